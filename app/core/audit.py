@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app import crud
+from app.core.config import Settings
+from app.core.database import AsyncSessionLocal
+from app.core.metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+settings = Settings()
+
+
+class AuditWriter:
+    """
+    Collects audit entries on a bounded queue and writes them in bulk
+    INSERTs, flushing every `flush_interval` seconds or `batch_size` rows,
+    whichever comes first. When the queue is full new entries are dropped
+    and counted rather than slowing down the request that produced them.
+    """
+
+    def __init__(
+        self,
+        max_queue: int,
+        batch_size: int,
+        flush_interval: float,
+        session_factory: async_sessionmaker[AsyncSession] = AsyncSessionLocal,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.session_factory = session_factory
+        self._queue: asyncio.Queue[dict] = asyncio.Queue(max_queue)
+        self._task: Optional[asyncio.Task] = None
+        # entries taken off the queue but not yet handed to a flush, and the
+        # flush in progress; stop() finishes both so nothing is lost
+        self._batch: list[dict] = []
+        self._flushing: Optional[asyncio.Future] = None
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_ms = None
+        self.max_flush_ms = 0.0
+
+    def enqueue(self, entry: dict):
+        try:
+            self._queue.put_nowait(entry)
+            self.enqueued += 1
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"Audit queue full, {self.dropped} entries dropped")
+
+    async def _collect(self):
+        self._batch.append(await self._queue.get())
+        deadline = time.monotonic() + self.flush_interval
+        while len(self._batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                self._batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    async def flush(self, batch: list[dict]):
+        start = time.perf_counter()
+        try:
+            async with self.session_factory() as session:
+                await crud.add_audits(session, batch)
+                await session.commit()
+            self.written += len(batch)
+        except SQLAlchemyError as e:
+            # a batch that can't be written is dropped, not retried forever
+            self.failed += len(batch)
+            logger.error(f"DataBase error writing {len(batch)} audit entries: {e}")
+        except Exception:
+            # anything escaping here would end run() and with it all auditing
+            self.failed += len(batch)
+            logger.exception(f"Error writing {len(batch)} audit entries")
+        finally:
+            self.flushes += 1
+            self.last_flush_ms = round((time.perf_counter() - start) * 1000, 1)
+            self.max_flush_ms = max(self.max_flush_ms, self.last_flush_ms)
+
+    async def run(self):
+        while True:
+            await self._collect()
+            batch, self._batch = self._batch, []
+            self._flushing = asyncio.ensure_future(self.flush(batch))
+            # cancelling the writer must not abort a half-done INSERT
+            await asyncio.shield(self._flushing)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run(), name="audit_writer")
+
+    async def stop(self):
+        """Stops the writer and flushes whatever is still queued."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._flushing is not None:
+            await self._flushing
+            self._flushing = None
+        await self.drain()
+
+    async def drain(self):
+        batch, self._batch = self._batch, []
+        while True:
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if not batch:
+                break
+            await self.flush(batch)
+            batch = []
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_size": self._queue.maxsize,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "written": self.written,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": self.max_flush_ms,
+        }
+
+
+audit_writer = AuditWriter(
+    settings.audit_queue_size,
+    settings.audit_batch_size,
+    settings.audit_flush_interval_ms / 1000,
+)
+register_metrics("audit_writer", audit_writer.stats)
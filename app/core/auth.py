@@ -1,7 +1,11 @@
-from fastapi import Depends, HTTPException, status
+import hashlib
+import time
+import uuid
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
+from fastapi.security.utils import get_authorization_scheme_param
 from jose import jwt
-from jose.exceptions import JWTError, ExpiredSignatureError
+from jose.exceptions import JWTError
 from app.core.config import Settings
 from datetime import datetime, timedelta, timezone
 from typing import Optional
@@ -9,9 +13,13 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 from app import crud
 from app.utils import generate_admin_id
+from app.core.cache import principal_cache, token_cache
 from app.core.database import get_session
 from app.models import User
+from app.schemas.user import Principal
 from passlib.context import CryptContext
+from app.core.hashing import HashingPoolFull, hashing_pool
+from app.core.revocation import revoked_tokens
 
 settings = Settings()
 
@@ -34,12 +42,31 @@ token_expire_exception = HTTPException(
             detail='Token has expired. Please login again'
         )
 
+hashing_busy_exception = HTTPException(
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='Server is busy. Please try again shortly',
+            headers={'Retry-After': '1'}
+        )
+
 def hash_password(password: str):
     return pwd_context.hash(password)
 
 def verify_password(plain_password: str, hashed_password: str):
     return pwd_context.verify(plain_password, hashed_password)
 
+# request paths use these so hashing never runs on the event loop
+async def hash_password_async(password: str):
+    try:
+        return await hashing_pool.run(hash_password, password)
+    except HashingPoolFull:
+        raise hashing_busy_exception
+
+async def verify_password_async(plain_password: str, hashed_password: str):
+    try:
+        return await hashing_pool.run(verify_password, plain_password, hashed_password)
+    except HashingPoolFull:
+        raise hashing_busy_exception
+
 def create_access_token(data: dict, user: User, expires_delta: Optional[timedelta] = None):
     role = None
     to_encode = data.copy()
@@ -53,14 +80,69 @@ def create_access_token(data: dict, user: User, expires_delta: Optional[timedelt
         role = 'staff'
     else:
         role = 'user'
-    to_encode.update({'exp': expire, 'role': role})
+    to_encode.update({'exp': expire, 'role': role, 'jti': uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, JWT_ALGORITHM)
     return encoded_jwt
 
+def create_refresh_token(user: User):
+    expire = datetime.now(timezone.utc) + timedelta(days=settings.refresh_token_expire_days)
+    to_encode = {
+        'sub': user.email,
+        'user_uid': user.user_uid,
+        'type': 'refresh',
+        'exp': expire,
+        'jti': uuid.uuid4().hex
+    }
+    return jwt.encode(to_encode, SECRET_KEY, JWT_ALGORITHM)
+
 def decode_token(token: str, verify_exp: bool=True):
     payload = jwt.decode(token, SECRET_KEY, 
                          algorithms=[JWT_ALGORITHM], options={'verify_exp': verify_exp})
     return payload
+
+async def verify_token(token: str):
+    """
+    Signature-checked payload of `token` (expiry is not checked), or None.
+    Verified payloads are cached by token digest so a token is only
+    verified once while it stays in the cache.
+    """
+    key = hashlib.sha256(token.encode()).hexdigest()
+    payload = await token_cache.get(key)
+    if payload is None:
+        try:
+            payload = decode_token(token, verify_exp=False)
+        except JWTError as e:
+            print(f'JWTError: {e}')
+            return None
+        await token_cache.set(key, payload)
+    return payload
+
+class AuthContext:
+    """The request's bearer token and its verified claims."""
+
+    __slots__ = ('token', 'claims', 'expired')
+
+    def __init__(self, token: Optional[str], claims: Optional[dict]):
+        self.token = token
+        self.claims = claims
+        self.expired = bool(claims) and claims.get('exp', 0) <= time.time()
+
+async def get_auth_context(request: Request) -> AuthContext:
+    """
+    Decodes the bearer token once per request; the audit middleware and the
+    auth dependencies share the result through request.state.
+    """
+    context = getattr(request.state, 'auth', None)
+    if context is None:
+        scheme, token = get_authorization_scheme_param(
+            request.headers.get('Authorization')
+        )
+        if scheme.lower() != 'bearer' or not token:
+            token = None
+        claims = await verify_token(token) if token else None
+        context = AuthContext(token, claims)
+        request.state.auth = context
+    return context
     
 async def authenticate_user(
         credentials: dict,
@@ -73,15 +155,42 @@ async def authenticate_user(
         user_email = credentials['email']
         
         user = await crud.get_user_by_email(db, user_email)
+        # hand the connection back to the pool while the hash is checked
+        await db.commit()
         print(user)
-        if not user or not verify_password(user_password, user.password):
+        if not user or not await verify_password_async(user_password, user.password):
             exceptions.append(credentials_exception)
+    except HTTPException as e:
+        exceptions.append(e)
     except Exception as e:
         print(f'Error: {e}')
     finally:
         return user, exceptions
 
+async def is_token_revoked(db: AsyncSession, payload: dict):
+    jti = payload.get('jti')
+    # tokens issued before revocation existed have no jti and can't be revoked
+    if not jti or not revoked_tokens.might_be_revoked(jti):
+        return False
+    revoked = await crud.is_token_revoked(db, jti)
+    if revoked:
+        revoked_tokens.confirmed += 1
+    return revoked
+
+async def get_principal(db: AsyncSession, email: str):
+    principal = await principal_cache.get(email)
+    if principal is None:
+        user = await crud.get_user_by_email(db, email)
+        if user:
+            principal = Principal.model_validate(user)
+            await principal_cache.set(email, principal)
+    return principal
+
+async def invalidate_principal(email: str):
+    await principal_cache.delete(email)
+
 async def get_current_user(
+        request: Request,
         token: str=Depends(oauth2_scheme), 
         db: AsyncSession=Depends(get_session)
         ):
@@ -89,21 +198,24 @@ async def get_current_user(
     user = None
     role = ''
     try:
-        payload = decode_token(token)
-        email = payload.get('sub')
-        #user_uid = payload.get('user_uid')
-        role = payload.get('role')
-        if not email:
+        context = await get_auth_context(request)
+        payload = context.claims
+        if payload is None or payload.get('type') == 'refresh':
+            exceptions.append(credentials_exception)
+        elif context.expired:
             exceptions.append(token_expire_exception)
-        else:
-            user = await crud.get_user_by_email(db, email)
-        if not user:
+        elif await is_token_revoked(db, payload):
             exceptions.append(credentials_exception)
-    except ExpiredSignatureError:
-        exceptions.append(token_expire_exception)
-    except JWTError as e:
-        print(f'JWTError: {e}')
-        exceptions.append(credentials_exception)
+        else:
+            email = payload.get('sub')
+            #user_uid = payload.get('user_uid')
+            role = payload.get('role')
+            if not email:
+                exceptions.append(token_expire_exception)
+            else:
+                user = await get_principal(db, email)
+            if not user:
+                exceptions.append(credentials_exception)
     finally:
         return user, role, exceptions
 
@@ -0,0 +1,106 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Protocol
+
+from app.core.config import Settings
+from app.core.metrics import register_metrics
+
+settings = Settings()
+
+
+class CacheBackend(Protocol):
+    """
+    What the services expect from a cache. `LRUCache` is the in-process
+    default; a shared store only has to provide these methods to replace it.
+    """
+
+    async def get(self, key: str) -> Optional[Any]: ...
+
+    async def set(self, key: str, value: Any) -> None: ...
+
+    async def delete(self, key: str) -> None: ...
+
+    async def clear(self) -> None: ...
+
+    def stats(self) -> dict: ...
+
+
+class LRUCache:
+    """
+    Size bounded LRU with a per-entry TTL. A `maxsize` of 0 turns it into a
+    no-op so caching can be switched off from settings.
+    """
+
+    def __init__(
+        self, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value = item
+        if expires_at <= self._clock():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    async def set(self, key: str, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (self._clock() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    async def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# BookResponse-shaped dicts keyed by ISBN, filled by get_book_by_isbn_service
+book_cache: CacheBackend = LRUCache(
+    settings.book_cache_size, settings.book_cache_ttl_seconds
+)
+register_metrics("book_cache", book_cache.stats)
+
+# Principal schemas keyed by token subject, filled by get_current_user
+principal_cache: CacheBackend = LRUCache(
+    settings.principal_cache_size, settings.principal_cache_ttl_seconds
+)
+register_metrics("principal_cache", principal_cache.stats)
+
+# verified JWT payloads keyed by token digest, filled by verify_token; an
+# entry never outlives the longest token it can hold
+token_cache: CacheBackend = LRUCache(
+    settings.token_cache_size, settings.access_token_expire_minutes * 60
+)
+register_metrics("token_cache", token_cache.stats)
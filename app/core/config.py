@@ -1,3 +1,4 @@
+from pydantic import PositiveFloat
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -13,9 +14,55 @@ class Settings(BaseSettings):
     jwt_algorithm: str = ''
     secret_key: str = ''
     access_token_expire_minutes: int = 15
+    refresh_token_expire_days: int = 7
 
     test_mode: bool = False
 
+    import_batch_size: int = 5000
+    import_report_limit: int = 1000
+
+    book_cache_size: int = 10000
+    book_cache_ttl_seconds: float = 300
+    principal_cache_size: int = 10000  # 0 disables the cache
+    # only crud.update_user drops entries early, any other change to a
+    # user's status or role can take this long to reach a cached principal
+    principal_cache_ttl_seconds: float = 30
+    token_cache_size: int = 10000  # 0 disables the cache
+
+    batch_fetch_max_isbns: int = 500
+
+    max_active_loans: int = 3
+    max_fine_balance: float = 10
+    late_fee_per_day: int = 100
+    bulk_return_max_items: int = 5000
+
+    # background jobs, an interval of 0 disables the job
+    overdue_sweep_interval_seconds: float = 3600
+    overdue_sweep_batch_size: int = 1000
+    schedule_expiry_interval_seconds: float = 300
+    schedule_expiry_batch_size: int = 1000
+    # unclaimed schedules are released at this hour (UTC)
+    schedule_cutoff_hour: int = 18
+    # time a patron gets to collect a copy allocated from the hold queue
+    hold_pickup_hours: int = 48
+    user_counter_reconcile_interval_seconds: float = 86400
+    user_counter_reconcile_batch_size: int = 5000
+    hashing_workers: int = 0  # 0 -> one per CPU, capped at 4
+    hashing_max_pending: int = 64
+    login_email_burst: int = 5  # 0 disables the limit
+    # refill rates must be above 0, a burst of 0 is how a limit is turned off
+    login_email_per_minute: PositiveFloat = 5
+    login_ip_burst: int = 20  # 0 disables the limit
+    login_ip_per_minute: PositiveFloat = 30
+    login_throttle_max_buckets: int = 10000
+    revocation_filter_capacity: int = 100000
+    revocation_filter_error_rate: float = 0.01
+    revocation_sync_interval_seconds: float = 60
+    audit_queue_size: int = 10000
+    audit_batch_size: int = 500
+    audit_flush_interval_ms: float = 200
+    audit_form_max_bytes: int = 4096
+
     mock_admin_email: str = ''
     mock_admin_password: str = ''
     mock_admin_name: str = ''
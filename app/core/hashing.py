@@ -0,0 +1,86 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from app.core.config import Settings
+from app.core.metrics import register_metrics
+
+settings = Settings()
+
+
+class HashingPoolFull(Exception):
+    """More hashing work is waiting than the pool accepts."""
+
+
+class HashingPool:
+    """
+    Runs password hashing (argon2/bcrypt, both release the GIL) on a small
+    dedicated thread pool so a burst of logins queues there instead of
+    stalling the event loop. At most `max_pending` calls may be queued or
+    running; past that `run` fails fast with HashingPoolFull.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        # threads beyond the core count only compete with the event loop
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.max_pending = max_pending
+        self._executor = None
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_ms_total = 0.0
+        self.hash_ms_total = 0.0
+        self.max_wait_ms = 0.0
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        if self.in_flight >= self.max_pending:
+            self.rejected += 1
+            raise HashingPoolFull()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="hashing"
+            )
+        submitted = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            return func(*args), started, time.perf_counter()
+
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result, started, finished = await loop.run_in_executor(
+                self._executor, timed
+            )
+        finally:
+            self.in_flight -= 1
+        wait_ms = (started - submitted) * 1000
+        self.completed += 1
+        self.wait_ms_total += wait_ms
+        self.hash_ms_total += (finished - started) * 1000
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        done = self.completed or 1
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.wait_ms_total / done, 2),
+            "max_wait_ms": round(self.max_wait_ms, 2),
+            "avg_hash_ms": round(self.hash_ms_total / done, 2),
+        }
+
+
+hashing_pool = HashingPool(settings.hashing_workers, settings.hashing_max_pending)
+register_metrics("hashing", hashing_pool.stats)
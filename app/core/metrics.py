@@ -0,0 +1,12 @@
+from typing import Callable, Dict
+
+# name -> zero-arg callable returning a dict of counters, read by /metrics
+_collectors: Dict[str, Callable[[], dict]] = {}
+
+
+def register_metrics(name: str, collector: Callable[[], dict]):
+    _collectors[name] = collector
+
+
+def collect_metrics() -> dict:
+    return {name: collector() for name, collector in _collectors.items()}
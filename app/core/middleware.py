@@ -2,27 +2,39 @@ import json
 import time
 from datetime import datetime
 from logging import getLogger
-from typing import Any, Awaitable, Callable, Dict
+from typing import Any, Dict, List
 from urllib.parse import parse_qs
 
-from fastapi import BackgroundTasks, Request
-from jose.exceptions import JWTError
-from jwt.exceptions import InvalidSignatureError
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request as StarletteRequest
-from starlette.responses import Response
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from app.core.auth import decode_token
-from app.core.database import AsyncSessionLocal
+from app.core.auth import get_auth_context
+from app.core.audit import audit_writer
+from app.core.config import Settings
 from app.models import Event, User
-from app.services import create_audit_service
 
 logger = getLogger(__name__)
 
+settings = Settings()
 
-async def _bg_audit(entry: dict):
-    async with AsyncSessionLocal() as session:
-        await create_audit_service(session, entry)
+# events whose form fields go into the audit entry
+FORM_EVENTS = frozenset(
+    {
+        Event.CHECKOUT,
+        Event.RETURN_BOOK,
+        Event.CREATE_BOOK,
+        Event.UPDATE_BOOK,
+        Event.CREATE_BK_COPIES,
+        Event.CREATE_USER,
+        Event.LOGIN_USER,
+        Event.LOGIN_ADMIN_USER,
+        Event.REFRESH_TOKEN,
+        Event.LOGOUT_USER,
+    }
+)
+
+SECRET_FORM_FIELDS = frozenset({"password", "refresh_token"})
 
 
 def actor_email(actor, claims):
@@ -64,71 +76,142 @@ def actor_id(actor, claims):
     return -1
 
 
-def get_actor_claims(token: str):
-    try:
-        payload = decode_token(token, False)
-        email = payload.get("sub")
-        user_uid = payload.get("user_uid")
-        is_staff = payload.get("is_staff")
-        return {
-            "email": email,
-            "user_uid": user_uid,
-            "is_staff": is_staff,
-        }
-    except (InvalidSignatureError, JWTError) as e:
-        logger.error(f"Token decode error: {e}")
-        return None
-    except Exception as e:
-        logger.error(f"Unexpected token error: {e}")
+def get_actor_claims(payload: dict | None):
+    if not payload:
         return None
+    return {
+        "email": payload.get("sub"),
+        "user_uid": payload.get("user_uid"),
+        "is_staff": payload.get("is_staff"),
+    }
 
 
-async def extract_form_data(request: Request) -> Dict[str, Any]:
-    """
-    Safely extract form fields (urlencoded or multipart) from `request`
-    without preventing downstream code (FastAPI/Dependencies) from reading
-    the body. Returns a dict where repeated fields become lists and file
-    uploads are returned as UploadFile instances.
-    """
-    # snapshot body
-    body = await request.body()
+def visible_fields(parsed: Dict[str, List[str]]) -> Dict[str, Any]:
+    # repeated fields become lists
+    return {
+        k: (v if len(v) > 1 else v[0])
+        for k, v in parsed.items()
+        if k not in SECRET_FORM_FIELDS
+    }
 
-    # restore mechanism so downstream can read the same body again
-    async def _receive() -> dict:
-        return {"type": "http.request", "body": body, "more_body": False}
 
-    request._receive = _receive
+class FormCapture:
+    """
+    Copies an urlencoded request body as the app reads it, keeping at most
+    `max_bytes`. Nothing is read ahead of the app, and the copy is only
+    parsed when the audit entry is built.
+    """
 
-    content_type = (request.headers.get("content-type") or "").lower()
+    def __init__(self, receive: Receive, max_bytes: int):
+        self._receive = receive
+        self.max_bytes = max_bytes
+        self._chunks: list[bytes] = []
+        self._size = 0
+        self.truncated = False
+
+    async def receive(self) -> Message:
+        message = await self._receive()
+        if message["type"] == "http.request" and not self.truncated:
+            self.feed(message.get("body", b""))
+        return message
+
+    def feed(self, body: bytes):
+        room = self.max_bytes - self._size
+        if len(body) > room:
+            self.truncated = True
+            body = body[:room]
+        if body:
+            self._chunks.append(body)
+            self._size += len(body)
+
+    def fields(self) -> Dict[str, Any]:
+        body = b"".join(self._chunks)
+        if self.truncated:
+            # the last field may have been cut off
+            body = body.rpartition(b"&")[0]
+        parsed = parse_qs(body.decode("utf-8", "replace"), keep_blank_values=True)
+        return visible_fields(parsed)
+
+
+class _StopCapture(Exception):
+    pass
+
+
+class MultipartCapture(FormCapture):
+    """
+    FormCapture for multipart/form-data bodies. Chunks go through a
+    streaming multipart parser as the app reads them and only the plain
+    fields are kept, up to `max_bytes` of names and values. Parsing stops
+    at the first file part, as the parser would otherwise walk every byte
+    of the upload; fields after it are not captured.
+    """
 
-    # application/x-www-form-urlencoded
-    if "application/x-www-form-urlencoded" in content_type:
-        decoded = body.decode("utf-8") if body else ""
-        parsed = parse_qs(decoded, keep_blank_values=True)
-        # convert single-item lists to scalars
-        data: Dict[str, Any] = {
-            k: (v if len(v) > 1 else v[0]) for k, v in parsed.items()
-        }
-        return data
-
-    # multipart/form-data (files supported) - parse with a temporary Starlette Request
-    if "multipart/form-data" in content_type:
-        # create a temporary Starlette request that reads from our saved body
-        temp_scope = dict(request.scope)
-        temp_req = StarletteRequest(temp_scope, _receive)
-        form = await temp_req.form()
-        data: Dict[str, Any] = {}
-        for key, val in form.multi_items():
-            if key not in data:
-                data[key] = val
-            else:
-                if not isinstance(data[key], list):
-                    data[key] = [data[key]]
-                data[key].append(val)
-        return data
-
-    # no form data or unsupported content-type
-    return {}
+    def __init__(self, receive: Receive, max_bytes: int, boundary: bytes):
+        super().__init__(receive, max_bytes)
+        self._fields: Dict[str, List[str]] = {}
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._name = None
+        self._value = bytearray()
+        self._parser = MultipartParser(
+            boundary,
+            callbacks={
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+            },
+        )
+
+    def feed(self, body: bytes):
+        try:
+            self._parser.write(body)
+        except _StopCapture:
+            self.truncated = True
+        except Exception as e:
+            # the app rejects a malformed body itself, keep what was parsed
+            logger.debug(f"Stopped capturing multipart form: {e}")
+            self.truncated = True
+
+    def _on_part_begin(self):
+        self._name = None
+        self._value.clear()
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        if self._header_field.lower() == b"content-disposition":
+            _, options = parse_options_header(bytes(self._header_value))
+            if b"filename" in options:
+                raise _StopCapture
+            self._name = options.get(b"name", b"").decode("utf-8", "replace")
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._name is not None:
+            self._value += data[start:end]
+            if self._size + len(self._name) + len(self._value) > self.max_bytes:
+                # the field is cut off, it is left out like a cut off
+                # urlencoded field and nothing after it is kept
+                self.truncated = True
+                self._name = None
+
+    def _on_part_end(self):
+        if self._name is None or self.truncated:
+            return
+        self._size += len(self._name) + len(self._value)
+        value = self._value.decode("utf-8", "replace")
+        self._fields.setdefault(self._name, []).append(value)
+
+    def fields(self) -> Dict[str, Any]:
+        return visible_fields(self._fields)
 
 
 def detect_event_from_request(request: Request) -> Event:
@@ -136,100 +219,167 @@ def detect_event_from_request(request: Request) -> Event:
     method = request.method.upper()
 
     # Book-related
+    if path.startswith("/books/loan-returns") and method == "POST":
+        return Event.BULK_RETURN
     if path.startswith("/books/loan-return") and method == "POST":
         return Event.RETURN_BOOK
+    if path.startswith("/books/loan-books") and method == "POST":
+        return Event.BULK_CHECKOUT
     if path.startswith("/books/loan") and method == "POST":
         return Event.CHECKOUT
     if path.startswith("/books/generate-copies") and method == "POST":
         return Event.CREATE_BK_COPIES
+    if path.startswith("/books/holds/") and method == "GET":
+        return Event.FETCH_HOLD_POSITION
     if path.startswith("/books/book-schedule") and method == "POST":
         return Event.SCHEDULE_BOOK
     if path == "/books" and method == "POST":
         return Event.CREATE_BOOK
+    if path.startswith("/books/import") and method == "POST":
+        return Event.IMPORT_BOOKS
     if path.startswith("/books/") and method == "PUT":
         return Event.UPDATE_BOOK
     if path.startswith("/books/update-bk-copies-status") and method == "PATCH":
         return Event.UPDATE_BOOK_COPIES
+    if path.startswith("/books/reconcile-availability") and method == "POST":
+        return Event.RECONCILE_AVAILABILITY
+    if path.startswith("/books/rebuild-search-index") and method == "POST":
+        return Event.REBUILD_SEARCH_INDEX
+    if path.startswith("/books/expire-schedules") and method == "POST":
+        return Event.EXPIRE_SCHEDULES
+    if path.startswith("/books/sweep-overdue") and method == "POST":
+        return Event.SWEEP_OVERDUE
     if path.startswith("/books/fetch") and method == "GET":
         return Event.FETCH_BOOK
+    if path.startswith("/books/fetch-batch") and method == "POST":
+        return Event.FETCH_BOOKS_BATCH
+    if path == "/books" and method == "GET":
+        return Event.LIST_BOOKS
+    if path.startswith("/books/search") and method == "GET":
+        return Event.SEARCH_BOOKS
+    if path.startswith("/books/export") and method == "GET":
+        return Event.EXPORT_CATALOG
 
     # User-related
     if path.startswith("/users/sign-up") and method == "POST":
         return Event.CREATE_USER
+    if path.startswith("/users/create-staff-user") and method == "POST":
+        return Event.CREATE_USER
     if path.startswith("/users/login") and method == "POST":
         return Event.LOGIN_USER
     if path.startswith("/users/admin/login") and method == "POST":
         return Event.LOGIN_ADMIN_USER
+    if path.startswith("/users/refresh") and method == "POST":
+        return Event.REFRESH_TOKEN
+    if path.startswith("/users/logout") and method == "POST":
+        return Event.LOGOUT_USER
+    if path.startswith("/users/reconcile-counters") and method == "POST":
+        return Event.RECONCILE_USER_COUNTERS
+    if path.startswith("/users/") and path.endswith("/loans") and method == "GET":
+        return Event.FETCH_LOAN_HISTORY
     if path == "/users" and method == "GET":
         return Event.FETCH_USER
 
-    return Event.UNIDENTIFIED_EVENT
-
+    if path == "/metrics" and method == "GET":
+        return Event.FETCH_METRICS
 
-class AuditMiddleware(BaseHTTPMiddleware):
-    async def dispatch(
-        self, request: Request, call_next: Callable[[Request], Awaitable[Response]]
-    ) -> Response:
-        start_time = time.time()
-        token = None
-        actor = None
-        claims = None
-        event_type = detect_event_from_request(request)
+    return Event.UNIDENTIFIED_EVENT
 
-        form_data = await extract_form_data(request)
-        if "password" in form_data.keys():
-            del form_data["password"]
 
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header[7:]
+class AuditMiddleware:
+    """
+    Records one audit entry per HTTP request. Written as plain ASGI so the
+    request and response stream straight through; only form events have
+    their urlencoded or multipart fields copied, and only up to
+    `max_form_bytes`.
+    """
 
-        if token:
-            claims = get_actor_claims(token)
+    def __init__(
+        self, app: ASGIApp, max_form_bytes: int = settings.audit_form_max_bytes
+    ):
+        self.app = app
+        self.max_form_bytes = max_form_bytes
 
-        response = await call_next(request)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-        if hasattr(request.state, "actor"):
-            actor = getattr(request.state, "actor", None)
+        start_time = time.time()
+        request = Request(scope)
+        event_type = detect_event_from_request(request)
 
-        response.background = BackgroundTasks()
+        capture = None
+        if event_type in FORM_EVENTS:
+            content_type, options = parse_options_header(
+                request.headers.get("content-type", "")
+            )
+            content_type = content_type.lower()
+            if content_type == b"application/x-www-form-urlencoded":
+                capture = FormCapture(receive, self.max_form_bytes)
+            elif content_type == b"multipart/form-data" and options.get(b"boundary"):
+                capture = MultipartCapture(
+                    receive, self.max_form_bytes, options[b"boundary"]
+                )
+        if capture is not None:
+            receive = capture.receive
+
+        # decoded once here; get_current_user reuses it from request.state
+        auth = await get_auth_context(request)
+
+        status_code = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            try:
+                self.audit(
+                    request, event_type, auth.claims, capture, status_code, start_time
+                )
+            except Exception as e:
+                # auditing must never turn into a failed request
+                logger.error(f"Error recording audit entry: {e}")
+
+    def audit(self, request, event_type, payload, capture, status_code, start_time):
+        actor = getattr(request.state, "actor", None)
+        claims = get_actor_claims(payload)
 
         if event_type == Event.UNIDENTIFIED_EVENT:
             logger.warning("Unidentified event detected")
 
-        success = response.status_code < 400
-
         extra_details = {
             "timestamp": datetime.now().isoformat(),
             "request_url": f"{request.url}",
             "actor_email": actor_email(actor, claims),
             "is_staff": actor_is_staff(actor, claims),
             "latency": f"{round((time.time() - start_time) * 1000, 2)} ms",
-            "status_code": response.status_code,
+            "status_code": status_code,
         }
 
         if hasattr(request.state, "msg"):
             msg: dict = getattr(request.state, "msg", {})
             extra_details.update({"msg": msg.get("message", None)})
 
-        if form_data:
-            extra_details.update({"form": form_data})
+        if capture is not None:
+            form_data = capture.fields()
+            if form_data:
+                extra_details.update({"form": form_data})
+            if capture.truncated:
+                extra_details.update({"form_truncated": True})
 
         audit_entry = {
-            "actor_id": actor_id(actor, claims),
-            "success": success,
+            # one batch shares an INSERT, keep the column type uniform
+            "actor_id": str(actor_id(actor, claims)),
+            "success": status_code < 400,
             "event": event_type,
-            "details": json.dumps(extra_details),
+            "details": json.dumps(extra_details, default=str),
         }
 
-        if response.background is None:
-            tasks = BackgroundTasks()
-            tasks.add_task(_bg_audit, audit_entry)
-            response.background = tasks
-        else:
-            response.background.add_task(_bg_audit, audit_entry)
-        return response
-
-    # avoid calling get_session() in middleware
-    # instead use a function that safely opens / closes, a db session and does the functionality
-    # add that function to the background tasks instead
+        # written in bulk by the audit writer, never on the request path
+        audit_writer.enqueue(audit_entry)
@@ -0,0 +1,96 @@
+import hashlib
+import math
+from typing import Iterable
+
+from app.core.config import Settings
+from app.core.metrics import register_metrics
+
+settings = Settings()
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings, sized for `capacity` items at
+    `error_rate` false positives. It never gives false negatives.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(
+            8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        # double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item)
+        )
+
+
+class RevocationFilter:
+    """
+    In-memory view of the revoked access tokens. A token id that is not in
+    the filter is certainly not revoked, so only filter hits need a
+    database lookup to confirm. Refresh tokens are rare to check and
+    revoked on every rotation, so they are looked up directly instead. The
+    filter is rebuilt from the table by the revocation_sync job, which also
+    picks up tokens revoked by other workers and forgets expired ones.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._filter = BloomFilter(capacity, error_rate)
+        # revocations since the last rebuild, so one that commits while the
+        # table is being read isn't lost when the new filter is swapped in
+        self._recent: list[str] = []
+        self.checks = 0
+        self.filter_hits = 0
+        self.confirmed = 0
+
+    def add(self, jti: str):
+        self._filter.add(jti)
+        self._recent.append(jti)
+
+    def rebuild(self, jtis: Iterable[str]):
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        for jti in set(jtis).union(self._recent):
+            bloom.add(jti)
+        self._filter = bloom
+        self._recent = []
+
+    def might_be_revoked(self, jti: str) -> bool:
+        self.checks += 1
+        if jti in self._filter:
+            self.filter_hits += 1
+            return True
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "entries": self._filter.count,
+            "capacity": self.capacity,
+            "size_bytes": len(self._filter._bits),
+            "checks": self.checks,
+            "filter_hits": self.filter_hits,
+            "confirmed": self.confirmed,
+        }
+
+
+revoked_tokens = RevocationFilter(
+    settings.revocation_filter_capacity, settings.revocation_filter_error_rate
+)
+register_metrics("revoked_tokens", revoked_tokens.stats)
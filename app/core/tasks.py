@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import AsyncSessionLocal
+from app.core.metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+JobFunc = Callable[[AsyncSession], Awaitable[dict]]
+
+
+class PeriodicJob:
+    """
+    Runs `func` with a fresh session every `interval` seconds until
+    cancelled. A failed run is logged and counted, the next one still
+    happens on schedule.
+    """
+
+    def __init__(self, name: str, interval: float, func: JobFunc):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.runs = 0
+        self.failures = 0
+        self.last_duration_ms = None
+        self.last_result: dict = {}
+
+    async def run_once(self) -> dict:
+        start = time.perf_counter()
+        try:
+            async with AsyncSessionLocal() as session:
+                self.last_result = await self.func(session)
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Job {self.name} failed: {e}")
+        finally:
+            self.runs += 1
+            self.last_duration_ms = round((time.perf_counter() - start) * 1000, 1)
+        return self.last_result
+
+    async def run_forever(self):
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {
+            "interval_seconds": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_duration_ms": self.last_duration_ms,
+            "last_result": self.last_result,
+        }
+
+
+_jobs: Dict[str, PeriodicJob] = {}
+_running: List[asyncio.Task] = []
+
+
+def register_job(name: str, interval: float, func: JobFunc):
+    """Jobs with a non-positive interval are left disabled."""
+    if interval > 0:
+        _jobs[name] = PeriodicJob(name, interval, func)
+
+
+def start_jobs():
+    for job in _jobs.values():
+        _running.append(asyncio.create_task(job.run_forever(), name=job.name))
+
+
+async def stop_jobs():
+    for task in _running:
+        task.cancel()
+    await asyncio.gather(*_running, return_exceptions=True)
+    _running.clear()
+
+
+register_metrics("jobs", lambda: {name: job.stats() for name, job in _jobs.items()})
@@ -0,0 +1,138 @@
+import math
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Protocol
+
+from app.core.config import Settings
+from app.core.metrics import register_metrics
+
+settings = Settings()
+
+
+class ThrottleBackend(Protocol):
+    """
+    Where token buckets live. `TokenBucketStore` keeps them in process; a
+    shared store (e.g. Redis) only has to provide these methods to give all
+    workers one view of each bucket.
+    """
+
+    async def peek(self, key: str, capacity: int, per_second: float) -> float: ...
+
+    async def take(self, key: str, capacity: int, per_second: float) -> float: ...
+
+    async def clear(self) -> None: ...
+
+    def stats(self) -> dict: ...
+
+
+class TokenBucketStore:
+    """
+    Token buckets keyed by caller, at most `maxsize` of them; the least
+    recently used bucket is dropped first. A dropped bucket simply starts
+    full again, so eviction can only make throttling more lenient.
+    """
+
+    def __init__(self, maxsize: int, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self._clock = clock
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self.evictions = 0
+
+    def _refill(self, key: str, capacity: int, per_second: float, now: float) -> float:
+        tokens, updated = self._buckets.get(key, (capacity, now))
+        return min(capacity, tokens + (now - updated) * per_second)
+
+    async def peek(self, key: str, capacity: int, per_second: float) -> float:
+        """Like `take`, but leaves the bucket untouched."""
+        tokens = self._refill(key, capacity, per_second, self._clock())
+        return 0.0 if tokens >= 1 else (1 - tokens) / per_second
+
+    async def take(self, key: str, capacity: int, per_second: float) -> float:
+        """
+        Takes one token from `key`'s bucket. Returns 0 when allowed,
+        otherwise the seconds until a token is available.
+        """
+        now = self._clock()
+        tokens = self._refill(key, capacity, per_second, now)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / per_second
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+            self.evictions += 1
+        return wait
+
+    async def clear(self) -> None:
+        self._buckets.clear()
+
+    def stats(self) -> dict:
+        return {
+            "buckets": len(self._buckets),
+            "maxsize": self.maxsize,
+            "evictions": self.evictions,
+        }
+
+
+class LoginThrottle:
+    """
+    Per-email and per-client-IP limits on login attempts, checked before
+    any user lookup or password hashing. A burst of 0 turns a limit off.
+    """
+
+    def __init__(self, store: ThrottleBackend):
+        self.store = store
+        self.allowed = 0
+        self.throttled_email = 0
+        self.throttled_ip = 0
+
+    async def check(self, email: str, ip: Optional[str]) -> Optional[int]:
+        """Returns None when the attempt may proceed, else a Retry-After."""
+        limits = []
+        if ip and settings.login_ip_burst > 0:
+            limits.append(
+                (
+                    "ip",
+                    f"ip:{ip}",
+                    settings.login_ip_burst,
+                    settings.login_ip_per_minute / 60,
+                )
+            )
+        if settings.login_email_burst > 0:
+            limits.append(
+                (
+                    "email",
+                    f"email:{email.lower()}",
+                    settings.login_email_burst,
+                    settings.login_email_per_minute / 60,
+                )
+            )
+        # every bucket is checked before any is charged, so an attempt
+        # refused by one limit doesn't use up the other
+        for kind, key, capacity, per_second in limits:
+            wait = await self.store.peek(key, capacity, per_second)
+            if wait:
+                if kind == "ip":
+                    self.throttled_ip += 1
+                else:
+                    self.throttled_email += 1
+                return math.ceil(wait)
+        for _, key, capacity, per_second in limits:
+            await self.store.take(key, capacity, per_second)
+        self.allowed += 1
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "allowed": self.allowed,
+            "throttled_email": self.throttled_email,
+            "throttled_ip": self.throttled_ip,
+            **self.store.stats(),
+        }
+
+
+login_throttle = LoginThrottle(TokenBucketStore(settings.login_throttle_max_buckets))
+register_metrics("login_throttle", login_throttle.stats)
@@ -1,7 +1,55 @@
-from sqlalchemy import select, desc
+from collections import Counter, defaultdict
+from sqlalchemy import (
+    bindparam,
+    case,
+    column,
+    delete,
+    desc,
+    func,
+    insert,
+    literal_column,
+    or_,
+    select,
+    table,
+    text,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.models import Book, BookCopy, User, Loan, BkCopySchedule, Audit, LoanStatus
-from typing import List, Set
+from app.models import (
+    BOOK_SEARCH_VECTOR,
+    BOOKS_FTS_DDL,
+    BOOKS_SEARCH_INDEX_DDL,
+    Book,
+    BookAvailability,
+    BookCopy,
+    BkCopyStatus,
+    User,
+    Loan,
+    BkCopySchedule,
+    Audit,
+    HoldRequest,
+    HoldStatus,
+    LoanStatus,
+    OPEN_LOAN_STATUSES,
+    RevokedToken,
+    ScheduleStatus,
+)
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# columns served by the catalog listing, keeps the page query off the full row
+BOOK_LIST_COLUMNS = (
+    Book.id,
+    Book.title,
+    Book.author,
+    Book.isbn,
+    Book.library_barcode,
+    Book.available,
+    Book.location,
+)
 
 
 async def get_book_by_id(db: AsyncSession, book_id: int):
@@ -16,11 +64,281 @@ async def get_book_by_barcode(db: AsyncSession, barcode: str):
 
 
 async def get_book_by_isbn(db: AsyncSession, bk_isbn: int):
-    stmt = select(Book).where(Book.isbn == bk_isbn)
+    # availability counts are maintained with core upserts, so make sure an
+    # already loaded instance picks up the current row
+    stmt = (
+        select(Book)
+        .where(Book.isbn == bk_isbn)
+        .execution_options(populate_existing=True)
+    )
     result = await db.execute(stmt)
     return result.scalar_one_or_none()
 
 
+async def get_books_page(
+    db: AsyncSession,
+    limit: int,
+    sort: str = "id",
+    after: Optional[int | str] = None,
+    author: Optional[str] = None,
+    location: Optional[str] = None,
+    available: Optional[bool] = None,
+):
+    """
+    Keyset page over `books` ordered by `sort` ("id" or the unique "title").
+    `after` is the sort key of the last row of the previous page. Fetches
+    `limit + 1` rows so the caller can tell whether another page exists.
+    """
+    sort_column = Book.title if sort == "title" else Book.id
+    stmt = select(*BOOK_LIST_COLUMNS)
+    if author is not None:
+        stmt = stmt.where(Book.author == author)
+    if location is not None:
+        stmt = stmt.where(Book.location == location)
+    if available is not None:
+        stmt = stmt.where(Book.available == available)
+    if after is not None:
+        stmt = stmt.where(sort_column > after)
+    stmt = stmt.order_by(sort_column).limit(limit + 1)
+    result = await db.execute(stmt)
+    return result.mappings().all()
+
+
+books_fts = table("books_fts", column("rowid"), column("title"), column("author"))
+
+
+def _dialect_name(db: AsyncSession) -> str:
+    return db.bind.dialect.name
+
+
+def _dialect_insert(db: AsyncSession):
+    return pg_insert if _dialect_name(db) == "postgresql" else sqlite_insert
+
+
+# book_availability column holding the count for each copy status
+AVAILABILITY_COLUMNS = {st: st.value.lower() for st in BkCopyStatus}
+
+
+def _copy_status(value) -> BkCopyStatus:
+    # unflushed copies carry no status yet, the column default applies
+    return BkCopyStatus(value) if value is not None else BkCopyStatus.AVAILABLE
+
+
+async def adjust_availability(db: AsyncSession, isbn: str, deltas: Dict):
+    """
+    Applies `deltas` ({BkCopyStatus: +/-n}) to the ISBN's availability row
+    in one upsert. ISBNs touched are collected in `db.info["stale_isbns"]`
+    so the services can drop them from the book cache after commit.
+    """
+    values = {AVAILABILITY_COLUMNS[st]: n for st, n in deltas.items() if n}
+    if not values:
+        return
+    counts = BookAvailability.__table__
+    stmt = _dialect_insert(db)(counts).values(book_isbn=isbn, **values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[counts.c.book_isbn],
+        set_={
+            **{col: counts.c[col] + stmt.excluded[col] for col in values},
+            "updated_at": func.now(),
+        },
+    )
+    await db.execute(stmt)
+    db.info.setdefault("stale_isbns", set()).add(isbn)
+
+
+async def track_status_changes(db: AsyncSession, changes: Iterable[Tuple]):
+    """`changes` holds (isbn, old_status, new_status) for every copy touched."""
+    deltas = defaultdict(Counter)
+    for isbn, old, new in changes:
+        old, new = _copy_status(old), _copy_status(new)
+        if old != new:
+            deltas[isbn][old] -= 1
+            deltas[isbn][new] += 1
+    for isbn, isbn_deltas in deltas.items():
+        await adjust_availability(db, isbn, isbn_deltas)
+
+
+async def rebuild_availability(db: AsyncSession):
+    """Recomputes every availability row from book_copies in one statement."""
+    counts = select(
+        BookCopy.book_isbn,
+        *[
+            func.sum(case((BookCopy.status == st, 1), else_=0)).label(col)
+            for st, col in AVAILABILITY_COLUMNS.items()
+        ],
+    ).group_by(BookCopy.book_isbn)
+    await db.execute(delete(BookAvailability))
+    result = await db.execute(
+        insert(BookAvailability).from_select(
+            ["book_isbn", *AVAILABILITY_COLUMNS.values()], counts
+        )
+    )
+    return result.rowcount
+
+
+async def sync_books_search(db: AsyncSession, books: List[dict]):
+    """
+    Mirrors title/author of `books` (dicts with id, title and author) into
+    the SQLite FTS5 table. Postgres indexes the expression directly so there
+    is nothing to do there.
+    """
+    if not books or _dialect_name(db) != "sqlite":
+        return
+    await db.execute(
+        text(
+            "INSERT OR REPLACE INTO books_fts(rowid, title, author) "
+            "VALUES (:id, :title, :author)"
+        ),
+        [
+            {"id": bk["id"], "title": bk["title"], "author": bk["author"]}
+            for bk in books
+        ],
+    )
+
+
+async def rebuild_books_search(db: AsyncSession) -> int:
+    """
+    Recreates the full-text index if it is missing and, on SQLite, refills
+    books_fts from every book, so books that predate it or drifted out of
+    step become searchable. Returns the number of books indexed.
+    """
+    if _dialect_name(db) != "sqlite":
+        await db.execute(text(BOOKS_SEARCH_INDEX_DDL))
+        return await db.scalar(select(func.count(Book.id)))
+    await db.execute(text(BOOKS_FTS_DDL))
+    await db.execute(delete(books_fts))
+    result = await db.execute(
+        text(
+            "INSERT INTO books_fts(rowid, title, author) "
+            "SELECT id, title, author FROM books"
+        )
+    )
+    return result.rowcount
+
+
+async def sync_book_search(db: AsyncSession, book: Book):
+    await sync_books_search(
+        db, [{"id": book.id, "title": book.title, "author": book.author}]
+    )
+
+
+async def bulk_insert_books(db: AsyncSession, rows: List[dict]):
+    """
+    Inserts `rows` with a single executemany, skipping any row that hits a
+    unique constraint. Returns id/isbn/title/author of the rows that went in.
+    """
+    books = Book.__table__
+    stmt = (
+        _dialect_insert(db)(books)
+        .on_conflict_do_nothing()
+        .returning(books.c.id, books.c.isbn, books.c.title, books.c.author)
+    )
+    result = await db.execute(stmt, rows)
+    return result.mappings().all()
+
+
+async def get_existing_titles_isbns(
+    db: AsyncSession, titles: Set[str], isbns: Set[str]
+):
+    stmt = select(Book.title, Book.isbn).where(
+        or_(Book.title.in_(titles), Book.isbn.in_(isbns))
+    )
+    result = await db.execute(stmt)
+    rows = result.all()
+    return {row.title for row in rows}, {row.isbn for row in rows}
+
+
+async def search_books(db: AsyncSession, terms: List[str], limit: int, offset: int = 0):
+    """
+    Ranked full-text search, best match first. Every term has to match,
+    the last one as a prefix so partially typed words still hit.
+    """
+    if _dialect_name(db) == "postgresql":
+        ts_query = func.to_tsquery(
+            literal_column("'simple'"), " & ".join(terms[:-1] + [f"{terms[-1]}:*"])
+        )
+        vector = literal_column(BOOK_SEARCH_VECTOR)
+        rank = func.ts_rank(vector, ts_query)
+        stmt = (
+            select(*BOOK_LIST_COLUMNS)
+            .where(vector.op("@@")(ts_query))
+            .order_by(rank.desc(), Book.id)
+        )
+    else:
+        match = " ".join(f'"{t}"' for t in terms[:-1])
+        match = f'{match} "{terms[-1]}"*'.strip()
+        stmt = (
+            select(*BOOK_LIST_COLUMNS)
+            .join(books_fts, books_fts.c.rowid == Book.id)
+            .where(literal_column("books_fts").op("MATCH")(match))
+            .order_by(func.bm25(literal_column("books_fts")), Book.id)
+        )
+    result = await db.execute(stmt.limit(limit + 1).offset(offset))
+    return result.mappings().all()
+
+
+async def stream_catalog(
+    db: AsyncSession, since: Optional[int] = None, yield_per: int = 1000
+):
+    """
+    Server-side cursor over every book joined to its copies, ordered by
+    book id so rows of one book arrive together. Rows are fetched
+    `yield_per` at a time, memory doesn't grow with the catalog.
+    """
+    stmt = (
+        select(
+            Book.__table__,
+            BookCopy.copy_barcode,
+            BookCopy.serial,
+            BookCopy.status.label("copy_status"),
+        )
+        .outerjoin(BookCopy, BookCopy.book_isbn == Book.isbn)
+        .order_by(Book.id, BookCopy.serial)
+        .execution_options(yield_per=yield_per)
+    )
+    if since is not None:
+        stmt = stmt.where(Book.id > since)
+    result = await db.stream(stmt)
+    return result.mappings()
+
+
+async def get_book_version(db: AsyncSession, isbn: int):
+    """
+    Just the columns that decide a book's ETag/Last-Modified, so conditional
+    requests can be answered without loading the row.
+    """
+    stmt = (
+        select(
+            Book.id,
+            Book.created_at,
+            Book.updated_at,
+            *[getattr(BookAvailability, col) for col in AVAILABILITY_COLUMNS.values()],
+            BookAvailability.updated_at.label("availability_updated_at"),
+        )
+        .outerjoin(BookAvailability, BookAvailability.book_isbn == Book.isbn)
+        .where(Book.isbn == isbn)
+    )
+    result = await db.execute(stmt)
+    return result.mappings().one_or_none()
+
+
+# stays under SQLite's historical 999 bound-parameter limit
+IN_CLAUSE_CHUNK_SIZE = 900
+
+
+async def get_books_by_isbns(db: AsyncSession, isbns: List[str]):
+    books = []
+    for i in range(0, len(isbns), IN_CLAUSE_CHUNK_SIZE):
+        stmt = (
+            select(Book)
+            .where(Book.isbn.in_(isbns[i : i + IN_CLAUSE_CHUNK_SIZE]))
+            .execution_options(populate_existing=True)
+        )
+        result = await db.execute(stmt)
+        books.extend(result.unique().scalars().all())
+    return books
+
+
 async def get_last_book_copy(db: AsyncSession, book: Book):
     stmt = (
         select(BookCopy)
@@ -59,6 +377,259 @@ async def get_active_schedule(db: AsyncSession, isbn: int, user_uid: str):
     return result.scalars().first()
 
 
+def _negated(counts: Counter) -> Counter:
+    return Counter({key: -n for key, n in counts.items()})
+
+
+async def adjust_user_counters(
+    db: AsyncSession,
+    loans: Optional[Dict[str, int]] = None,
+    holds: Optional[Dict[str, int]] = None,
+):
+    """
+    Applies per-user deltas ({user_uid: +/-n}) to the open loan and active
+    hold counters. Called by every crud function that opens or closes a
+    loan or schedule, inside the caller's transaction.
+    """
+    loans, holds = loans or {}, holds or {}
+    params = [
+        {"uid": uid, "loans": loans.get(uid, 0), "holds": holds.get(uid, 0)}
+        for uid in loans.keys() | holds.keys()
+    ]
+    if not params:
+        return
+    users = User.__table__
+    await db.execute(
+        update(users)
+        .where(users.c.user_uid == bindparam("uid"))
+        .values(
+            active_loans_count=users.c.active_loans_count + bindparam("loans"),
+            active_holds_count=users.c.active_holds_count + bindparam("holds"),
+        ),
+        params,
+    )
+
+
+async def reconcile_user_counters(db: AsyncSession, first_id: int, last_id: int):
+    """
+    Recounts open loans and active holds for users with ids in
+    [first_id, last_id] and fixes the counters that drifted. Returns the
+    number of users corrected.
+    """
+    open_loans = (
+        select(func.count(Loan.id))
+        .where(Loan.user_uid == User.user_uid, Loan.status.in_(OPEN_LOAN_STATUSES))
+        .scalar_subquery()
+    )
+    active_holds = (
+        select(func.count(BkCopySchedule.id))
+        .where(
+            BkCopySchedule.user_uid == User.user_uid,
+            BkCopySchedule.status == ScheduleStatus.ACTIVE,
+        )
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        update(User)
+        .where(
+            User.id.between(first_id, last_id),
+            or_(
+                User.active_loans_count != open_loans,
+                User.active_holds_count != active_holds,
+            ),
+        )
+        .values(active_loans_count=open_loans, active_holds_count=active_holds)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+async def get_max_user_id(db: AsyncSession) -> int:
+    return await db.scalar(select(func.coalesce(func.max(User.id), 0)))
+
+
+async def get_checkout_eligibility(
+    db: AsyncSession, user_uid: str, isbn: Optional[int | str] = None
+):
+    """
+    Everything a checkout has to know before claiming a copy, in one
+    statement: the patron's fine balance, their loan and hold counters and, when
+    an ISBN is given, their oldest active schedule (with its copy) for it.
+    None if there is no such user.
+    """
+    columns = [
+        User.user_uid,
+        User.fine_balance,
+        User.active_loans_count.label("active_loans"),
+        User.active_holds_count.label("active_holds"),
+    ]
+    if isbn is not None:
+        active_schedule = (
+            select(BkCopySchedule.id)
+            .join(BookCopy, BkCopySchedule.bk_copy_barcode == BookCopy.copy_barcode)
+            .where(
+                BkCopySchedule.status == ScheduleStatus.ACTIVE,
+                BkCopySchedule.user_uid == User.user_uid,
+                BookCopy.book_isbn == isbn,
+            )
+            .order_by(BkCopySchedule.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+        schedule_copy = (
+            select(BkCopySchedule.bk_copy_barcode)
+            .where(BkCopySchedule.id == active_schedule)
+            .scalar_subquery()
+        )
+        columns += [
+            active_schedule.label("schedule_id"),
+            schedule_copy.label("schedule_copy_barcode"),
+        ]
+    result = await db.execute(select(*columns).where(User.user_uid == user_uid))
+    return result.mappings().one_or_none()
+
+
+async def get_active_schedules(db: AsyncSession, user_uid: str):
+    """Active schedules of the user with their copy's ISBN, oldest first."""
+    stmt = (
+        select(BkCopySchedule.id, BkCopySchedule.bk_copy_barcode, BookCopy.book_isbn)
+        .join(BookCopy, BkCopySchedule.bk_copy_barcode == BookCopy.copy_barcode)
+        .where(
+            BkCopySchedule.user_uid == user_uid,
+            BkCopySchedule.status == ScheduleStatus.ACTIVE,
+        )
+        .order_by(BkCopySchedule.id)
+    )
+    result = await db.execute(stmt)
+    return result.all()
+
+
+async def consume_schedules(db: AsyncSession, schedule_ids: List[int]):
+    result = await db.execute(
+        update(BkCopySchedule)
+        .where(
+            BkCopySchedule.id.in_(schedule_ids),
+            BkCopySchedule.status == ScheduleStatus.ACTIVE,
+        )
+        .values(status=ScheduleStatus.CONSUMED)
+        .returning(BkCopySchedule.user_uid)
+        .execution_options(synchronize_session=False)
+    )
+    await adjust_user_counters(db, holds=_negated(Counter(result.scalars())))
+
+
+async def book_exists(db: AsyncSession, isbn: int | str) -> bool:
+    return await db.scalar(select(Book.id).where(Book.isbn == isbn)) is not None
+
+
+async def get_waiting_hold(db: AsyncSession, user_uid: str, isbn: int | str):
+    stmt = select(HoldRequest).where(
+        HoldRequest.user_uid == user_uid,
+        HoldRequest.book_isbn == isbn,
+        HoldRequest.status == HoldStatus.WAITING,
+    )
+    result = await db.execute(stmt)
+    return result.scalars().first()
+
+
+async def create_hold(db: AsyncSession, user_uid: str, isbn: int | str):
+    """
+    Queues the patron for the ISBN unless they are already waiting on it
+    and returns their WAITING hold. The insert does nothing on
+    uq_hold_requests_user_isbn_waiting, so concurrent requests from the
+    same patron share one place in the queue.
+    """
+    holds = HoldRequest.__table__
+    await db.execute(
+        _dialect_insert(db)(holds)
+        .values(user_uid=user_uid, book_isbn=str(isbn), status=HoldStatus.WAITING)
+        .on_conflict_do_nothing()
+    )
+    return await get_waiting_hold(db, user_uid, isbn)
+
+
+async def get_hold_position(db: AsyncSession, hold: HoldRequest) -> int:
+    """1-based place of `hold` in its ISBN's queue, counted off the index."""
+    stmt = select(func.count(HoldRequest.id)).where(
+        HoldRequest.book_isbn == hold.book_isbn,
+        HoldRequest.status == HoldStatus.WAITING,
+        HoldRequest.id <= hold.id,
+    )
+    return await db.scalar(stmt)
+
+
+def next_hold_head(
+    isbn: int | str, max_active_loans: int, max_fine_balance: int, skip_locked: bool
+):
+    """
+    Id of the first WAITING hold on the ISBN whose patron can take a
+    schedule right now. With `skip_locked` (Postgres) holds locked by other
+    allocations are skipped; only the hold row is locked, never the
+    patron's, so their checkouts aren't blocked and a patron busy in
+    another transaction doesn't lose their turn.
+    """
+    head = (
+        select(HoldRequest.id)
+        .join(User, HoldRequest.user_uid == User.user_uid)
+        .where(
+            HoldRequest.book_isbn == isbn,
+            HoldRequest.status == HoldStatus.WAITING,
+            User.is_active,
+            User.active_loans_count < max_active_loans,
+            User.fine_balance < max_fine_balance,
+        )
+        .order_by(HoldRequest.id)
+        .limit(1)
+    )
+    if skip_locked:
+        head = head.with_for_update(of=HoldRequest, skip_locked=True)
+    return head
+
+
+async def claim_next_hold(
+    db: AsyncSession, isbn: int | str, max_active_loans: int, max_fine_balance: int
+):
+    """
+    Takes the head of the ISBN's hold queue and marks it ALLOCATED in one
+    UPDATE ... RETURNING, the same way claim_book_copy takes a copy, so
+    concurrent returns never hand one hold two copies. Postgres skips heads
+    locked by other allocations and moves on to the next in line.
+    Patrons who can't take a schedule right now (inactive, at
+    `max_active_loans` or owing `max_fine_balance`) are passed over and
+    keep their place for the next copy.
+    """
+    head = next_hold_head(
+        isbn,
+        max_active_loans,
+        max_fine_balance,
+        skip_locked=_dialect_name(db) == "postgresql",
+    )
+    result = await db.execute(
+        update(HoldRequest)
+        .where(
+            HoldRequest.id == head.scalar_subquery(),
+            HoldRequest.status == HoldStatus.WAITING,
+        )
+        .values(status=HoldStatus.ALLOCATED, allocated_at=func.now())
+        .returning(HoldRequest.id, HoldRequest.user_uid)
+        .execution_options(synchronize_session=False)
+    )
+    return result.one_or_none()
+
+
+async def set_hold_schedule(db: AsyncSession, hold_id: int, schedule_id: Optional[int]):
+    """Links an allocated hold to its schedule, or puts it back in line if None."""
+    values = {"schedule_id": schedule_id}
+    if schedule_id is None:
+        values.update(status=HoldStatus.WAITING, allocated_at=None)
+    await db.execute(
+        update(HoldRequest)
+        .where(HoldRequest.id == hold_id)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+
+
 async def update_bk_schedule(
     db: AsyncSession,
     bk_copy_schedule: BkCopySchedule,
@@ -69,9 +640,32 @@ async def update_bk_schedule(
     await db.flush()
 
 
+async def get_loan_history_page(
+    db: AsyncSession,
+    user_uid: str,
+    limit: int,
+    loan_status: Optional[LoanStatus] = None,
+    after: Optional[Tuple[datetime, int]] = None,
+):
+    """
+    Keyset page of the user's loans, newest first, read off the
+    (user_uid[, status], checked_out_at, id) indexes. `after` is the
+    (checked_out_at, id) of the last row of the previous page. Fetches
+    `limit + 1` rows so the caller can tell whether another page exists.
+    """
+    stmt = select(Loan).where(Loan.user_uid == user_uid)
+    if loan_status is not None:
+        stmt = stmt.where(Loan.status == loan_status)
+    if after is not None:
+        stmt = stmt.where(tuple_(Loan.checked_out_at, Loan.id) < tuple_(*after))
+    stmt = stmt.order_by(desc(Loan.checked_out_at), desc(Loan.id)).limit(limit + 1)
+    result = await db.execute(stmt)
+    return result.scalars().all()
+
+
 async def get_user_active_loans(db: AsyncSession, user_uid: str):
     stmt = select(Loan).where(
-        Loan.user_uid == user_uid, Loan.status == LoanStatus.ACTIVE
+        Loan.user_uid == user_uid, Loan.status.in_(OPEN_LOAN_STATUSES)
     )
     result = await db.execute(stmt)
     return result.scalars().all()
@@ -82,9 +676,49 @@ async def create_new_book(db: AsyncSession, book: Book):
     await db.flush()
 
 
-async def add_book_copies(db: AsyncSession, copies: List[BookCopy]):
-    db.add_all(copies)
-    await db.flush()
+async def reserve_copy_serials(db: AsyncSession, isbn: str, quantity: int):
+    """
+    Atomically claims `quantity` copy serials for the book and returns the
+    last one claimed (the range is `last - quantity + 1 .. last`), or None
+    if there is no such book. The row stays locked until commit, so
+    concurrent requests get disjoint ranges. Books that predate the
+    counter are seeded from their highest existing serial on first use.
+    """
+    highest_serial = (
+        select(func.coalesce(func.max(BookCopy.serial), 0))
+        .where(BookCopy.book_isbn == Book.isbn)
+        .scalar_subquery()
+    )
+    stmt = (
+        update(Book)
+        .where(Book.isbn == isbn)
+        .values(
+            last_copy_serial=case(
+                (Book.last_copy_serial == 0, highest_serial),
+                else_=Book.last_copy_serial,
+            )
+            + quantity
+        )
+        .returning(Book.last_copy_serial)
+        .execution_options(synchronize_session=False)
+    )
+    result = await db.execute(stmt)
+    return result.scalar_one_or_none()
+
+
+async def add_book_copies(db: AsyncSession, isbn: str, copies: List[dict]):
+    """
+    Bulk inserts AVAILABLE copies (dicts with serial and copy_barcode) with
+    a single core executemany and bumps the ISBN's availability count.
+    """
+    await db.execute(
+        insert(BookCopy.__table__),
+        [
+            {**copy, "book_isbn": isbn, "status": BkCopyStatus.AVAILABLE}
+            for copy in copies
+        ],
+    )
+    await adjust_availability(db, isbn, {BkCopyStatus.AVAILABLE: len(copies)})
 
 
 async def update_book(
@@ -97,6 +731,47 @@ async def update_book(
     await db.flush()
 
 
+async def claim_book_copy(
+    db: AsyncSession,
+    isbn: int | str,
+    new_status: BkCopyStatus,
+    current_status: BkCopyStatus = BkCopyStatus.AVAILABLE,
+    copy_barcode: Optional[str] = None,
+):
+    """
+    Picks one copy of the ISBN in `current_status` (or exactly
+    `copy_barcode`, if given) and moves it to `new_status` in a single
+    UPDATE ... RETURNING, so two concurrent callers can never end up with
+    the same copy. Postgres skips rows locked by other claims instead of
+    queueing behind them. Returns None when no copy is left.
+    """
+    if copy_barcode is not None:
+        target = BookCopy.copy_barcode == copy_barcode
+    else:
+        candidate = (
+            select(BookCopy.copy_id)
+            .where(BookCopy.book_isbn == isbn, BookCopy.status == current_status)
+            .limit(1)
+        )
+        if _dialect_name(db) == "postgresql":
+            candidate = candidate.with_for_update(skip_locked=True)
+        target = BookCopy.copy_id == candidate.scalar_subquery()
+    stmt = (
+        update(BookCopy)
+        .where(target, BookCopy.status == current_status)
+        .values(status=new_status)
+        .returning(BookCopy)
+        .execution_options(synchronize_session=False, populate_existing=True)
+    )
+    result = await db.execute(stmt)
+    book_copy = result.scalar_one_or_none()
+    if book_copy is not None:
+        await adjust_availability(
+            db, book_copy.book_isbn, {current_status: -1, new_status: 1}
+        )
+    return book_copy
+
+
 async def get_book_copy(db: AsyncSession, isbn: int):
     stmt = select(BookCopy).where(
         BookCopy.book_isbn == isbn, BookCopy.status == "AVAILABLE"
@@ -112,8 +787,12 @@ async def get_book_copy_by_barcode(db: AsyncSession, copy_barcode_: str):
 
 
 async def update_bk_copy(db: AsyncSession, book_copy: BookCopy, update_data: dict):
+    old_status = book_copy.status
     for key, value in update_data.items():
         setattr(book_copy, key, value)
+    await track_status_changes(
+        db, [(book_copy.book_isbn, old_status, book_copy.status)]
+    )
     await db.flush()
     await db.refresh(book_copy)
     return book_copy
@@ -141,18 +820,234 @@ async def create_new_user(db: AsyncSession, user: User):
 
 
 async def create_loan(db: AsyncSession, loan: Loan):
-    db.add(loan)
-    await db.flush()
-    await db.refresh(loan)
+    await create_loans(db, [loan])
     return loan
 
 
+async def create_loans(db: AsyncSession, loans: List[Loan]):
+    # Loan uses eager_defaults, the INSERT returns checked_out_at already;
+    # an explicit updated_at keeps the onupdate column from being post-fetched
+    for loan in loans:
+        loan.updated_at = None
+    db.add_all(loans)
+    await db.flush()
+    await adjust_user_counters(db, loans=Counter(loan.user_uid for loan in loans))
+
+
 async def get_all_non_staff_users(db: AsyncSession):
     stmt = select(User).where(~User.is_staff, ~User.is_superuser)
     result = await db.execute(stmt)
     return result.scalars().all()
 
 
+async def get_active_loans_by_barcodes(db: AsyncSession, barcodes: List[str]):
+    """
+    Active loans on the given copies, in one query per
+    IN_CLAUSE_CHUNK_SIZE barcodes. Copies not currently BORROWED are
+    left out so a return cannot be applied twice.
+    """
+    rows = []
+    for i in range(0, len(barcodes), IN_CLAUSE_CHUNK_SIZE):
+        stmt = (
+            select(
+                Loan.id,
+                Loan.loan_id,
+                Loan.user_uid,
+                Loan.bk_copy_barcode,
+                Loan.due_at,
+                Loan.fined_days,
+            )
+            .join(BookCopy, Loan.bk_copy_barcode == BookCopy.copy_barcode)
+            .where(
+                Loan.bk_copy_barcode.in_(barcodes[i : i + IN_CLAUSE_CHUNK_SIZE]),
+                Loan.status.in_(OPEN_LOAN_STATUSES),
+                BookCopy.status == BkCopyStatus.BORROWED,
+            )
+        )
+        result = await db.execute(stmt)
+        rows.extend(result.all())
+    return rows
+
+
+async def get_overdue_loans_batch(
+    db: AsyncSession,
+    loan_status: LoanStatus,
+    now: datetime,
+    limit: int,
+    after: Optional[Tuple[datetime, int]] = None,
+):
+    """
+    Up to `limit` loans in `loan_status` that were due before `now`,
+    ordered by (due_at, id) so the ix_loans_status_due_at range is read in
+    index order. `after` is the (due_at, id) of the last row of the
+    previous batch.
+    """
+    stmt = select(Loan.id, Loan.user_uid, Loan.due_at, Loan.fined_days).where(
+        Loan.status == loan_status, Loan.due_at < now
+    )
+    if after is not None:
+        # a row-value comparison, both backends seek the index with it
+        stmt = stmt.where(tuple_(Loan.due_at, Loan.id) > tuple_(*after))
+    stmt = stmt.order_by(Loan.due_at, Loan.id).limit(limit)
+    result = await db.execute(stmt)
+    return result.all()
+
+
+async def mark_loans_overdue(
+    db: AsyncSession,
+    loan_status: LoanStatus,
+    fined_days: Dict[Tuple[datetime, int], Tuple[int, int]],
+) -> List[Tuple[str, int]]:
+    """
+    Flags the loans ({(due_at, loan id): (fined_days as read, fined_days
+    now)}, in get_overdue_loans_batch order) as overdue. A loan is only
+    changed while it is still in `loan_status` with the fined_days that
+    were read, so one returned or swept in the meantime is left alone.
+    Returns (user_uid, newly charged days) per loan changed.
+    """
+    # due dates fall on the hour, so a batch holds a few distinct due_at
+    # values and both fined_days follow from it: one UPDATE per group
+    groups = defaultdict(list)
+    for (due_at, loan_id), days in fined_days.items():
+        groups[(due_at, *days)].append(loan_id)
+    loans = Loan.__table__
+    updated = []
+    for (due_at, read_days, charged_days), ids in groups.items():
+        for i in range(0, len(ids), IN_CLAUSE_CHUNK_SIZE):
+            chunk = ids[i : i + IN_CLAUSE_CHUNK_SIZE]
+            result = await db.execute(
+                update(loans)
+                .where(
+                    # seeks ix_loans_status_due_at down to the id range, on
+                    # the id list alone SQLite prefers to walk every loan in
+                    # `loan_status` through the index
+                    loans.c.status == loan_status,
+                    loans.c.due_at == due_at,
+                    loans.c.id.between(chunk[0], chunk[-1]),
+                    loans.c.id.in_(chunk),
+                    loans.c.fined_days == read_days,
+                )
+                .values(status=LoanStatus.OVERDUE, fined_days=charged_days)
+                .returning(loans.c.user_uid)
+            )
+            updated.extend(
+                (user_uid, charged_days - read_days) for user_uid in result.scalars()
+            )
+    return updated
+
+
+async def get_expired_schedules(db: AsyncSession, now: datetime, limit: int):
+    """Up to `limit` ACTIVE schedules whose hold ran out before `now`."""
+    stmt = (
+        select(BkCopySchedule.id, BkCopySchedule.bk_copy_barcode)
+        .where(
+            BkCopySchedule.status == ScheduleStatus.ACTIVE,
+            BkCopySchedule.expires_at <= now,
+        )
+        .order_by(BkCopySchedule.expires_at, BkCopySchedule.id)
+        .limit(limit)
+    )
+    result = await db.execute(stmt)
+    return result.all()
+
+
+async def expire_schedules(db: AsyncSession, schedule_ids: List[int]):
+    """Marks the schedules EXPIRED, returns the copies of those still ACTIVE."""
+    result = await db.execute(
+        update(BkCopySchedule)
+        .where(
+            BkCopySchedule.id.in_(schedule_ids),
+            BkCopySchedule.status == ScheduleStatus.ACTIVE,
+        )
+        .values(status=ScheduleStatus.EXPIRED)
+        .returning(BkCopySchedule.bk_copy_barcode, BkCopySchedule.user_uid)
+        .execution_options(synchronize_session=False)
+    )
+    rows = result.all()
+    await adjust_user_counters(
+        db, holds=_negated(Counter(row.user_uid for row in rows))
+    )
+    return [row.bk_copy_barcode for row in rows]
+
+
+async def close_loans(
+    db: AsyncSession, loan_ids: List[int], loan_status: LoanStatus, returned_at
+):
+    """
+    Closes the loans that are still open as `loan_status` and takes them off
+    their patrons' active counts. Returns the (id, loan_id, user_uid,
+    bk_copy_barcode, due_at, fined_days) rows actually closed, so a loan
+    returned twice at once is only fined and counted by one of the returns.
+    """
+    closed = []
+    for i in range(0, len(loan_ids), IN_CLAUSE_CHUNK_SIZE):
+        result = await db.execute(
+            update(Loan)
+            .where(
+                Loan.id.in_(loan_ids[i : i + IN_CLAUSE_CHUNK_SIZE]),
+                Loan.status.in_(OPEN_LOAN_STATUSES),
+            )
+            .values(status=loan_status, returned_at=returned_at)
+            .returning(
+                Loan.id,
+                Loan.loan_id,
+                Loan.user_uid,
+                Loan.bk_copy_barcode,
+                Loan.due_at,
+                Loan.fined_days,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        closed.extend(result.all())
+    await adjust_user_counters(
+        db, loans=_negated(Counter(row.user_uid for row in closed))
+    )
+    return closed
+
+
+async def set_copies_status(
+    db: AsyncSession,
+    barcodes: List[str],
+    current_status: BkCopyStatus,
+    new_status: BkCopyStatus,
+):
+    """
+    Moves the copies still in `current_status` to `new_status` set-wise and
+    updates the availability counts for the ones actually moved. Returns
+    the (copy_barcode, book_isbn) rows moved.
+    """
+    moved = []
+    for i in range(0, len(barcodes), IN_CLAUSE_CHUNK_SIZE):
+        result = await db.execute(
+            update(BookCopy)
+            .where(
+                BookCopy.copy_barcode.in_(barcodes[i : i + IN_CLAUSE_CHUNK_SIZE]),
+                BookCopy.status == current_status,
+            )
+            .values(status=new_status)
+            .returning(BookCopy.copy_barcode, BookCopy.book_isbn)
+            .execution_options(synchronize_session=False)
+        )
+        moved.extend(result.all())
+    await track_status_changes(
+        db, [(row.book_isbn, current_status, new_status) for row in moved]
+    )
+    return moved
+
+
+async def add_user_fines(db: AsyncSession, fines: Dict[str, int]):
+    """Adds `fines` ({user_uid: amount}) to the users' balances."""
+    if not fines:
+        return
+    users = User.__table__
+    await db.execute(
+        update(users)
+        .where(users.c.user_uid == bindparam("uid"))
+        .values(fine_balance=users.c.fine_balance + bindparam("fine")),
+        [{"uid": k, "fine": v} for k, v in fines.items()],
+    )
+
+
 async def get_loan_by_loan_id(db: AsyncSession, _loan_id: str):
     stmt = select(Loan).where(Loan.loan_id == _loan_id)
     result = await db.execute(stmt)
@@ -172,6 +1067,8 @@ async def update_user(
     for key, value in update_data.items():
         setattr(user, key, value)
     await db.flush()
+    # cached principals for this user are dropped once the caller commits
+    db.info.setdefault("stale_principals", set()).add(user.email)
 
 
 async def get_default_superuser(db: AsyncSession, email: str):
@@ -211,13 +1108,14 @@ async def get_user_by_uid(db: AsyncSession, user_uid: str):
 async def create_schedule(db: AsyncSession, schedule: BkCopySchedule):
     db.add(schedule)
     await db.flush()
+    await adjust_user_counters(db, holds={schedule.user_uid: 1})
     await db.refresh(schedule)
     return schedule
 
 
-async def add_audit(db: AsyncSession, audit: Audit):
-    db.add(audit)
-    await db.flush()
+async def add_audits(db: AsyncSession, entries: List[dict]):
+    """One executemany INSERT for a batch of audit entries."""
+    await db.execute(insert(Audit), entries)
 
 
 async def get_bk_copies_by_barcode(db: AsyncSession, barcodes: Set[str]):
@@ -229,7 +1127,34 @@ async def get_bk_copies_by_barcode(db: AsyncSession, barcodes: Set[str]):
 async def update_bk_copies_status(
     db: AsyncSession, bk_copies: List[BookCopy], update_data: List[dict]
 ):
+    changes = []
     for i, data in enumerate(update_data):
+        old_status = bk_copies[i].status
         for key, value in data.items():
             setattr(bk_copies[i], key, value)
+        changes.append((bk_copies[i].book_isbn, old_status, bk_copies[i].status))
+    await track_status_changes(db, changes)
     await db.flush()
+
+
+async def revoke_tokens(db: AsyncSession, tokens: List[dict]):
+    """
+    Inserts `tokens` ({jti, user_uid, token_type, expires_at}) into
+    revoked_tokens; revoking an already revoked jti raises IntegrityError.
+    """
+    await db.execute(insert(RevokedToken), tokens)
+
+
+async def is_token_revoked(db: AsyncSession, jti: str) -> bool:
+    stmt = select(RevokedToken.jti).where(RevokedToken.jti == jti)
+    return (await db.execute(stmt)).scalar_one_or_none() is not None
+
+
+async def prune_revoked_tokens(db: AsyncSession, now: datetime) -> int:
+    stmt = delete(RevokedToken).where(RevokedToken.expires_at <= now)
+    return (await db.execute(stmt)).rowcount
+
+
+async def get_revoked_jtis(db: AsyncSession, token_type: str) -> List[str]:
+    stmt = select(RevokedToken.jti).where(RevokedToken.token_type == token_type)
+    return list((await db.execute(stmt)).scalars())
@@ -2,9 +2,18 @@ from fastapi import FastAPI
 from app.core.config import Settings
 from contextlib import asynccontextmanager
 from app.core.middleware import AuditMiddleware
-from app.routers import books, users
+from app.routers import books, metrics, users
 from app.core.database import engine, Base, AsyncSessionLocal
 from app.core.auth import create_superuser
+from app.core.audit import audit_writer
+from app.core.hashing import hashing_pool
+from app.core.tasks import register_job, start_jobs, stop_jobs
+from app.services import (
+    reconcile_user_counters,
+    sweep_expired_schedules,
+    sweep_overdue_loans,
+    sync_revoked_tokens,
+)
 
 settings = Settings()
 
@@ -15,7 +24,30 @@ async def lifespan(app: FastAPI):
     async with AsyncSessionLocal() as session:
         if not settings.test_mode:
             await create_superuser(session)         
+    register_job(
+        "overdue_sweep", settings.overdue_sweep_interval_seconds, sweep_overdue_loans
+    )
+    register_job(
+        "schedule_expiry",
+        settings.schedule_expiry_interval_seconds,
+        sweep_expired_schedules,
+    )
+    register_job(
+        "user_counter_reconcile",
+        settings.user_counter_reconcile_interval_seconds,
+        reconcile_user_counters,
+    )
+    register_job(
+        "revocation_sync",
+        settings.revocation_sync_interval_seconds,
+        sync_revoked_tokens,
+    )
+    start_jobs()
+    audit_writer.start()
     yield
+    await stop_jobs()
+    await audit_writer.stop()
+    hashing_pool.shutdown()
     await engine.dispose()
     
 app = FastAPI(lifespan=lifespan)
@@ -25,6 +57,7 @@ if not settings.test_mode:
 
 app.include_router(books.books_router)
 app.include_router(users.users_router)
+app.include_router(metrics.metrics_router)
 
 @app.get('/')
 async def root():
@@ -1,17 +1,32 @@
 import enum
 from datetime import datetime
 
-from sqlalchemy import JSON, Boolean, DateTime, Enum, ForeignKey, Integer, String, func
+from sqlalchemy import (
+    DDL,
+    JSON,
+    Boolean,
+    DateTime,
+    Enum,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    event,
+    func,
+    text,
+)
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.core.database import Base
 from app.utils import (
     default_loan_due_date,
+    default_schedule_expiry,
     generate_barcode,
     generate_library_cardnumber,
     generate_loan_id,
     generate_schedule_id,
     generate_user_id,
+    utc_now,
 )
 
 
@@ -19,21 +34,43 @@ class LoanStatus(enum.Enum):
     ACTIVE = "active"
     RETURNED = "returned"
     RETURNED_LATE = "returned_late"
+    OVERDUE = "overdue"
+
+
+# loans still out with a patron, whether or not they are past due
+OPEN_LOAN_STATUSES = (LoanStatus.ACTIVE, LoanStatus.OVERDUE)
 
 
 class Event(enum.Enum):
     CHECKOUT = "checkout"
+    BULK_CHECKOUT = "bulk_checkout"
     CREATE_BOOK = "create_book"
     CREATE_BK_COPIES = "create_bk_copies"
+    IMPORT_BOOKS = "import_books"
+    EXPORT_CATALOG = "export_catalog"
     CREATE_USER = "create_user"
     FETCH_BOOK = "fecth_book"
+    FETCH_BOOKS_BATCH = "fetch_books_batch"
+    LIST_BOOKS = "list_books"
+    SEARCH_BOOKS = "search_books"
     FETCH_USER = "fetch_user"
+    FETCH_METRICS = "fetch_metrics"
     LOGIN_ADMIN_USER = "login_admin_user"
     LOGIN_USER = "login_user"
     RETURN_BOOK = "return_book"
+    BULK_RETURN = "bulk_return"
     SCHEDULE_BOOK = "schedule_book"
     UPDATE_BOOK = "update_book"
     UPDATE_BOOK_COPIES = "update_book_copies"
+    RECONCILE_AVAILABILITY = "reconcile_availability"
+    REBUILD_SEARCH_INDEX = "rebuild_search_index"
+    SWEEP_OVERDUE = "sweep_overdue"
+    EXPIRE_SCHEDULES = "expire_schedules"
+    RECONCILE_USER_COUNTERS = "reconcile_user_counters"
+    FETCH_LOAN_HISTORY = "fetch_loan_history"
+    FETCH_HOLD_POSITION = "fetch_hold_position"
+    REFRESH_TOKEN = "refresh_token"
+    LOGOUT_USER = "logout_user"
     UNIDENTIFIED_EVENT = "unidentified_event"  # safety net
     REJECTED_EVENT = "rejected_event"
 
@@ -53,18 +90,27 @@ class ScheduleStatus(enum.Enum):
     EXPIRED = "expired"
 
 
+class HoldStatus(enum.Enum):
+    WAITING = "waiting"
+    ALLOCATED = "allocated"
+
+
 class Book(Base):
     __tablename__ = "books"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     title: Mapped[str] = mapped_column(String(100), unique=True, nullable=False)
-    author: Mapped[str] = mapped_column(String(100), nullable=False)
+    author: Mapped[str] = mapped_column(String(100), nullable=False, index=True)
     isbn: Mapped[str] = mapped_column(String(50), unique=True, nullable=False)
     library_barcode: Mapped[str] = mapped_column(
         String(50), unique=True, nullable=False, default=generate_barcode
     )
     available: Mapped[bool] = mapped_column(Boolean, default=True)
-    location: Mapped[str] = mapped_column(String(50), nullable=False)
+    location: Mapped[str] = mapped_column(String(50), nullable=False, index=True)
+    # highest copy serial handed out, see crud.reserve_copy_serials
+    last_copy_serial: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0", nullable=False
+    )
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now()
     )
@@ -72,6 +118,43 @@ class Book(Base):
         DateTime(timezone=True), nullable=True, onupdate=func.now()
     )
 
+    availability = relationship("BookAvailability", lazy="joined", uselist=False)
+
+
+# Full-text index over title/author. SQLite gets an FTS5 table keyed by
+# books.id that the book services keep in step, Postgres gets a GIN
+# expression index that the planner maintains itself. The expression must
+# match the one used by crud.search_books for the index to be picked up.
+BOOK_SEARCH_VECTOR = (
+    "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(author, ''))"
+)
+
+# also run by crud.rebuild_books_search, for tables created before them
+BOOKS_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts "
+    "USING fts5(title, author, tokenize='unicode61 remove_diacritics 2')"
+)
+BOOKS_SEARCH_INDEX_DDL = (
+    f"CREATE INDEX IF NOT EXISTS ix_books_search ON books "
+    f"USING GIN ({BOOK_SEARCH_VECTOR})"
+)
+
+event.listen(
+    Book.__table__,
+    "after_create",
+    DDL(BOOKS_FTS_DDL).execute_if(dialect="sqlite"),
+)
+event.listen(
+    Book.__table__,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS books_fts").execute_if(dialect="sqlite"),
+)
+event.listen(
+    Book.__table__,
+    "after_create",
+    DDL(BOOKS_SEARCH_INDEX_DDL).execute_if(dialect="postgresql"),
+)
+
 
 class User(Base):
     __tablename__ = "users"
@@ -87,6 +170,13 @@ class User(Base):
         String(50), unique=True, default=generate_library_cardnumber
     )
     fine_balance: Mapped[int] = mapped_column(Integer, default=0)
+    # kept in step by the crud functions that open and close loans/schedules
+    active_loans_count: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0"
+    )
+    active_holds_count: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0"
+    )
     is_active: Mapped[bool] = mapped_column(Boolean, default=True, index=True)
     is_staff: Mapped[bool] = mapped_column(Boolean, default=False, index=True)
     is_superuser: Mapped[bool] = mapped_column(Boolean, default=False, index=True)
@@ -102,6 +192,22 @@ class User(Base):
 
 class Loan(Base):
     __tablename__ = "loans"
+    # fetch checked_out_at in the INSERT itself instead of a refresh
+    __mapper_args__ = {"eager_defaults": True}
+    __table_args__ = (
+        # the overdue sweep walks (status, due_at) ranges
+        Index("ix_loans_status_due_at", "status", "due_at"),
+        # patron history pages, newest first, with and without a status
+        # filter; the second also serves the open-loan lookups and counts
+        Index("ix_loans_user_uid_checked_out_at", "user_uid", "checked_out_at", "id"),
+        Index(
+            "ix_loans_user_uid_status_checked_out_at",
+            "user_uid",
+            "status",
+            "checked_out_at",
+            "id",
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     loan_id: Mapped[str] = mapped_column(
@@ -114,13 +220,16 @@ class Loan(Base):
     status: Mapped[enum.Enum] = mapped_column(
         Enum(LoanStatus), default=LoanStatus.ACTIVE
     )
+    # set by the app so history cursors compare exactly on every backend
     checked_out_at: Mapped[datetime] = mapped_column(
-        DateTime(timezone=True), server_default=func.now()
+        DateTime(timezone=True), default=utc_now, server_default=func.now()
     )
     due_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), default=default_loan_due_date
     )
     returned_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    # overdue days already charged to the patron by the sweep
+    fined_days: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
     updated_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), nullable=True, onupdate=func.now()
     )
@@ -146,6 +255,10 @@ class BookCopy(Base):
 
 class BkCopySchedule(Base):
     __tablename__ = "bk_copy_schedules"
+    # the expiry sweep reads ACTIVE schedules by expires_at
+    __table_args__ = (
+        Index("ix_bk_copy_schedules_status_expires_at", "status", "expires_at"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_uid: Mapped[int] = mapped_column(
@@ -163,10 +276,102 @@ class BkCopySchedule(Base):
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now()
     )
+    expires_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, default=default_schedule_expiry
+    )
 
     bk_copy = relationship("BookCopy", back_populates="schedule")
 
 
+class HoldRequest(Base):
+    """
+    A patron waiting for a copy of an ISBN. Each ISBN's WAITING rows form a
+    FIFO queue in id order; the head is allocated a schedule as soon as a
+    copy becomes AVAILABLE.
+    """
+
+    __tablename__ = "hold_requests"
+    __table_args__ = (
+        # queue head and positions: a range of one ISBN's WAITING ids
+        Index("ix_hold_requests_isbn_status_id", "book_isbn", "status", "id"),
+        Index("ix_hold_requests_user_isbn_status", "user_uid", "book_isbn", "status"),
+        # a patron waits on an ISBN at most once, even when two requests
+        # queue them at the same time
+        Index(
+            "uq_hold_requests_user_isbn_waiting",
+            "user_uid",
+            "book_isbn",
+            unique=True,
+            sqlite_where=text("status = 'WAITING'"),
+            postgresql_where=text("status = 'WAITING'"),
+        ),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_uid: Mapped[str] = mapped_column(
+        String(50), ForeignKey("users.user_uid"), nullable=False
+    )
+    book_isbn: Mapped[str] = mapped_column(
+        String(50), ForeignKey("books.isbn"), nullable=False
+    )
+    status: Mapped[enum.Enum] = mapped_column(
+        Enum(HoldStatus), default=HoldStatus.WAITING
+    )
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=utc_now, server_default=func.now()
+    )
+    allocated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    schedule_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("bk_copy_schedules.id"), nullable=True
+    )
+
+
+class BookAvailability(Base):
+    """
+    Per-ISBN copy counts by BkCopyStatus, maintained by the crud functions
+    that change copy status and rebuilt by crud.rebuild_availability.
+    """
+
+    __tablename__ = "book_availability"
+
+    book_isbn: Mapped[str] = mapped_column(
+        String(50), ForeignKey("books.isbn"), primary_key=True
+    )
+    available: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    borrowed: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    reserved: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    in_check: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    lost: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    damaged: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+
+class RevokedToken(Base):
+    """
+    Token ids (jti) revoked before they expire. Rows are only needed until
+    `expires_at`; the revocation_sync job deletes them after that.
+    """
+
+    __tablename__ = "revoked_tokens"
+
+    jti: Mapped[str] = mapped_column(String(64), primary_key=True)
+    user_uid: Mapped[str] = mapped_column(String(50), nullable=True)
+    # "access" or "refresh"; only access tokens go in the revocation filter
+    token_type: Mapped[str] = mapped_column(
+        String(16), default="access", server_default="access"
+    )
+    expires_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, index=True
+    )
+    revoked_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=utc_now, server_default=func.now()
+    )
+
+
 class Audit(Base):
     __tablename__ = "audit"
 
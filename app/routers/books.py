@@ -1,18 +1,30 @@
-from typing import Annotated
+from typing import Annotated, Literal, Optional
 
-from fastapi import APIRouter, Body, Depends, Form, Query, Request, status
+from fastapi import APIRouter, Body, Depends, Form, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 
 from app import services
 from app.core.auth import get_current_active_user, get_current_staff_user
 from app.core.database import AsyncSession, get_session
+from app.utils import buffer_chunks, gzip_chunks
 from app.schemas.book import (
     BkCopyLoanResponse,
     BkCopyUpdateResponse,
+    BookBatchRequest,
+    BookBatchResponse,
     BookCopyForm,
     BookCreate,
+    BookImportReport,
+    BookListResponse,
     BookResponse,
+    BookSearchResponse,
     BookUpdate,
+    BulkLoanRequest,
+    BulkLoanResponse,
+    BulkReturnRequest,
+    BulkReturnResponse,
     FullScheduleInfo,
+    HoldQueueInfo,
     ListBkUpdate,
     LoanForm,
     LoanReturnForm,
@@ -21,25 +33,80 @@ from app.schemas.book import (
 books_router = APIRouter(prefix="/books")
 
 
-@books_router.get("")
-async def get_all_books(request: Request):
-    return {"books": []}
+# tested
+@books_router.get("", response_model=BookListResponse)
+async def get_all_books(
+    request: Request,
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+    sort: Annotated[Literal["id", "title"], Query()] = "id",
+    cursor: Annotated[Optional[str], Query()] = None,
+    author: Annotated[Optional[str], Query()] = None,
+    location: Annotated[Optional[str], Query()] = None,
+    available: Annotated[Optional[bool], Query()] = None,
+    user_role_exc: tuple = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_session),
+):
+    current_user, role, exc = user_role_exc
+    request.state.exceptions = exc
+    return await services.list_books_service(
+        request,
+        db,
+        limit,
+        sort=sort,
+        cursor=cursor,
+        author=author,
+        location=location,
+        available=available,
+    )
+
+
+# tested
+@books_router.get("/search", response_model=BookSearchResponse)
+async def search_books(
+    request: Request,
+    q: Annotated[str, Query(min_length=1, max_length=100)],
+    limit: Annotated[int, Query(ge=1, le=50)] = 20,
+    offset: Annotated[int, Query(ge=0, le=1000)] = 0,
+    user_role_exc: tuple = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_session),
+):
+    current_user, role, exc = user_role_exc
+    request.state.exceptions = exc
+    return await services.search_books_service(request, db, q, limit, offset)
 
 
 # tested
 @books_router.get("/fetch", response_model=BookResponse)
 async def get_book_by_ISBN(
     request: Request,
+    response: Response,
     isbn: Annotated[int, Query()],
     user_role_exc: tuple = Depends(get_current_active_user),
     db: AsyncSession = Depends(get_session),
 ):
+    """
+    Sends ETag/Last-Modified and answers If-None-Match/If-Modified-Since
+    with an empty 304 when the book hasn't changed.
+    """
     current_user, role, exc = user_role_exc
     request.state.exceptions = exc
-    book = await services.get_book_by_isbn_service(request, db, isbn)
+    book = await services.get_book_by_isbn_service(request, db, isbn, response)
     return book
 
 
+# tested
+@books_router.post("/fetch-batch", response_model=BookBatchResponse)
+async def get_books_by_ISBNs(
+    request: Request,
+    data: BookBatchRequest = Body(),
+    user_role_exc: tuple = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_session),
+):
+    current_user, role, exc = user_role_exc
+    request.state.exceptions = exc
+    return await services.get_books_by_isbns_service(request, db, data.isbns)
+
+
 # tested
 @books_router.post("", status_code=status.HTTP_201_CREATED)
 async def create_book(
@@ -55,6 +122,49 @@ async def create_book(
     return {"message": "Created new book successully"}
 
 
+# tested
+@books_router.post("/import", response_model=BookImportReport)
+async def import_books(
+    request: Request,
+    fmt: Annotated[Literal["csv", "jsonl"], Query(alias="format")] = "csv",
+    batch_size: Annotated[Optional[int], Query(ge=1, le=10000)] = None,
+    staff_user_exc: tuple = Depends(get_current_staff_user),
+    db: AsyncSession = Depends(get_session),
+):
+    """
+    Streams a CSV (with a header row) or JSONL catalog from the request body
+    and bulk inserts it. Rows that are invalid or already exist are reported
+    back instead of failing the whole import.
+    """
+    staff_user, role, exc = staff_user_exc
+    request.state.exceptions = exc
+    return await services.import_books_service(request, db, fmt, batch_size)
+
+
+# tested
+@books_router.get("/export")
+async def export_catalog(
+    request: Request,
+    since: Annotated[Optional[int], Query(ge=0)] = None,
+    compress: Annotated[bool, Query()] = False,
+    staff_user_exc: tuple = Depends(get_current_staff_user),
+    db: AsyncSession = Depends(get_session),
+):
+    """
+    Streams every book (with its copies) after book id `since` as NDJSON,
+    gzip encoded when `compress` is set.
+    """
+    staff_user, role, exc = staff_user_exc
+    request.state.exceptions = exc
+    lines = await services.export_catalog_service(request, db, since)
+    body = buffer_chunks(lines)
+    headers = {}
+    if compress:
+        body = gzip_chunks(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type="application/x-ndjson", headers=headers)
+
+
 # tested
 @books_router.put("/{isbn}", status_code=status.HTTP_204_NO_CONTENT)
 async def update_book(
@@ -85,6 +195,56 @@ async def add_book_copies(
     return message
 
 
+# tested
+@books_router.post("/reconcile-availability")
+async def reconcile_availability(
+    request: Request,
+    staff_user_exc: tuple = Depends(get_current_staff_user),
+    db: AsyncSession = Depends(get_session),
+):
+    staff_user, role, exc = staff_user_exc
+    request.state.exceptions = exc
+    return await services.reconcile_availability_service(request, db)
+
+
+# tested
+@books_router.post("/rebuild-search-index")
+async def rebuild_search_index(
+    request: Request,
+    staff_user_exc: tuple = Depends(get_current_staff_user),
+    db: AsyncSession = Depends(get_session),
+):
+    staff_user, role, exc = staff_user_exc
+    request.state.exceptions = exc
+    return await services.rebuild_books_search_service(request, db)
+
+
+# tested
+@books_router.post("/sweep-overdue")
+async def sweep_overdue_loans(
+    request: Request,
+    staff_user_exc: tuple = Depends(get_current_staff_user),
+    db: AsyncSession = Depends(get_session),
+):
+    """Runs the overdue sweep now instead of waiting for the background job."""
+    staff_user, role, exc = staff_user_exc
+    request.state.exceptions = exc
+    return await services.sweep_overdue_service(request, db)
+
+
+# tested
+@books_router.post("/expire-schedules")
+async def expire_schedules(
+    request: Request,
+    staff_user_exc: tuple = Depends(get_current_staff_user),
+    db: AsyncSession = Depends(get_session),
+):
+    """Releases expired schedules now instead of waiting for the background job."""
+    staff_user, role, exc = staff_user_exc
+    request.state.exceptions = exc
+    return await services.expire_schedules_service(request, db)
+
+
 @books_router.delete("/")
 async def delete_book(request: Request):
     pass
@@ -106,6 +266,20 @@ async def return_book_loan(
     return message
 
 
+# tested
+@books_router.post("/loan-returns", response_model=BulkReturnResponse)
+async def return_books(
+    request: Request,
+    data: BulkReturnRequest = Body(),
+    staff_user_exc: tuple = Depends(get_current_staff_user),
+    db: AsyncSession = Depends(get_session),
+):
+    """Processes a batch of scanned copy barcodes, e.g. from the book drop."""
+    staff_user, role, exc = staff_user_exc
+    request.state.exceptions = exc
+    return await services.return_books_service(request, db, data.barcodes)
+
+
 # tested
 @books_router.post(
     "/loan-book", response_model=BkCopyLoanResponse, status_code=status.HTTP_201_CREATED
@@ -123,25 +297,56 @@ async def loan_book(
     return loan_info
 
 
+# tested
+@books_router.post("/loan-books", response_model=BulkLoanResponse)
+async def loan_books(
+    request: Request,
+    data: BulkLoanRequest = Body(),
+    staff_user_exc: tuple = Depends(get_current_staff_user),
+    db: AsyncSession = Depends(get_session),
+):
+    """Checks out several ISBNs or copies to one patron at the desk."""
+    staff_user, role, exc = staff_user_exc
+    request.state.exceptions = exc
+    return await services.loan_books_service(
+        request, db, data.user_uid, [item.model_dump() for item in data.items]
+    )
+
+
 @books_router.post(
     "/book-schedule/{isbn}",
-    response_model=FullScheduleInfo,
+    response_model=FullScheduleInfo | HoldQueueInfo,
     status_code=status.HTTP_201_CREATED,
 )
 async def schedule_book(
     request: Request,
     isbn: int,
+    response: Response,
     user_role_exc: tuple = Depends(get_current_active_user),
     db: AsyncSession = Depends(get_session),
 ):
+    """Reserves a free copy (201), or joins the ISBN's hold queue (202)."""
     current_user, role, exc = user_role_exc
     request.state.exceptions = exc
     schedule_info = await services.schedule_book_copy_service(
-        request, db, isbn, current_user
+        request, db, isbn, current_user, response
     )
     return schedule_info
 
 
+# tested
+@books_router.get("/holds/{isbn}", response_model=HoldQueueInfo)
+async def get_hold_position(
+    request: Request,
+    isbn: str,
+    user_role_exc: tuple = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_session),
+):
+    current_user, role, exc = user_role_exc
+    request.state.exceptions = exc
+    return await services.get_hold_position_service(request, db, isbn, current_user)
+
+
 @books_router.patch("/update-bk-copies-status", response_model=BkCopyUpdateResponse) # change method later
 async def update_bk_copies(
     request: Request,
@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Depends, Request
+
+from app import services
+from app.core.auth import get_current_staff_user
+
+metrics_router = APIRouter(prefix="/metrics")
+
+
+@metrics_router.get("")
+async def get_metrics(
+    request: Request,
+    staff_user_exc: tuple = Depends(get_current_staff_user),
+):
+    staff_user, role, exc = staff_user_exc
+    request.state.exceptions = exc
+    return await services.get_metrics_service(request)
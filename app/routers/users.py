@@ -1,8 +1,10 @@
-from fastapi import APIRouter, status, Depends, Form, Request
+from fastapi import APIRouter, status, Depends, Form, Query, Request
 from app import services
-from app.core.auth import get_current_staff_user, get_current_admin_user
+from app.core.auth import get_current_active_user, get_current_staff_user, get_current_admin_user
 from app.core.database import get_session, AsyncSession
-from typing import Annotated
+from typing import Annotated, Optional
+from app.models import LoanStatus
+from app.schemas.book import LoanHistoryResponse
 from app.schemas.token import TokenResponse
 from app.schemas.user import UserCreate, UserLogin, UserListResponse
 
@@ -21,6 +23,51 @@ async def get_all_non_staff_users(
     users = await services.get_all_non_staff_users_service(request, db)
     return users
 
+# tested
+@users_router.get('/me/loans', response_model=LoanHistoryResponse)
+async def get_my_loans(
+    request: Request,
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+    loan_status: Annotated[Optional[LoanStatus], Query(alias='status')] = None,
+    cursor: Annotated[Optional[str], Query()] = None,
+    user_role_exc: tuple=Depends(get_current_active_user),
+    db: AsyncSession=Depends(get_session),
+    ):
+    current_user, role, exc = user_role_exc
+    request.state.exceptions = exc
+    user_uid = current_user.user_uid if current_user else None
+    return await services.get_loan_history_service(
+        request, db, user_uid, limit, loan_status, cursor
+    )
+
+# tested
+@users_router.get('/{user_uid}/loans', response_model=LoanHistoryResponse)
+async def get_patron_loans(
+    request: Request,
+    user_uid: str,
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+    loan_status: Annotated[Optional[LoanStatus], Query(alias='status')] = None,
+    cursor: Annotated[Optional[str], Query()] = None,
+    staff_user_exc: tuple=Depends(get_current_staff_user),
+    db: AsyncSession=Depends(get_session),
+    ):
+    staff_user, role, exc = staff_user_exc
+    request.state.exceptions = exc
+    return await services.get_loan_history_service(
+        request, db, user_uid, limit, loan_status, cursor
+    )
+
+# tested
+@users_router.post('/reconcile-counters')
+async def reconcile_user_counters(
+    request: Request,
+    staff_user_exc: tuple=Depends(get_current_staff_user),
+    db: AsyncSession=Depends(get_session),
+    ):
+    staff_user, role, exc = staff_user_exc
+    request.state.exceptions = exc
+    return await services.reconcile_user_counters_service(request, db)
+
 @users_router.post('/create-staff-user')
 async def create_new_staff_user(
     request: Request,
@@ -75,4 +122,25 @@ async def admin_login_for_access_token(
     token = await services.login_user_service(request, db, form_data.model_dump()) 
     return token
 
+# tested
+@users_router.post('/refresh', response_model=TokenResponse)
+async def refresh_access_token(
+    request: Request,
+    refresh_token: Annotated[str, Form()],
+    db: AsyncSession=Depends(get_session)
+    ):
+    return await services.refresh_access_token_service(request, db, refresh_token)
+
+# tested
+@users_router.post('/logout')
+async def logout(
+    request: Request,
+    refresh_token: Annotated[Optional[str], Form()] = None,
+    user_role_exc: tuple=Depends(get_current_active_user),
+    db: AsyncSession=Depends(get_session)
+    ):
+    current_user, role, exc = user_role_exc
+    request.state.exceptions = exc
+    return await services.logout_user_service(request, db, current_user, refresh_token)
+
 # Note: You can inject request object in dependency signature
\ No newline at end of file
@@ -1,7 +1,14 @@
 from datetime import datetime
 from typing import Literal, Optional
 
-from pydantic import BaseModel, ConfigDict, PositiveInt
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    PositiveInt,
+    field_validator,
+    model_validator,
+)
 
 
 class BookBase(BaseModel):
@@ -22,18 +29,81 @@ class BookUpdate(BaseModel):
     location: Optional[str] = None
 
 
+class BookAvailabilityCounts(BaseModel):
+    available: int = 0
+    borrowed: int = 0
+    reserved: int = 0
+    in_check: int = 0
+    lost: int = 0
+    damaged: int = 0
+    updated_at: Optional[datetime] = None
+    model_config = ConfigDict(from_attributes=True)
+
+
 class BookResponse(BookBase):
     id: PositiveInt
     isbn: str
     library_barcode: str
     created_at: datetime
     updated_at: Optional[datetime] = None
+    availability: BookAvailabilityCounts = BookAvailabilityCounts()
     model_config = ConfigDict(from_attributes=True)
 
+    @field_validator("availability", mode="before")
+    @classmethod
+    def default_availability(cls, value):
+        # books without copies have no availability row yet
+        return BookAvailabilityCounts() if value is None else value
+
+
+class BookBatchRequest(BaseModel):
+    isbns: list[str] = Field(min_length=1)
+
+
+class BookBatchResponse(BaseModel):
+    books: list[BookResponse]
+    not_found: list[str]
+
+
+class BookSummary(BaseModel):
+    id: PositiveInt
+    title: str
+    author: str
+    isbn: str
+    library_barcode: str
+    available: bool
+    location: str
+    model_config = ConfigDict(from_attributes=True)
+
+
+class BookListResponse(BaseModel):
+    books: list[BookSummary]
+    next_cursor: Optional[str] = None
+
+
+class BookSearchResponse(BaseModel):
+    books: list[BookSummary]
+    next_offset: Optional[int] = None
+
+
+class ImportRowIssue(BaseModel):
+    row: int
+    isbn: Optional[str] = None
+    title: Optional[str] = None
+    detail: str
+
+
+class BookImportReport(BaseModel):
+    inserted: int
+    num_conflicts: int
+    num_invalid: int
+    conflicts: list[ImportRowIssue]
+    invalid: list[ImportRowIssue]
+
 
 class BookCopyForm(BaseModel):
     isbn: str
-    quantity: PositiveInt
+    quantity: PositiveInt = Field(le=50_000)
 
 
 class LoanForm(BaseModel):
@@ -59,6 +129,15 @@ class LoanResponse(LoanBase):
     model_config = ConfigDict(from_attributes=True)
 
 
+class LoanHistoryItem(LoanResponse):
+    returned_at: Optional[datetime] = None
+
+
+class LoanHistoryResponse(BaseModel):
+    loans: list[LoanHistoryItem]
+    next_cursor: Optional[str] = None
+
+
 class LoanModel(BaseModel):
     pass
 
@@ -82,12 +161,68 @@ class BkCopyLoanResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class CheckoutItem(BaseModel):
+    isbn: Optional[str] = None
+    copy_barcode: Optional[str] = None
+
+    @model_validator(mode="after")
+    def one_identifier(self):
+        if (self.isbn is None) == (self.copy_barcode is None):
+            raise ValueError("Give either an isbn or a copy_barcode")
+        return self
+
+
+class BulkLoanRequest(BaseModel):
+    user_uid: str
+    items: list[CheckoutItem] = Field(min_length=1)
+
+
+class BulkLoanItemResult(BaseModel):
+    isbn: Optional[str] = None
+    copy_barcode: Optional[str] = None
+    loaned: bool
+    detail: Optional[str] = None
+    loan: Optional[LoanResponse] = None
+    book_copy: Optional[BkCopyResponse] = None
+    was_scheduled: bool = False
+
+
+class BulkLoanResponse(BaseModel):
+    user_uid: str
+    loaned: int
+    failed: int
+    results: list[BulkLoanItemResult]
+
+
+class BulkReturnRequest(BaseModel):
+    barcodes: list[str] = Field(min_length=1)
+
+
+class BulkReturnItemResult(BaseModel):
+    copy_barcode: str
+    returned: bool
+    detail: Optional[str] = None
+    loan_id: Optional[str] = None
+    user_uid: Optional[str] = None
+    status: Optional[str] = None
+    days_late: int = 0
+    fine: int = 0
+
+
+class BulkReturnResponse(BaseModel):
+    returned: int
+    failed: int
+    total_fines: int
+    results: list[BulkReturnItemResult]
+
+
 class BkCopyScheduleInfo(BaseModel):
     user_uid: str
     bk_copy_barcode: str
     schedule_id: str
     status: str
     created_at: datetime
+    expires_at: datetime
     model_config = ConfigDict(from_attributes=True)
 
 
@@ -98,6 +233,13 @@ class FullScheduleInfo(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class HoldQueueInfo(BaseModel):
+    message: str
+    isbn: str
+    position: PositiveInt
+    queued_at: datetime
+
+
 class BkCopyUpdate(BaseModel):
     copy_barcode: str
     status: Literal["AVAILABLE", "LOST", "DAMAGED"]
@@ -111,4 +253,5 @@ class BkCopyUpdateResponse(BaseModel):
     message: str
     not_found_barcodes: list[str]
     num_not_found: int
+    holds_allocated: int = 0
     model_config = ConfigDict(from_attributes=True)
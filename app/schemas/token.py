@@ -6,7 +6,7 @@ class Token(BaseModel):
     token_type: str
 
 class TokenResponse(Token):
-    pass
+    refresh_token: Optional[str] = None
 
 class TokenPayload(BaseModel):
     sub: Optional[str] = None
@@ -27,6 +27,16 @@ class UserResponse(UserBase):
 
     model_config = ConfigDict(from_attributes=True)
 
+class Principal(BaseModel):
+    # what request handling needs to know about the caller
+    user_uid: str
+    email: str
+    is_active: bool
+    is_staff: bool
+    is_superuser: bool
+
+    model_config = ConfigDict(from_attributes=True, frozen=True)
+
 class UserListResponse(UserBase):
     users: List[UserResponse]
 
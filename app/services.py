@@ -1,29 +1,56 @@
+import json
 import logging
+from collections import Counter
 from datetime import timedelta, datetime, timezone
-from fastapi import HTTPException, status, Request
+from fastapi import HTTPException, status, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from pydantic import ValidationError
 from app import crud
+from app.schemas.book import BookCreate, BookResponse
 from app.utils import (
+    as_utc,
+    decode_cursor,
+    default_schedule_expiry,
+    encode_cursor,
+    generate_barcode,
     generate_book_copy_barcode,
     generate_staff_id,
+    http_date,
+    is_not_modified,
+    iter_text_lines,
+    json_default,
+    make_etag,
+    parse_import_rows,
     reraise_exceptions,
     safe_datetime_compare,
+    search_terms,
+    utc_now,
 )
 from app.models import (
     BkCopySchedule,
     Book,
-    BookCopy,
     User,
     BkCopyStatus,
     Loan,
-    ScheduleStatus,
-    Audit,
     LoanStatus,
 )
-from app.core.auth import authenticate_user, create_access_token, hash_password
+from app.core.auth import (
+    authenticate_user,
+    create_access_token,
+    create_refresh_token,
+    credentials_exception,
+    hash_password_async,
+    invalidate_principal,
+    token_expire_exception,
+    verify_token,
+)
+from app.core.cache import book_cache
 from app.core.config import Settings
-from typing import List
+from app.core.metrics import collect_metrics, register_metrics
+from app.core.revocation import revoked_tokens
+from app.core.throttle import login_throttle
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -61,6 +88,22 @@ book_copy_integrity_exception = HTTPException(
     status.HTTP_409_CONFLICT, detail="Error creating book copies"
 )
 
+invalid_cursor_exception = HTTPException(
+    status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor"
+)
+
+empty_search_exception = HTTPException(
+    status.HTTP_400_BAD_REQUEST, detail="Search query must contain at least one word"
+)
+
+
+def login_throttled_exception(retry_after: int):
+    return HTTPException(
+        status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many login attempts. Please try again later",
+        headers={"Retry-After": str(retry_after)},
+    )
+
 
 # tested
 async def create_new_book_service(
@@ -72,6 +115,7 @@ async def create_new_book_service(
         reraise_exceptions(request)
         book = Book(**book_data)
         await crud.create_new_book(db, book)
+        await crud.sync_book_search(db, book)
         logger.info(f"New book created: {book_data['title']}")
     except IntegrityError as e:
         logger.warning(f"Integrity error creating book: {e}")
@@ -86,15 +130,260 @@ async def create_new_book_service(
         await db.commit()
 
 
+# library barcodes are random, so a handful of rows in a big import can
+# collide with an existing one; those rows get a fresh barcode and retry
+IMPORT_BARCODE_RETRIES = 5
+
+
+def _report_import_issue(report: dict, kind: str, row_no: int, data: dict, detail: str):
+    report[f"num_{kind}"] += 1
+    if len(report[kind]) < settings.import_report_limit:
+        data = data or {}
+        report[kind].append(
+            {
+                "row": row_no,
+                "isbn": data.get("isbn"),
+                "title": data.get("title"),
+                "detail": detail,
+            }
+        )
+
+
+async def _flush_import_batch(db: AsyncSession, batch: List[tuple], report: dict):
+    pending = []
+    seen_titles, seen_isbns = set(), set()
+    for row_no, data in batch:
+        if data["title"] in seen_titles or data["isbn"] in seen_isbns:
+            _report_import_issue(
+                report,
+                "conflicts",
+                row_no,
+                data,
+                "Duplicate title or ISBN in this import",
+            )
+            continue
+        seen_titles.add(data["title"])
+        seen_isbns.add(data["isbn"])
+        pending.append((row_no, data))
+
+    for _ in range(IMPORT_BARCODE_RETRIES):
+        if not pending:
+            break
+        for _, data in pending:
+            data["library_barcode"] = generate_barcode()
+        inserted = await crud.bulk_insert_books(db, [data for _, data in pending])
+        await crud.sync_books_search(db, inserted)
+        report["inserted"] += len(inserted)
+
+        inserted_isbns = {row["isbn"] for row in inserted}
+        rejected = [item for item in pending if item[1]["isbn"] not in inserted_isbns]
+        pending = []
+        if not rejected:
+            break
+        titles, isbns = await crud.get_existing_titles_isbns(
+            db,
+            {data["title"] for _, data in rejected},
+            {data["isbn"] for _, data in rejected},
+        )
+        for row_no, data in rejected:
+            if data["title"] in titles or data["isbn"] in isbns:
+                _report_import_issue(
+                    report, "conflicts", row_no, data, book_integrity_exception.detail
+                )
+            else:
+                pending.append((row_no, data))
+
+    for row_no, data in pending:
+        _report_import_issue(
+            report, "conflicts", row_no, data, "Could not allocate a library barcode"
+        )
+    await db.commit()
+
+
+async def import_books(
+    db: AsyncSession, rows: AsyncIterator[tuple[int, dict | None]], batch_size: int
+):
+    """
+    Validates `rows` against BookCreate and bulk inserts them `batch_size`
+    at a time, committing per batch. Invalid or conflicting rows are
+    reported and skipped instead of aborting the load.
+    """
+    report = {
+        "inserted": 0,
+        "num_conflicts": 0,
+        "num_invalid": 0,
+        "conflicts": [],
+        "invalid": [],
+    }
+    batch = []
+    async for row_no, data in rows:
+        if data is None:
+            _report_import_issue(report, "invalid", row_no, {}, "Malformed row")
+            continue
+        try:
+            book = BookCreate.model_validate(data)
+        except ValidationError as e:
+            fields = sorted({str(err["loc"][0]) for err in e.errors() if err["loc"]})
+            _report_import_issue(
+                report, "invalid", row_no, data, f"Invalid fields: {fields}"
+            )
+            continue
+        batch.append((row_no, book.model_dump()))
+        if len(batch) >= batch_size:
+            await _flush_import_batch(db, batch, report)
+            batch = []
+    if batch:
+        await _flush_import_batch(db, batch, report)
+    return report
+
+
+async def import_books_service(
+    request: Request, db: AsyncSession, fmt: str, batch_size: Optional[int] = None
+):
+    report = None
+    try:
+        reraise_exceptions(request)
+        rows = parse_import_rows(iter_text_lines(request.stream()), fmt)
+        report = await import_books(db, rows, batch_size or settings.import_batch_size)
+        logger.info(
+            f"Imported {report['inserted']} books, "
+            f"{report['num_conflicts']} conflicts, {report['num_invalid']} invalid"
+        )
+    except HTTPException:
+        raise
+    except SQLAlchemyError as e:
+        logger.error(f"DataBase error importing books: {e}")
+        await db.rollback()
+        raise internal_error_exception
+    else:
+        request.state.msg = {"message": f"Imported {report['inserted']} books"}
+        return report
+
+
+async def _catalog_ndjson(db: AsyncSession, since: Optional[int]):
+    book = None
+    try:
+        rows = await crud.stream_catalog(db, since)
+        async for row in rows:
+            if book is None or row["id"] != book["id"]:
+                if book is not None:
+                    yield json.dumps(book, default=json_default) + "\n"
+                book = {key: row[key] for key in Book.__table__.columns.keys()}
+                book["copies"] = []
+            if row["copy_barcode"] is not None:
+                book["copies"].append(
+                    {
+                        "copy_barcode": row["copy_barcode"],
+                        "serial": row["serial"],
+                        "status": row["copy_status"],
+                    }
+                )
+        if book is not None:
+            yield json.dumps(book, default=json_default) + "\n"
+    except SQLAlchemyError as e:
+        # headers are already out, all we can do is cut the stream short
+        logger.error(
+            f"DataBase error exporting catalog after book {book and book['id']}: {e}"
+        )
+        await db.rollback()
+
+
+async def export_catalog_service(
+    request: Request, db: AsyncSession, since: Optional[int] = None
+):
+    """
+    Returns an async iterator of NDJSON lines, one book per line with its
+    copies nested. Resume an interrupted export with the last `id` seen.
+    """
+    reraise_exceptions(request)
+    request.state.msg = {"message": f"Catalog export started after book id {since}"}
+    return _catalog_ndjson(db, since)
+
+
+async def invalidate_book_cache(isbn: int | str):
+    await book_cache.delete(str(isbn))
+
+
+async def invalidate_stale_books(db: AsyncSession):
+    """Drops cached books whose copy counts changed in the committed work."""
+    for isbn in db.info.pop("stale_isbns", ()):
+        await invalidate_book_cache(isbn)
+
+
+async def invalidate_stale_principals(db: AsyncSession):
+    """Drops cached principals of users updated in the committed work."""
+    for email in db.info.pop("stale_principals", ()):
+        await invalidate_principal(email)
+
+
+def _book_validators(book: dict):
+    """ETag and Last-Modified for a BookResponse-shaped dict."""
+    availability = book.get("availability") or {}
+    stamps = [book["updated_at"] or book["created_at"], availability.get("updated_at")]
+    last_modified = max(as_utc(stamp) for stamp in stamps if stamp)
+    counts = [availability.get(col) or 0 for col in crud.AVAILABILITY_COLUMNS.values()]
+    return make_etag(book["id"], last_modified.isoformat(), *counts), last_modified
+
+
+def _validator_headers(etag: str, last_modified: datetime):
+    return {
+        "ETag": etag,
+        "Last-Modified": http_date(last_modified),
+        "Cache-Control": "private, no-cache",
+    }
+
+
 # tested
-async def get_book_by_isbn_service(request: Request, db: AsyncSession, isbn: int):
+async def get_book_by_isbn_service(
+    request: Request,
+    db: AsyncSession,
+    isbn: int,
+    response: Optional[Response] = None,
+):
     try:
         reraise_exceptions(request)
-        book = await crud.get_book_by_isbn(db, isbn)
-        if not book:
-            raise book_not_found_exception
+        book = await book_cache.get(str(isbn))
+        if book is None and (
+            "if-none-match" in request.headers or "if-modified-since" in request.headers
+        ):
+            # conditional request and nothing cached: settle it on the version
+            # columns before paying for the full row
+            version = await crud.get_book_version(db, isbn)
+            if not version:
+                raise book_not_found_exception
+            etag, last_modified = _book_validators(
+                {
+                    "id": version["id"],
+                    "created_at": version["created_at"],
+                    "updated_at": version["updated_at"],
+                    "availability": {
+                        **{
+                            col: version[col]
+                            for col in crud.AVAILABILITY_COLUMNS.values()
+                        },
+                        "updated_at": version["availability_updated_at"],
+                    },
+                }
+            )
+            if is_not_modified(request, etag, last_modified):
+                return Response(
+                    status_code=status.HTTP_304_NOT_MODIFIED,
+                    headers=_validator_headers(etag, last_modified),
+                )
+        if book is None:
+            db_book = await crud.get_book_by_isbn(db, isbn)
+            if not db_book:
+                raise book_not_found_exception
+            book = BookResponse.model_validate(db_book).model_dump()
+            await book_cache.set(str(isbn), book)
 
-        logger.info(f"Retrieved book: {book.library_barcode}")
+        etag, last_modified = _book_validators(book)
+        headers = _validator_headers(etag, last_modified)
+        if is_not_modified(request, etag, last_modified):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        if response is not None:
+            response.headers.update(headers)
+        logger.info(f"Retrieved book: {book['library_barcode']}")
     except HTTPException:
         raise
     except SQLAlchemyError as e:
@@ -105,6 +394,108 @@ async def get_book_by_isbn_service(request: Request, db: AsyncSession, isbn: int
         return book
 
 
+# tested
+async def list_books_service(
+    request: Request,
+    db: AsyncSession,
+    limit: int,
+    sort: str = "id",
+    cursor: Optional[str] = None,
+    author: Optional[str] = None,
+    location: Optional[str] = None,
+    available: Optional[bool] = None,
+):
+    try:
+        reraise_exceptions(request)
+        after = None
+        if cursor:
+            decoded = decode_cursor(cursor)
+            if not decoded or decoded.get("sort") != sort or "after" not in decoded:
+                raise invalid_cursor_exception
+            after = decoded["after"]
+        rows = await crud.get_books_page(
+            db,
+            limit,
+            sort=sort,
+            after=after,
+            author=author,
+            location=location,
+            available=available,
+        )
+    except HTTPException:
+        raise
+    except SQLAlchemyError as e:
+        logger.error(f"DataBase error listing books: {e}")
+        await db.rollback()
+        raise internal_error_exception
+    else:
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor({"sort": sort, "after": rows[-1][sort]})
+        return {"books": rows, "next_cursor": next_cursor}
+
+
+# tested
+async def search_books_service(
+    request: Request, db: AsyncSession, query: str, limit: int, offset: int = 0
+):
+    try:
+        reraise_exceptions(request)
+        terms = search_terms(query)
+        if not terms:
+            raise empty_search_exception
+        rows = await crud.search_books(db, terms, limit, offset)
+    except HTTPException:
+        raise
+    except SQLAlchemyError as e:
+        logger.error(f"DataBase error searching books: {e}")
+        await db.rollback()
+        raise internal_error_exception
+    else:
+        next_offset = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_offset = offset + limit
+        return {"books": rows, "next_offset": next_offset}
+
+
+# tested
+async def get_books_by_isbns_service(
+    request: Request, db: AsyncSession, isbns: List[str]
+):
+    try:
+        reraise_exceptions(request)
+        isbns = list(dict.fromkeys(isbns))  # dedupe, keep request order
+        if len(isbns) > settings.batch_fetch_max_isbns:
+            raise HTTPException(
+                status.HTTP_422_UNPROCESSABLE_CONTENT,
+                detail=f"At most {settings.batch_fetch_max_isbns} ISBNs per request",
+            )
+        found = {}
+        for isbn in isbns:
+            book = await book_cache.get(isbn)
+            if book is not None:
+                found[isbn] = book
+        missing = [isbn for isbn in isbns if isbn not in found]
+        if missing:
+            for db_book in await crud.get_books_by_isbns(db, missing):
+                book = BookResponse.model_validate(db_book).model_dump()
+                await book_cache.set(db_book.isbn, book)
+                found[db_book.isbn] = book
+    except HTTPException:
+        raise
+    except SQLAlchemyError as e:
+        logger.error(f"DataBase error retrieving books: {e}")
+        await db.rollback()
+        raise internal_error_exception
+    else:
+        return {
+            "books": [found[isbn] for isbn in isbns if isbn in found],
+            "not_found": [isbn for isbn in isbns if isbn not in found],
+        }
+
+
 # tested
 async def update_book_service(
     request: Request, db: AsyncSession, update_data: dict, isbn: int, current_user: User
@@ -115,6 +506,8 @@ async def update_book_service(
         if not book:
             raise book_not_found_exception
         await crud.update_book(db, book, update_data)
+        if {"title", "author"} & update_data.keys():
+            await crud.sync_book_search(db, book)
         logger.info(f"Book-{book.library_barcode} updated")
     except IntegrityError as e:
         await db.rollback()
@@ -128,12 +521,16 @@ async def update_book_service(
         raise internal_error_exception
     else:
         await db.commit()
+        await invalidate_book_cache(isbn)
         request.state.msg = {
             "message": f"Book-{book.library_barcode} updated, fields updated: {list(update_data.keys())}"
         }
         return current_user
 
 
+COPY_INSERT_BATCH_SIZE = 5000
+
+
 # tested
 async def add_book_copies_service(
     request: Request,
@@ -143,25 +540,28 @@ async def add_book_copies_service(
 ):
     try:
         reraise_exceptions(request)
-        book_copies = []
-        last_serial = 0
         book = await crud.get_book_by_isbn(db, isbn)
         if not book:
             raise book_not_found_exception
+        # claim the whole serial range up front, concurrent requests for the
+        # same book get disjoint ranges instead of racing on the last copy
+        last_serial = await crud.reserve_copy_serials(db, book.isbn, quantity)
+        first_serial = last_serial - quantity + 1
         book_lib_barcode = book.library_barcode
-        # get last bookcopy where isbn == book.isbn
-        last_book_copy = await crud.get_last_book_copy(db, book)
-        if last_book_copy:
-            last_serial = last_book_copy.serial
-        for i in range(quantity):
-            bk_copy_serial = last_serial + 1
-            barcode = generate_book_copy_barcode(book_lib_barcode, bk_copy_serial)
-            book_copy = BookCopy(
-                book_isbn=isbn, serial=bk_copy_serial, copy_barcode=barcode
-            )
-            book_copies.append(book_copy)
-            last_serial += 1
-        await crud.add_book_copies(db, book_copies)
+        for start in range(first_serial, last_serial + 1, COPY_INSERT_BATCH_SIZE):
+            stop = min(start + COPY_INSERT_BATCH_SIZE, last_serial + 1)
+            copies = [
+                {
+                    "serial": serial,
+                    "copy_barcode": generate_book_copy_barcode(
+                        book_lib_barcode, serial
+                    ),
+                }
+                for serial in range(start, stop)
+            ]
+            await crud.add_book_copies(db, book.isbn, copies)
+            # new copies serve the hold queue before anyone else
+            await allocate_holds(db, ((c["copy_barcode"], book.isbn) for c in copies))
         logger.info(f"Created {quantity} copies of {isbn}")
     except IntegrityError as e:
         await db.rollback()
@@ -175,6 +575,7 @@ async def add_book_copies_service(
         raise internal_error_exception
     else:
         await db.commit()
+        await invalidate_stale_books(db)
         msg = {"message": f"{quantity} copies of ISBN-{isbn} were created successfully"}
         request.state.msg = msg
         return msg
@@ -187,66 +588,52 @@ async def loan_book_service(
     created_loan = None
     updated_bk_copy = None
     try:
-        user = await crud.get_user_by_uid(db, user_uid)
-        if not user:
+        # one query for the user, their loan count and any schedule on isbn
+        eligibility = await crud.get_checkout_eligibility(db, user_uid, isbn)
+        if not eligibility:
             raise user_not_found_exception
         bk_schedule_is_available = (
             False  # determines which return is used depending on if bk_schedule is None
         )
-        user_loans = await crud.get_user_active_loans(db, user.user_uid)
-        if (len(user_loans) >= 3) or (user.fine_balance >= 10):  # been a bit easy here
+        if (eligibility["active_loans"] >= settings.max_active_loans) or (
+            eligibility["fine_balance"] >= settings.max_fine_balance
+        ):  # been a bit easy here
             raise loan_eligibility_exception
 
-        bk_schedule = await crud.get_active_schedule(
-            db, isbn, user.user_uid
-        )  # returns first record
-        if bk_schedule:
-            reserved_bk_copy = await crud.get_reserved_bk_copy_by_barcode(
-                db, bk_schedule.bk_copy_barcode
+        if eligibility["schedule_id"]:
+            updated_bk_copy = await crud.claim_book_copy(
+                db,
+                isbn,
+                BkCopyStatus.BORROWED,
+                current_status=BkCopyStatus.RESERVED,
+                copy_barcode=eligibility["schedule_copy_barcode"],
             )
-            if not reserved_bk_copy:
-                raise HTTPException(
-                    status.HTTP_404_NOT_FOUND, detail="Scheduled book copy not found"
-                )
-            if reserved_bk_copy.status != BkCopyStatus.RESERVED:
+            if not updated_bk_copy:
                 raise HTTPException(
                     status.HTTP_409_CONFLICT,
                     detail="Scheduled book copy is not available",
                 )
-            loan_data = {
-                "user_uid": user.user_uid,
-                "bk_copy_barcode": reserved_bk_copy.copy_barcode,
-            }
-            loan = Loan(**loan_data)
-            created_loan = await crud.create_loan(db, loan)
-            updated_bk_copy = await crud.update_bk_copy(
-                db, reserved_bk_copy, {"status": BkCopyStatus.BORROWED}
-            )
-            await crud.update_bk_schedule(
-                db, bk_schedule, {"status": ScheduleStatus.CONSUMED}
-            )
+            await crud.consume_schedules(db, [eligibility["schedule_id"]])
             logger.info("Retrieved scheduled book copy")
             bk_schedule_is_available = True
 
         if not bk_schedule_is_available:
-            book_copy = await crud.get_book_copy(db, isbn)
-            if not book_copy:
+            # claimed and flipped to BORROWED in one statement
+            updated_bk_copy = await crud.claim_book_copy(
+                db, isbn, BkCopyStatus.BORROWED
+            )
+            if not updated_bk_copy:
                 raise HTTPException(
                     status.HTTP_404_NOT_FOUND,
                     detail=f"There are no available copies of ISBN-{isbn} currently and user does not have any active schedules",
                 )
-            loan_data = {
-                "user_uid": user.user_uid,
-                "bk_copy_barcode": book_copy.copy_barcode,
-            }
-
-            loan = Loan(**loan_data)
-            created_loan = await crud.create_loan(db, loan)
-            updated_bk_copy = await crud.update_bk_copy(
-                db, book_copy, {"status": BkCopyStatus.BORROWED}
-            )
-
             logger.info("Retrieved book copy")
+
+        loan_data = {
+            "user_uid": eligibility["user_uid"],
+            "bk_copy_barcode": updated_bk_copy.copy_barcode,
+        }
+        created_loan = await crud.create_loan(db, Loan(**loan_data))
     except IntegrityError as e:
         logger.warning(f"Integrity error fetching book_copy: {e}")
         await db.rollback()
@@ -261,6 +648,7 @@ async def loan_book_service(
         raise internal_error_exception
     else:
         await db.commit()
+        await invalidate_stale_books(db)
         if bk_schedule_is_available:
             return {
                 "loan": created_loan,
@@ -274,6 +662,112 @@ async def loan_book_service(
         }
 
 
+async def loan_books_service(
+    request: Request, db: AsyncSession, user_uid: str, items: List[dict]
+):
+    """
+    Checks out several copies to one patron in a single transaction.
+    Eligibility is checked once against the loans the patron would end up
+    with; each item then goes through the same steps as
+    loan_book_service (the patron's schedule first, then any available
+    copy) and reports its own outcome, so one missing copy does not send
+    the rest of the pile back.
+    """
+    results = []
+    loans = []
+    try:
+        reraise_exceptions(request)
+        eligibility = await crud.get_checkout_eligibility(db, user_uid)
+        if not eligibility:
+            raise user_not_found_exception
+        if (eligibility["active_loans"] + len(items) > settings.max_active_loans) or (
+            eligibility["fine_balance"] >= settings.max_fine_balance
+        ):
+            raise loan_eligibility_exception
+
+        schedules = await crud.get_active_schedules(db, user_uid)
+        schedules_by_barcode = {s.bk_copy_barcode: s for s in schedules}
+        consumed_schedules = []
+        for item in items:
+            isbn, copy_barcode = item["isbn"], item["copy_barcode"]
+            if copy_barcode is not None:
+                schedule = schedules_by_barcode.pop(copy_barcode, None)
+            else:
+                schedule = next(
+                    (s for s in schedules_by_barcode.values() if s.book_isbn == isbn),
+                    None,
+                )
+                if schedule is not None:
+                    del schedules_by_barcode[schedule.bk_copy_barcode]
+
+            if schedule is not None:
+                bk_copy = await crud.claim_book_copy(
+                    db,
+                    schedule.book_isbn,
+                    BkCopyStatus.BORROWED,
+                    current_status=BkCopyStatus.RESERVED,
+                    copy_barcode=schedule.bk_copy_barcode,
+                )
+            else:
+                bk_copy = await crud.claim_book_copy(
+                    db, isbn, BkCopyStatus.BORROWED, copy_barcode=copy_barcode
+                )
+            if not bk_copy:
+                results.append(
+                    {
+                        **item,
+                        "loaned": False,
+                        "detail": "Book copy is not available"
+                        if copy_barcode is not None
+                        else f"There are no available copies of ISBN-{isbn} currently",
+                    }
+                )
+                continue
+
+            if schedule is not None:
+                consumed_schedules.append(schedule.id)
+            loan = Loan(
+                user_uid=eligibility["user_uid"], bk_copy_barcode=bk_copy.copy_barcode
+            )
+            loans.append(loan)
+            results.append(
+                {
+                    **item,
+                    "loaned": True,
+                    "loan": loan,
+                    "book_copy": bk_copy,
+                    "was_scheduled": schedule is not None,
+                }
+            )
+
+        if consumed_schedules:
+            await crud.consume_schedules(db, consumed_schedules)
+        if loans:
+            await crud.create_loans(db, loans)
+    except IntegrityError as e:
+        logger.warning(f"Integrity error creating loans: {e}")
+        await db.rollback()
+        raise HTTPException(
+            status.HTTP_409_CONFLICT, detail="Loan with this id already exists"
+        )
+    except HTTPException:
+        raise
+    except SQLAlchemyError as e:
+        logger.error(f"DataBase error creating loans: {e}")
+        await db.rollback()
+        raise internal_error_exception
+    else:
+        await db.commit()
+        await invalidate_stale_books(db)
+        logger.info(f"Checked out {len(loans)} of {len(items)} items to {user_uid}")
+        return {
+            "user_uid": eligibility["user_uid"],
+            "loaned": len(loans),
+            "failed": len(items) - len(loans),
+            "results": results,
+        }
+
+
 # tested
 async def create_user_service(
     request: Request,
@@ -283,7 +777,7 @@ async def create_user_service(
     try:
         # reraise_exceptions(request)
         data = user_data.copy()
-        data["password"] = hash_password(data["password"])
+        data["password"] = await hash_password_async(data["password"])
         user = await crud.create_new_user(db, User(**data))
         request.state.actor = user
         logger.info("Created new user successfully")
@@ -313,6 +807,10 @@ async def login_user_service(
         ACCESS_TOKEN_EXPIRE_MINUTES = timedelta(
             minutes=settings.access_token_expire_minutes
         )
+        client_ip = request.client.host if request.client else None
+        retry_after = await login_throttle.check(user_data["email"], client_ip)
+        if retry_after:
+            raise login_throttled_exception(retry_after)
         user, exc = await authenticate_user(user_data, db)
         request.state.actor = user
         if exc:
@@ -325,6 +823,7 @@ async def login_user_service(
                 "is_staff": user.is_staff,
             }
             token = create_access_token(data, user, ACCESS_TOKEN_EXPIRE_MINUTES)
+            refresh_token = create_refresh_token(user)
     except HTTPException:
         await db.rollback()
         raise
@@ -334,7 +833,119 @@ async def login_user_service(
         raise internal_error_exception
     else:
         await db.commit()
-        return {"access_token": token, "token_type": "bearer"}
+        return {
+            "access_token": token,
+            "refresh_token": refresh_token,
+            "token_type": "bearer",
+        }
+
+
+def _revocation(payload: dict) -> dict:
+    return {
+        "jti": payload["jti"],
+        "user_uid": payload.get("user_uid"),
+        "token_type": payload.get("type", "access"),
+        "expires_at": datetime.fromtimestamp(payload["exp"], timezone.utc),
+    }
+
+
+# tested
+async def refresh_access_token_service(
+    request: Request,
+    db: AsyncSession,
+    refresh_token: str,
+):
+    """
+    Mints a new access token from a refresh token without a password check.
+    The refresh token is rotated: the presented one is revoked and a new
+    one is returned with the access token.
+    """
+    try:
+        payload = await verify_token(refresh_token)
+        if not payload or payload.get("type") != "refresh" or "jti" not in payload:
+            raise credentials_exception
+        if payload["exp"] <= utc_now().timestamp():
+            raise token_expire_exception
+        # refresh tokens are checked in the table, not the revocation filter:
+        # every rotation revokes one, which would soon saturate the filter
+        if await crud.is_token_revoked(db, payload["jti"]):
+            raise credentials_exception
+        user = await crud.get_user_by_email(db, payload["sub"])
+        request.state.actor = user
+        if not user or not user.is_active:
+            raise credentials_exception
+        await crud.revoke_tokens(db, [_revocation(payload)])
+        data = {
+            "sub": user.email,
+            "user_uid": user.user_uid,
+            "is_staff": user.is_staff,
+        }
+        token = create_access_token(
+            data, user, timedelta(minutes=settings.access_token_expire_minutes)
+        )
+        new_refresh_token = create_refresh_token(user)
+    except IntegrityError:
+        # a concurrent refresh already rotated this token
+        await db.rollback()
+        raise credentials_exception
+    except HTTPException:
+        await db.rollback()
+        raise
+    except SQLAlchemyError as e:
+        await db.rollback()
+        logger.error(f"DataBase error refreshing token: {e}")
+        raise internal_error_exception
+    else:
+        await db.commit()
+        return {
+            "access_token": token,
+            "refresh_token": new_refresh_token,
+            "token_type": "bearer",
+        }
+
+
+# tested
+async def logout_user_service(
+    request: Request,
+    db: AsyncSession,
+    current_user: User,
+    refresh_token: Optional[str] = None,
+):
+    """
+    Revokes the access token used for this request and, when given, the
+    caller's refresh token.
+    """
+    try:
+        reraise_exceptions(request)
+        revocations = []
+        access = request.state.auth.claims
+        if access.get("jti"):
+            revocations.append(_revocation(access))
+        if refresh_token:
+            payload = await verify_token(refresh_token)
+            if (
+                payload
+                and payload.get("type") == "refresh"
+                and payload.get("sub") == current_user.email
+                and payload.get("jti")
+                and not await crud.is_token_revoked(db, payload["jti"])
+            ):
+                revocations.append(_revocation(payload))
+        if revocations:
+            await crud.revoke_tokens(db, revocations)
+    except HTTPException:
+        raise
+    except SQLAlchemyError as e:
+        await db.rollback()
+        logger.error(f"DataBase error revoking tokens: {e}")
+        raise internal_error_exception
+    else:
+        await db.commit()
+        for revocation in revocations:
+            if revocation["token_type"] == "access":
+                revoked_tokens.add(revocation["jti"])
+        request.state.msg = {"message": "Logged out"}
+        return {"revoked": len(revocations)}
 
 
 async def get_all_non_staff_users_service(
@@ -379,12 +990,6 @@ async def return_book_loan_service(
         book_returned = await crud.get_book_copy_by_barcode(db, bk_copy_barcode_)
         if not book_returned:
             raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Book copy not found")
-        if book_returned.status != BkCopyStatus.BORROWED:
-            raise HTTPException(
-                status.HTTP_409_CONFLICT,
-                detail="This book copy is not currently on loan",
-            )
-        await crud.update_bk_copy(db, book_returned, {"status": BkCopyStatus.IN_CHECK})
 
         returned_at = datetime.now(timezone.utc).replace(
             minute=0, second=0, microsecond=0
@@ -392,18 +997,32 @@ async def return_book_loan_service(
         loan_status = LoanStatus.RETURNED
         if safe_datetime_compare(returned_at, loan.due_at):  # overdue
             loan_status = LoanStatus.RETURNED_LATE
-            days_deltas = (returned_at.date() - loan.due_at.date()).days
-            fine = 100 * days_deltas
+        # only a loan that is still open is closed, so returning an old loan
+        # again neither fines the patron twice nor touches their counts
+        closed = await crud.close_loans(db, [loan.id], loan_status, returned_at)
+        if not closed:
+            raise HTTPException(
+                status.HTTP_409_CONFLICT,
+                detail="This loan has already been returned",
+            )
+        moved = await crud.set_copies_status(
+            db, [bk_copy_barcode_], BkCopyStatus.BORROWED, BkCopyStatus.IN_CHECK
+        )
+        if not moved:
+            raise HTTPException(
+                status.HTTP_409_CONFLICT,
+                detail="This book copy is not currently on loan",
+            )
+
+        if loan_status == LoanStatus.RETURNED_LATE:
+            days_deltas = (returned_at.date() - closed[0].due_at.date()).days
+            # days already charged by the overdue sweep are not charged again
+            fine = settings.late_fee_per_day * max(
+                days_deltas - closed[0].fined_days, 0
+            )
             fine_fee = fine
             fined = True
-            user = await crud.get_user_by_id(db, loan.user_id)
-            if not user:
-                raise user_not_found_exception
-            updated_fine = fine + user.fine_balance
-            await crud.update_user(db, user, update_data={"fine_balance": updated_fine})
-
-        loan_data = {"status": loan_status, "returned_at": returned_at}
-        await crud.update_loan(db, loan, loan_data)
+            await crud.add_user_fines(db, {loan.user_uid: fine})
     except HTTPException:
         await db.rollback()
         raise
@@ -413,6 +1032,7 @@ async def return_book_loan_service(
         raise internal_error_exception
     else:
         await db.commit()
+        await invalidate_stale_books(db)
         return (
             {
                 "message": "User loan cleared, you have also been fined for delay",
@@ -424,28 +1044,201 @@ async def return_book_loan_service(
         )
 
 
+async def return_books_service(request: Request, db: AsyncSession, barcodes: List[str]):
+    """
+    Book-drop returns: closes the active loan on every scanned copy with a
+    handful of set-based statements instead of a round trip per item. Late
+    returns are fined per day overdue, less what the overdue sweep already
+    charged, summed per patron. Copies go to
+    IN_CHECK for staff inspection, as with a single return.
+    """
+    barcodes = list(dict.fromkeys(barcodes))  # a copy scanned twice returns once
+    try:
+        reraise_exceptions(request)
+        if len(barcodes) > settings.bulk_return_max_items:
+            raise HTTPException(
+                status.HTTP_422_UNPROCESSABLE_CONTENT,
+                detail=f"At most {settings.bulk_return_max_items} copies per request",
+            )
+        returned_at = datetime.now(timezone.utc).replace(
+            minute=0, second=0, microsecond=0
+        )
+        loan_ids = {LoanStatus.RETURNED: [], LoanStatus.RETURNED_LATE: []}
+        days_late = {}
+        for loan in await crud.get_active_loans_by_barcodes(db, barcodes):
+            days_late[loan.id] = 0
+            if safe_datetime_compare(returned_at, loan.due_at):
+                days_late[loan.id] = (returned_at.date() - loan.due_at.date()).days
+            loan_status = (
+                LoanStatus.RETURNED_LATE if days_late[loan.id] else LoanStatus.RETURNED
+            )
+            loan_ids[loan_status].append(loan.id)
+        # fines, counts and results follow the loans the UPDATE actually
+        # closed, the read above may be stale by the time it runs
+        loans = {}
+        for loan_status, ids in loan_ids.items():
+            for row in await crud.close_loans(db, ids, loan_status, returned_at):
+                loans[row.bk_copy_barcode] = (row, loan_status)
+        await crud.set_copies_status(
+            db, list(loans), BkCopyStatus.BORROWED, BkCopyStatus.IN_CHECK
+        )
+
+        results = []
+        fines = Counter()
+        for barcode in barcodes:
+            if barcode not in loans:
+                results.append(
+                    {
+                        "copy_barcode": barcode,
+                        "returned": False,
+                        "detail": "This book copy is not currently on loan",
+                    }
+                )
+                continue
+            loan, loan_status = loans[barcode]
+            fine = settings.late_fee_per_day * max(
+                days_late[loan.id] - loan.fined_days, 0
+            )
+            if fine:
+                fines[loan.user_uid] += fine
+            results.append(
+                {
+                    "copy_barcode": barcode,
+                    "returned": True,
+                    "loan_id": loan.loan_id,
+                    "user_uid": loan.user_uid,
+                    "status": loan_status.value,
+                    "days_late": days_late[loan.id],
+                    "fine": fine,
+                }
+            )
+        await crud.add_user_fines(db, fines)
+    except HTTPException:
+        raise
+    except SQLAlchemyError as e:
+        await db.rollback()
+        logger.error(f"DataBase error clearing loans: {e}")
+        raise internal_error_exception
+    else:
+        await db.commit()
+        await invalidate_stale_books(db)
+        logger.info(f"Returned {len(loans)} of {len(barcodes)} scanned copies")
+        return {
+            "returned": len(loans),
+            "failed": len(barcodes) - len(loans),
+            "total_fines": sum(fines.values()),
+            "results": results,
+        }
+
+
+# tested
+async def get_hold_position_service(
+    request: Request, db: AsyncSession, isbn: str, current_user: User
+):
+    try:
+        reraise_exceptions(request)
+        hold = await crud.get_waiting_hold(db, current_user.user_uid, isbn)
+        if hold is None:
+            raise HTTPException(
+                status.HTTP_404_NOT_FOUND, detail="No waiting hold on this ISBN"
+            )
+        position = await crud.get_hold_position(db, hold)
+    except HTTPException:
+        raise
+    except SQLAlchemyError as e:
+        logger.error(f"DataBase error fetching hold position: {e}")
+        await db.rollback()
+        raise internal_error_exception
+    else:
+        return {
+            "message": "You are in the hold queue",
+            "isbn": hold.book_isbn,
+            "position": position,
+            "queued_at": hold.created_at,
+        }
+
+
+async def allocate_holds(db: AsyncSession, copies: Iterable[Tuple[str, str]]) -> int:
+    """
+    Offers each (copy_barcode, isbn) that just became AVAILABLE to the first
+    patron in its ISBN's hold queue still eligible for a schedule: the hold
+    and the copy are both claimed atomically and the patron gets a schedule
+    to collect it within hold_pickup_hours. Runs in the caller's
+    transaction, returns the number of holds allocated.
+    """
+    allocated = 0
+    drained = set()
+    for barcode, isbn in copies:
+        if isbn in drained:
+            continue
+        hold = await crud.claim_next_hold(
+            db, isbn, settings.max_active_loans, settings.max_fine_balance
+        )
+        if hold is None:
+            drained.add(isbn)
+            continue
+        book_copy = await crud.claim_book_copy(
+            db, isbn, BkCopyStatus.RESERVED, copy_barcode=barcode
+        )
+        if book_copy is None:  # taken in the meantime, the hold keeps its place
+            await crud.set_hold_schedule(db, hold.id, None)
+            continue
+        pickup_by = datetime.now(timezone.utc) + timedelta(
+            hours=settings.hold_pickup_hours
+        )
+        schedule = await crud.create_schedule(
+            db,
+            BkCopySchedule(
+                user_uid=hold.user_uid,
+                bk_copy_barcode=barcode,
+                expires_at=default_schedule_expiry(
+                    pickup_by, cutoff_hour=settings.schedule_cutoff_hour
+                ),
+            ),
+        )
+        await crud.set_hold_schedule(db, hold.id, schedule.id)
+        allocated += 1
+    if allocated:
+        logger.info(f"Allocated {allocated} copies to waiting holds")
+    return allocated
+
+
 # tested
 async def schedule_book_copy_service(
-    request: Request, db: AsyncSession, isbn: int, current_user: User
+    request: Request,
+    db: AsyncSession,
+    isbn: int,
+    current_user: User,
+    response: Optional[Response] = None,
 ):
+    """
+    Reserves a copy of the ISBN for the patron, or, with none free, puts
+    them in the ISBN's hold queue (202 with their position).
+    """
+    hold = None
     try:
         reraise_exceptions(request)
-        user_loans = await crud.get_user_active_loans(db, current_user.user_uid)
-        if (len(user_loans) >= 3) or (current_user.fine_balance >= 10):
+        eligibility = await crud.get_checkout_eligibility(db, current_user.user_uid)
+        if (eligibility["active_loans"] >= settings.max_active_loans) or (
+            eligibility["fine_balance"] >= settings.max_fine_balance
+        ):
             raise schd_eligibility_exception
 
-        book_copy = await crud.get_book_copy(db, isbn)
+        book_copy = await crud.claim_book_copy(db, isbn, BkCopyStatus.RESERVED)
         if not book_copy:
-            raise book_not_found_exception
-
-        await crud.update_bk_copy(
-            db, book_copy, update_data={"status": BkCopyStatus.RESERVED}
-        )
-        schedule_data = {
-            "user_uid": current_user.user_uid,
-            "bk_copy_barcode": book_copy.copy_barcode,
-        }
-        schedule = await crud.create_schedule(db, BkCopySchedule(**schedule_data))
+            if not await crud.book_exists(db, isbn):
+                raise book_not_found_exception
+            hold = await crud.create_hold(db, current_user.user_uid, isbn)
+            position = await crud.get_hold_position(db, hold)
+        else:
+            schedule_data = {
+                "user_uid": current_user.user_uid,
+                "bk_copy_barcode": book_copy.copy_barcode,
+                "expires_at": default_schedule_expiry(
+                    cutoff_hour=settings.schedule_cutoff_hour
+                ),
+            }
+            schedule = await crud.create_schedule(db, BkCopySchedule(**schedule_data))
     except IntegrityError as e:
         await db.rollback()
         logger.warning(f"Integrity error creating schedule: {e}")
@@ -461,26 +1254,272 @@ async def schedule_book_copy_service(
         raise internal_error_exception
     else:
         await db.commit()
+        await invalidate_stale_books(db)
+        if hold is not None:
+            if response is not None:
+                response.status_code = status.HTTP_202_ACCEPTED
+            return {
+                "message": "No copy is free right now, you have been added to the hold queue",
+                "isbn": hold.book_isbn,
+                "position": position,
+                "queued_at": hold.created_at,
+            }
         return {
             "message": "Schedule has been successfuly created",
-            "note": "All schedules that have'nt been consumed will be cleared by 6pm",
+            "note": "Schedules that have'nt been consumed are released at expires_at",
             "schedule_info": schedule,
         }
 
 
-async def create_audit_service(db: AsyncSession, details: dict):
+async def reconcile_availability_service(request: Request, db: AsyncSession):
+    try:
+        reraise_exceptions(request)
+        num_isbns = await crud.rebuild_availability(db)
+    except HTTPException:
+        raise
+    except SQLAlchemyError as e:
+        logger.error(f"DataBase error rebuilding availability counts: {e}")
+        await db.rollback()
+        raise internal_error_exception
+    else:
+        await db.commit()
+        await book_cache.clear()
+        msg = {"message": f"Availability counts rebuilt for {num_isbns} ISBNs"}
+        request.state.msg = msg
+        return msg
+
+
+async def rebuild_books_search_service(request: Request, db: AsyncSession):
     try:
-        audit = Audit(**details)
-        await crud.add_audit(db, audit)
+        reraise_exceptions(request)
+        num_books = await crud.rebuild_books_search(db)
     except HTTPException:
+        raise
+    except SQLAlchemyError as e:
+        logger.error(f"DataBase error rebuilding the search index: {e}")
         await db.rollback()
+        raise internal_error_exception
+    else:
+        await db.commit()
+        msg = {"message": f"Search index rebuilt for {num_books} books"}
+        request.state.msg = msg
+        return msg
+
+
+async def sweep_overdue_loans(
+    db: AsyncSession, now: Optional[datetime] = None, batch_size: Optional[int] = None
+) -> dict:
+    """
+    Flags loans past due as OVERDUE and charges their patrons for every
+    overdue day not charged yet (tracked in Loan.fined_days), so running it
+    twice on the same day charges nothing new. Works through the
+    (status, due_at) index in keyset batches of `batch_size`, committing
+    each one so no lock outlives a batch. Already overdue loans go first,
+    the ACTIVE pass then only sees loans that have just fallen due.
+    """
+    now = now or datetime.now(timezone.utc)
+    batch_size = batch_size or settings.overdue_sweep_batch_size
+    totals = Counter(scanned=0, newly_overdue=0, fined_loans=0, fines=0)
+    for loan_status in (LoanStatus.OVERDUE, LoanStatus.ACTIVE):
+        after = None
+        while True:
+            rows = await crud.get_overdue_loans_batch(
+                db, loan_status, now, batch_size, after
+            )
+            if not rows:
+                break
+            after = (rows[-1].due_at, rows[-1].id)
+            fined_days = {}
+            for row in rows:
+                days = (now.date() - as_utc(row.due_at).date()).days
+                charge = max(days - row.fined_days, 0)
+                if charge or loan_status == LoanStatus.ACTIVE:
+                    fined_days[(row.due_at, row.id)] = (
+                        row.fined_days,
+                        row.fined_days + charge,
+                    )
+            # fines only for the loans the guarded UPDATE actually changed,
+            # a loan returned since the read is neither flagged nor charged
+            updated = await crud.mark_loans_overdue(db, loan_status, fined_days)
+            fines = Counter()
+            for user_uid, charge in updated:
+                if charge:
+                    fines[user_uid] += settings.late_fee_per_day * charge
+                    totals["fined_loans"] += 1
+            await crud.add_user_fines(db, fines)
+            await db.commit()
+            totals["scanned"] += len(rows)
+            totals["fines"] += sum(fines.values())
+            if loan_status == LoanStatus.ACTIVE:
+                totals["newly_overdue"] += len(updated)
+            if len(rows) < batch_size:
+                break
+    logger.info(f"Overdue sweep: {dict(totals)}")
+    return dict(totals)
+
+
+async def sweep_overdue_service(request: Request, db: AsyncSession):
+    try:
+        reraise_exceptions(request)
+        totals = await sweep_overdue_loans(db)
+    except HTTPException:
         raise
     except SQLAlchemyError as e:
+        logger.error(f"DataBase error sweeping overdue loans: {e}")
         await db.rollback()
-        logger.error(f"DataBase error creating audit: {e}")
         raise internal_error_exception
     else:
+        request.state.msg = totals
+        return totals
+
+
+schedule_expiry_stats = Counter(runs=0, released_total=0, last_released=0)
+register_metrics("schedule_expiry", lambda: dict(schedule_expiry_stats))
+
+
+async def sweep_expired_schedules(
+    db: AsyncSession, now: Optional[datetime] = None, batch_size: Optional[int] = None
+) -> dict:
+    """
+    Expires ACTIVE schedules past their expires_at and puts their RESERVED
+    copies back to AVAILABLE, `batch_size` schedules per transaction via
+    ix_bk_copy_schedules_status_expires_at. A schedule consumed by a
+    checkout in the meantime is left alone, as is its copy. Released copies
+    go to the head of their hold queue first.
+    """
+    now = now or datetime.now(timezone.utc)
+    batch_size = batch_size or settings.schedule_expiry_batch_size
+    expired = released = allocated = 0
+    while True:
+        rows = await crud.get_expired_schedules(db, now, batch_size)
+        if not rows:
+            break
+        barcodes = await crud.expire_schedules(db, [row.id for row in rows])
+        moved = await crud.set_copies_status(
+            db, barcodes, BkCopyStatus.RESERVED, BkCopyStatus.AVAILABLE
+        )
+        allocated += await allocate_holds(db, moved)
         await db.commit()
+        await invalidate_stale_books(db)
+        expired += len(barcodes)
+        released += len(moved)
+        if len(rows) < batch_size:
+            break
+    schedule_expiry_stats["runs"] += 1
+    schedule_expiry_stats["released_total"] += released
+    schedule_expiry_stats["last_released"] = released
+    if expired:
+        logger.info(f"Expired {expired} schedules, released {released} copies")
+    return {"expired": expired, "released": released, "allocated": allocated}
+
+
+async def expire_schedules_service(request: Request, db: AsyncSession):
+    try:
+        reraise_exceptions(request)
+        totals = await sweep_expired_schedules(db)
+    except HTTPException:
+        raise
+    except SQLAlchemyError as e:
+        logger.error(f"DataBase error expiring schedules: {e}")
+        await db.rollback()
+        raise internal_error_exception
+    else:
+        request.state.msg = totals
+        return totals
+
+
+async def get_loan_history_service(
+    request: Request,
+    db: AsyncSession,
+    user_uid: str,
+    limit: int,
+    loan_status: Optional[LoanStatus] = None,
+    cursor: Optional[str] = None,
+):
+    try:
+        reraise_exceptions(request)
+        filters = {"user": user_uid, "status": loan_status and loan_status.value}
+        after = None
+        if cursor:
+            decoded = decode_cursor(cursor)
+            if not decoded or any(decoded.get(k) != v for k, v in filters.items()):
+                raise invalid_cursor_exception
+            try:
+                after = (datetime.fromisoformat(decoded["at"]), int(decoded["id"]))
+            except (KeyError, TypeError, ValueError):
+                raise invalid_cursor_exception
+        loans = await crud.get_loan_history_page(
+            db, user_uid, limit, loan_status=loan_status, after=after
+        )
+    except HTTPException:
+        raise
+    except SQLAlchemyError as e:
+        logger.error(f"DataBase error fetching loan history: {e}")
+        await db.rollback()
+        raise internal_error_exception
+    else:
+        next_cursor = None
+        if len(loans) > limit:
+            loans = loans[:limit]
+            last = loans[-1]
+            next_cursor = encode_cursor(
+                {**filters, "at": last.checked_out_at.isoformat(), "id": last.id}
+            )
+        return {"loans": loans, "next_cursor": next_cursor}
+
+
+async def reconcile_user_counters(
+    db: AsyncSession, batch_size: Optional[int] = None
+) -> dict:
+    """
+    Recounts every user's open loans and active holds against the
+    maintained counters and fixes any drift, one id range of `batch_size`
+    users per transaction.
+    """
+    batch_size = batch_size or settings.user_counter_reconcile_batch_size
+    max_id = await crud.get_max_user_id(db)
+    corrected = 0
+    for first_id in range(1, max_id + 1, batch_size):
+        corrected += await crud.reconcile_user_counters(
+            db, first_id, first_id + batch_size - 1
+        )
+        await db.commit()
+    if corrected:
+        logger.warning(f"Corrected circulation counters of {corrected} users")
+    return {"corrected": corrected}
+
+
+async def reconcile_user_counters_service(request: Request, db: AsyncSession):
+    try:
+        reraise_exceptions(request)
+        totals = await reconcile_user_counters(db)
+    except HTTPException:
+        raise
+    except SQLAlchemyError as e:
+        logger.error(f"DataBase error reconciling user counters: {e}")
+        await db.rollback()
+        raise internal_error_exception
+    else:
+        request.state.msg = totals
+        return totals
+
+
+async def sync_revoked_tokens(db: AsyncSession) -> dict:
+    """
+    Deletes expired revocations and rebuilds the in-memory revocation
+    filter from the access tokens left, picking up other workers'
+    revocations.
+    """
+    pruned = await crud.prune_revoked_tokens(db, utc_now())
+    await db.commit()
+    jtis = await crud.get_revoked_jtis(db, "access")
+    revoked_tokens.rebuild(jtis)
+    return {"pruned": pruned, "revoked": len(jtis)}
+
+
+async def get_metrics_service(request: Request):
+    reraise_exceptions(request)
+    return collect_metrics()
 
 
 async def create_staff_user_service(
@@ -491,7 +1530,7 @@ async def create_staff_user_service(
     try:
         reraise_exceptions(request)
         data = user_data.copy()
-        data["password"] = hash_password(data["password"])
+        data["password"] = await hash_password_async(data["password"])
         data["user_uid"] = generate_staff_id()
         user = await crud.create_new_user(db, User(**data))
         logger.info("Created new staff user successfully")
@@ -533,6 +1572,15 @@ async def update_bk_copies_status(request: Request, db: AsyncSession, data: List
         book_copies = list(book_copies)
 
         await crud.update_bk_copies_status(db, ordered_copies, filtered_data)
+        # copies back on the shelf after inspection serve the hold queue first
+        holds_allocated = await allocate_holds(
+            db,
+            [
+                (item["copy_barcode"], bk_map[item["copy_barcode"]].book_isbn)
+                for item in filtered_data
+                if item["status"] == BkCopyStatus.AVAILABLE.value
+            ],
+        )
     except HTTPException:
         raise
     except SQLAlchemyError as e:
@@ -541,10 +1589,12 @@ async def update_bk_copies_status(request: Request, db: AsyncSession, data: List
         raise internal_error_exception  # update exceptions
     else:
         await db.commit()
+        await invalidate_stale_books(db)
         msg = {
             "message": f"Updated {len(book_copies)} book copies successfully",
             "not_found_barcodes": list(not_found),
             "num_not_found": len(not_found),
+            "holds_allocated": holds_allocated,
         }
         request.state.msg = msg
         return msg
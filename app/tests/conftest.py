@@ -10,6 +10,8 @@ load_dotenv()
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 from app.core.auth import hash_password
+from app.core.cache import book_cache, principal_cache, token_cache
+from app.core.throttle import login_throttle
 from app.core.config import Settings
 from app.core.database import Base, get_session
 from app.main import app
@@ -68,6 +70,10 @@ async def client(test_session):
         yield test_session
 
     app.dependency_overrides[get_session] = override_get_session
+    await book_cache.clear()
+    await principal_cache.clear()
+    await token_cache.clear()
+    await login_throttle.store.clear()
     async with AsyncClient(transport=ASGITransport(app=app), base_url=BASE_URL) as ac:
         yield ac
     app.dependency_overrides.clear()
@@ -152,6 +158,7 @@ async def mock_loan(test_session, mock_user, mock_book_copies) -> (str, str):
     }
     loan = Loan(**loan_data)
     test_session.add(loan)
+    mock_user.active_loans_count += 1
     await test_session.flush()
     await test_session.refresh(loan)
     return loan.loan_id, loan.bk_copy_barcode
@@ -0,0 +1,167 @@
+import asyncio
+import json
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import func, select
+
+from app.core.audit import AuditWriter, audit_writer
+from app.core.middleware import AuditMiddleware
+from app.main import app
+from app.models import Audit, Event
+from app.tests.conftest import TestAsyncSessionLocal
+
+
+def audit_entry(i: int) -> dict:
+    return {
+        "actor_id": str(i),
+        "success": True,
+        "event": Event.FETCH_BOOK,
+        "details": "{}",
+    }
+
+
+@pytest.mark.anyio
+async def test_audit_writer_batches_and_drains(test_session):
+    writer = AuditWriter(
+        max_queue=5,
+        batch_size=2,
+        flush_interval=60,
+        session_factory=TestAsyncSessionLocal,
+    )
+    for i in range(6):
+        writer.enqueue(audit_entry(i))
+    # the sixth entry didn't fit in the queue
+    assert writer.stats()["queue_depth"] == 5
+    assert writer.dropped == 1
+
+    writer.start()
+    await writer.stop()
+    stats = writer.stats()
+    assert stats["written"] == 5
+    assert stats["queue_depth"] == 0
+    # nothing is lost on stop, and no INSERT exceeds batch_size rows
+    assert stats["flushes"] == 3
+
+    count = await test_session.scalar(select(func.count()).select_from(Audit))
+    assert count == 5
+
+
+async def wait_for_written(writer: AuditWriter, written: int):
+    for _ in range(200):
+        if writer.written + writer.failed >= written:
+            return
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.anyio
+async def test_audit_writer_run_flushes_by_size_and_interval(test_session):
+    writer = AuditWriter(
+        max_queue=10,
+        batch_size=2,
+        flush_interval=60,
+        session_factory=TestAsyncSessionLocal,
+    )
+    writer.start()
+    # full batches are written without waiting for the interval
+    for i in range(4):
+        writer.enqueue(audit_entry(i))
+    await wait_for_written(writer, 4)
+    assert (writer.written, writer.flushes) == (4, 2)
+
+    # a partial batch goes out once the interval runs out
+    writer.flush_interval = 0.05
+    writer.enqueue(audit_entry(4))
+    await wait_for_written(writer, 5)
+    assert (writer.written, writer.flushes) == (5, 3)
+    await writer.stop()
+
+    count = await test_session.scalar(select(func.count()).select_from(Audit))
+    assert count == 5
+
+
+@pytest.mark.anyio
+async def test_audit_writer_survives_unexpected_errors(test_session):
+    def broken_session():
+        raise RuntimeError("not a database error")
+
+    writer = AuditWriter(
+        max_queue=10,
+        batch_size=1,
+        flush_interval=60,
+        session_factory=broken_session,
+    )
+    writer.start()
+    writer.enqueue(audit_entry(0))
+    await wait_for_written(writer, 1)
+    assert writer.failed == 1
+
+    # the writer is still running and picks up the next entry
+    writer.session_factory = TestAsyncSessionLocal
+    writer.enqueue(audit_entry(1))
+    await wait_for_written(writer, 2)
+    assert writer.written == 1
+    await writer.stop()
+
+
+@pytest.mark.anyio
+async def test_audit_middleware_captures_form(
+    client, test_session, mock_user, monkeypatch
+):
+    monkeypatch.setattr(audit_writer, "session_factory", TestAsyncSessionLocal)
+    await audit_writer.drain()
+    transport = ASGITransport(app=AuditMiddleware(app, max_form_bytes=64))
+    async with AsyncClient(transport=transport, base_url=client.base_url) as audited:
+        form_data = {"email": mock_user.email, "password": "mockuser123"}
+        response = await audited.post("/users/login", data=form_data)
+        assert response.status_code == 200
+        # longer than max_form_bytes, the cut off field is left out
+        form_data = {"email": mock_user.email, "password": "x" * 40, "extra": "y" * 40}
+        await audited.post("/users/login", data=form_data)
+        await audited.get("/")
+    await audit_writer.drain()
+
+    rows = (
+        (await test_session.execute(select(Audit).order_by(Audit.id))).scalars().all()
+    )
+    assert [row.event for row in rows] == [
+        Event.LOGIN_USER,
+        Event.LOGIN_USER,
+        Event.UNIDENTIFIED_EVENT,
+    ]
+    details = [json.loads(row.details) for row in rows]
+    assert details[0]["form"] == {"email": mock_user.email}
+    assert details[0]["status_code"] == 200
+    assert details[1]["form"] == {"email": mock_user.email}
+    assert details[1]["form_truncated"]
+    # bodies of non-form events are never captured
+    assert "form" not in details[2]
+
+
+@pytest.mark.anyio
+async def test_audit_middleware_captures_multipart_form(
+    client, test_session, mock_user, monkeypatch
+):
+    monkeypatch.setattr(audit_writer, "session_factory", TestAsyncSessionLocal)
+    await audit_writer.drain()
+    transport = ASGITransport(app=AuditMiddleware(app, max_form_bytes=64))
+    async with AsyncClient(transport=transport, base_url=client.base_url) as audited:
+        # a file part makes httpx send multipart/form-data
+        files = {"avatar": ("avatar.txt", b"z" * 200, "text/plain")}
+        form_data = {"email": mock_user.email, "password": "mockuser123"}
+        response = await audited.post("/users/login", data=form_data, files=files)
+        assert response.status_code == 200
+        form_data = {"email": mock_user.email, "extra": "y" * 60}
+        await audited.post("/users/login", data=form_data, files=files)
+    await audit_writer.drain()
+
+    rows = (
+        (await test_session.execute(select(Audit).order_by(Audit.id))).scalars().all()
+    )
+    details = [json.loads(row.details) for row in rows]
+    # secrets are left out, and capture stops at the file part
+    assert details[0]["form"] == {"email": mock_user.email}
+    assert details[0]["form_truncated"]
+    # longer than max_form_bytes, the cut off field is left out
+    assert details[1]["form"] == {"email": mock_user.email}
+    assert details[1]["form_truncated"]
@@ -1,5 +1,27 @@
+import json
+from datetime import datetime, timedelta, timezone
+
 import pytest
 
+from sqlalchemy import event, select, text, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+
+from app import crud
+from app.core.cache import book_cache
+from app.models import (
+    BkCopySchedule,
+    BkCopyStatus,
+    Book,
+    BookCopy,
+    HoldRequest,
+    HoldStatus,
+    Loan,
+    LoanStatus,
+    User,
+)
+from app.tests.conftest import mock_admin_email, mock_admin_password, test_engine
+
 
 @pytest.mark.anyio
 async def test_book_creation(admin_auth_client, book_creation_data):
@@ -114,3 +136,746 @@ async def test_return_book(admin_auth_client, mock_loan):
         f"{admin_auth_client.base_url}/books/loan-return", data=form_data
     )
     assert response.status_code == 409
+
+
+@pytest.mark.anyio
+async def test_return_old_loan_leaves_new_loan_alone(
+    admin_auth_client, test_session, mock_user, mock_loan
+):
+    loan_id, barcode = mock_loan
+    user_uid = mock_user.user_uid
+    form_data = {"bk_copy_barcode": barcode, "loan_id": loan_id}
+    base_url = admin_auth_client.base_url
+    response = await admin_auth_client.post(
+        f"{base_url}/books/loan-return", data=form_data
+    )
+    assert response.status_code == 200
+    # the copy goes straight back out on a new loan
+    await test_session.execute(
+        update(BookCopy)
+        .where(BookCopy.copy_barcode == barcode)
+        .values(status=BkCopyStatus.BORROWED)
+    )
+    test_session.add(Loan(user_uid=user_uid, bk_copy_barcode=barcode))
+    await test_session.execute(
+        update(User).where(User.user_uid == user_uid).values(active_loans_count=1)
+    )
+    await test_session.commit()
+
+    # a stale return of the old loan is refused and changes nothing
+    response = await admin_auth_client.post(
+        f"{base_url}/books/loan-return", data=form_data
+    )
+    assert response.status_code == 409
+    copy_status = await test_session.scalar(
+        select(BookCopy.status).where(BookCopy.copy_barcode == barcode)
+    )
+    assert copy_status == BkCopyStatus.BORROWED
+    user = await test_session.scalar(
+        select(User)
+        .where(User.user_uid == user_uid)
+        .execution_options(populate_existing=True)
+    )
+    assert (user.active_loans_count, user.fine_balance) == (1, 0)
+
+
+@pytest.mark.anyio
+async def test_list_books(auth_client, test_session):
+    for i in range(5):
+        author = "author-a" if i % 2 else "author-b"
+        test_session.add(
+            Book(title=f"title-{i}", author=author, location="a3", isbn=f"isbn-{i}")
+        )
+    await test_session.flush()
+
+    response = await auth_client.get(f"{auth_client.base_url}/books?limit=2")
+    assert response.status_code == 200
+    data = response.json()
+    assert [bk["title"] for bk in data["books"]] == ["title-0", "title-1"]
+    assert data["next_cursor"]
+
+    seen = [bk["isbn"] for bk in data["books"]]
+    cursor = data["next_cursor"]
+    while cursor:
+        response = await auth_client.get(
+            f"{auth_client.base_url}/books", params={"limit": 2, "cursor": cursor}
+        )
+        assert response.status_code == 200
+        seen += [bk["isbn"] for bk in response.json()["books"]]
+        cursor = response.json()["next_cursor"]
+    assert seen == [f"isbn-{i}" for i in range(5)]
+
+    # filters
+    response = await auth_client.get(
+        f"{auth_client.base_url}/books", params={"author": "author-a", "sort": "title"}
+    )
+    assert [bk["title"] for bk in response.json()["books"]] == ["title-1", "title-3"]
+    # cursor minted for another sort order is rejected
+    response = await auth_client.get(
+        f"{auth_client.base_url}/books",
+        params={"sort": "title", "cursor": data["next_cursor"]},
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_search_books(admin_auth_client, book_creation_data):
+    base_url = admin_auth_client.base_url
+    response = await admin_auth_client.post(
+        f"{base_url}/books", data=book_creation_data
+    )
+    assert response.status_code == 201
+    other_book = {
+        "title": "Dune",
+        "author": "Frank Herbert",
+        "location": "b1",
+        "isbn": "99",
+    }
+    await admin_auth_client.post(f"{base_url}/books", data=other_book)
+
+    response = await admin_auth_client.get(
+        f"{base_url}/books/search", params={"q": "herb"}
+    )
+    assert response.status_code == 200
+    assert [bk["isbn"] for bk in response.json()["books"]] == ["99"]
+
+    # index follows updates
+    await admin_auth_client.put(
+        f"{base_url}/books/{other_book['isbn']}", data={"title": "Children of Dune"}
+    )
+    response = await admin_auth_client.get(
+        f"{base_url}/books/search", params={"q": "children dune"}
+    )
+    assert response.json()["books"][0]["title"] == "Children of Dune"
+
+    response = await admin_auth_client.get(
+        f"{base_url}/books/search", params={"q": "*"}
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_rebuild_search_index(admin_auth_client, test_session, mock_book):
+    base_url = admin_auth_client.base_url
+    # a database from before the index: no books_fts, books already in place
+    await test_session.execute(text("DROP TABLE books_fts"))
+    await test_session.commit()
+
+    response = await admin_auth_client.post(f"{base_url}/books/rebuild-search-index")
+    assert response.status_code == 200
+    assert response.json()["message"] == "Search index rebuilt for 1 books"
+    response = await admin_auth_client.get(
+        f"{base_url}/books/search", params={"q": mock_book.author}
+    )
+    assert [bk["isbn"] for bk in response.json()["books"]] == [mock_book.isbn]
+    # running it again replaces the rows instead of duplicating them
+    await admin_auth_client.post(f"{base_url}/books/rebuild-search-index")
+    count = await test_session.scalar(text("SELECT count(*) FROM books_fts"))
+    assert count == 1
+
+
+@pytest.mark.anyio
+async def test_import_books(admin_auth_client, mock_book):
+    base_url = admin_auth_client.base_url
+    csv_body = "\n".join(
+        [
+            "title,author,isbn,location,available",
+            "Emma,Jane Austen,1001,c2,true",
+            f"{mock_book.title},Someone,1002,c2,true",  # title already exists
+            "Persuasion,Jane Austen,1003,c2,maybe",  # invalid bool
+            "Emma,Jane Austen,1001,c2,true",  # repeated in the same file
+        ]
+    )
+    response = await admin_auth_client.post(
+        f"{base_url}/books/import?format=csv", content=csv_body.encode()
+    )
+    assert response.status_code == 200
+    report = response.json()
+    assert report["inserted"] == 1
+    assert sorted(c["row"] for c in report["conflicts"]) == [2, 4]
+    assert [i["row"] for i in report["invalid"]] == [3]
+
+    jsonl_body = '{"title": "Sanditon", "author": "Jane Austen", "isbn": "1004", "location": "c2"}\nnot json\n'
+    response = await admin_auth_client.post(
+        f"{base_url}/books/import?format=jsonl&batch_size=1", content=jsonl_body
+    )
+    assert response.json()["inserted"] == 1
+    assert response.json()["num_invalid"] == 1
+    # imported rows are searchable straight away
+    response = await admin_auth_client.get(f"{base_url}/books/search?q=austen")
+    assert {bk["title"] for bk in response.json()["books"]} == {"Emma", "Sanditon"}
+
+
+@pytest.mark.anyio
+async def test_export_catalog(admin_auth_client, test_session, mock_book_copies):
+    base_url = admin_auth_client.base_url
+    isbn, bk_copies = mock_book_copies
+    test_session.add(Book(title="no copies", author="x", location="a1", isbn="555"))
+    await test_session.flush()
+
+    response = await admin_auth_client.get(f"{base_url}/books/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    books = [json.loads(line) for line in response.text.splitlines()]
+    assert [bk["isbn"] for bk in books] == [isbn, "555"]
+    assert [cp["copy_barcode"] for cp in books[0]["copies"]] == [
+        bk.copy_barcode for bk in bk_copies
+    ]
+    assert books[1]["copies"] == []
+
+    # resume after the first book, gzip encoded
+    response = await admin_auth_client.get(
+        f"{base_url}/books/export", params={"since": books[0]["id"], "compress": True}
+    )
+    assert response.headers["content-encoding"] == "gzip"
+    assert [json.loads(line)["isbn"] for line in response.text.splitlines()] == ["555"]
+
+
+@pytest.mark.anyio
+async def test_book_cache(admin_auth_client, mock_book):
+    base_url = admin_auth_client.base_url
+    url = f"{base_url}/books/fetch?isbn={mock_book.isbn}"
+    before = (await admin_auth_client.get(f"{base_url}/metrics")).json()["book_cache"]
+
+    assert (await admin_auth_client.get(url)).status_code == 200
+    assert (await admin_auth_client.get(url)).status_code == 200
+    stats = (await admin_auth_client.get(f"{base_url}/metrics")).json()["book_cache"]
+    assert stats["misses"] == before["misses"] + 1
+    assert stats["hits"] == before["hits"] + 1
+
+    # writes invalidate the cached entry
+    await admin_auth_client.put(
+        f"{base_url}/books/{mock_book.isbn}", data={"location": "z9"}
+    )
+    response = await admin_auth_client.get(url)
+    assert response.json()["location"] == "z9"
+
+
+@pytest.mark.anyio
+async def test_availability_counts(admin_auth_client, mock_book_copies, mock_user):
+    base_url = admin_auth_client.base_url
+    isbn, _ = mock_book_copies
+    url = f"{base_url}/books/fetch?isbn={isbn}"
+    # fixture copies bypass crud, the reconciliation job picks them up
+    response = await admin_auth_client.get(url)
+    assert response.json()["availability"]["available"] == 0
+    response = await admin_auth_client.post(f"{base_url}/books/reconcile-availability")
+    assert response.status_code == 200
+    response = await admin_auth_client.get(url)
+    assert response.json()["availability"]["available"] == 5
+
+    await admin_auth_client.post(
+        f"{base_url}/books/generate-copies", data={"isbn": isbn, "quantity": 3}
+    )
+    await admin_auth_client.post(
+        f"{base_url}/books/loan-book",
+        data={"user_uid": mock_user.user_uid, "isbn": isbn},
+    )
+    availability = (await admin_auth_client.get(url)).json()["availability"]
+    assert availability["available"] == 7
+    assert availability["borrowed"] == 1
+
+
+@pytest.mark.anyio
+async def test_add_book_copies_continues_serials(
+    admin_auth_client, test_session, mock_book_copies
+):
+    isbn, bk_copies = mock_book_copies
+    for quantity in (3, 2):
+        response = await admin_auth_client.post(
+            f"{admin_auth_client.base_url}/books/generate-copies",
+            data={"isbn": isbn, "quantity": quantity},
+        )
+        assert response.status_code == 201
+
+    result = await test_session.execute(
+        select(BookCopy.serial, BookCopy.copy_barcode)
+        .where(BookCopy.book_isbn == isbn)
+        .order_by(BookCopy.serial)
+    )
+    rows = result.all()
+    assert [row.serial for row in rows] == list(range(1, 11))
+    assert rows[-1].copy_barcode.endswith("-000010")
+    # barcodes sort in serial order
+    assert sorted(row.copy_barcode for row in rows) == [
+        row.copy_barcode for row in rows
+    ]
+
+
+@pytest.mark.anyio
+async def test_fetch_books_batch(auth_client, mock_book):
+    url = f"{auth_client.base_url}/books/fetch-batch"
+    isbns = ["missing-1", mock_book.isbn, "missing-1", "missing-2"]
+    response = await auth_client.post(url, json={"isbns": isbns})
+    assert response.status_code == 200
+    data = response.json()
+    assert [bk["isbn"] for bk in data["books"]] == [mock_book.isbn]
+    assert data["not_found"] == ["missing-1", "missing-2"]
+    # second round is served from the book cache
+    response = await auth_client.post(url, json={"isbns": [mock_book.isbn]})
+    assert response.json()["books"][0]["title"] == mock_book.title
+
+    response = await auth_client.post(url, json={"isbns": ["x"] * 501})
+    assert response.status_code == 200  # duplicates collapse to one ISBN
+    response = await auth_client.post(url, json={"isbns": [str(i) for i in range(501)]})
+    assert response.status_code == 422
+
+
+@pytest.mark.anyio
+async def test_get_book_conditional(admin_auth_client, mock_book):
+    base_url = admin_auth_client.base_url
+    url = f"{base_url}/books/fetch?isbn={mock_book.isbn}"
+    response = await admin_auth_client.get(url)
+    etag = response.headers["etag"]
+    last_modified = response.headers["last-modified"]
+
+    response = await admin_auth_client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    response = await admin_auth_client.get(
+        url, headers={"If-Modified-Since": last_modified}
+    )
+    assert response.status_code == 304
+
+    # new copies change the availability counts and so the validators
+    await admin_auth_client.post(
+        f"{base_url}/books/generate-copies",
+        data={"isbn": mock_book.isbn, "quantity": 1},
+    )
+    response = await admin_auth_client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    # without a cached copy the version columns alone settle it
+    await book_cache.clear()
+    response = await admin_auth_client.get(
+        url, headers={"If-None-Match": response.headers["etag"]}
+    )
+    assert response.status_code == 304
+
+
+async def login_headers(client, mock_user) -> dict:
+    """Auth headers for the mock admin and the mock user, keyed by email."""
+    tokens = {}
+    for email, password in (
+        (mock_admin_email, mock_admin_password),
+        (mock_user.email, "mockuser123"),
+    ):
+        response = await client.post(
+            f"{client.base_url}/users/login",
+            data={"email": email, "password": password},
+        )
+        tokens[email] = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    return tokens
+
+
+@pytest.mark.anyio
+async def test_loan_book_statement_count(
+    client, mock_admin, mock_user, mock_book_copies
+):
+    isbn, _ = mock_book_copies
+    base_url = client.base_url
+    tokens = await login_headers(client, mock_user)
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    async def loan_book():
+        statements.clear()
+        event.listen(test_engine.sync_engine, "before_cursor_execute", count_statement)
+        try:
+            return await client.post(
+                f"{base_url}/books/loan-book",
+                data={"user_uid": mock_user.user_uid, "isbn": isbn},
+                headers=tokens[mock_admin_email],
+            )
+        finally:
+            event.remove(
+                test_engine.sync_engine, "before_cursor_execute", count_statement
+            )
+
+    # auth, eligibility, copy claim, availability upsert, loan insert and
+    # the patron's loan counter
+    response = await loan_book()
+    assert response.status_code == 201
+    assert len(statements) <= 6
+
+    response = await client.post(
+        f"{base_url}/books/book-schedule/{isbn}", headers=tokens[mock_user.email]
+    )
+    assert response.status_code == 201
+    # the scheduled path also marks the schedule fulfilled and drops the
+    # patron's hold counter
+    response = await loan_book()
+    assert response.status_code == 201
+    assert response.json()["was_scheduled"]
+    assert len(statements) <= 8
+
+
+@pytest.mark.anyio
+async def test_loan_books(
+    client, test_session, mock_admin, mock_user, mock_book_copies
+):
+    isbn, bk_copies = mock_book_copies
+    base_url = client.base_url
+    tokens = await login_headers(client, mock_user)
+    response = await client.post(
+        f"{base_url}/books/book-schedule/{isbn}", headers=tokens[mock_user.email]
+    )
+    scheduled_barcode = response.json()["schedule_info"]["bk_copy_barcode"]
+
+    payload = {
+        "user_uid": mock_user.user_uid,
+        "items": [
+            {"isbn": isbn},
+            {"copy_barcode": "BK-MISSING-000001"},
+            {"isbn": isbn},
+        ],
+    }
+    response = await client.post(
+        f"{base_url}/books/loan-books", json=payload, headers=tokens[mock_admin_email]
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert (data["loaned"], data["failed"]) == (2, 1)
+    first, missing, second = data["results"]
+    # the patron's schedule is consumed before any available copy
+    assert first["was_scheduled"]
+    assert first["book_copy"]["copy_barcode"] == scheduled_barcode
+    assert not missing["loaned"] and missing["detail"]
+    assert second["loaned"] and not second["was_scheduled"]
+    assert second["book_copy"]["copy_barcode"] != scheduled_barcode
+    counters = (
+        await test_session.execute(
+            select(User.active_loans_count, User.active_holds_count).where(
+                User.user_uid == mock_user.user_uid
+            )
+        )
+    ).one()
+    assert tuple(counters) == (2, 0)
+
+    response = await client.get(
+        f"{base_url}/books/fetch?isbn={isbn}", headers=tokens[mock_admin_email]
+    )
+    assert response.json()["availability"]["borrowed"] == 2
+
+    # two active loans plus two more is over the limit of three
+    payload["items"] = [{"isbn": isbn}, {"copy_barcode": bk_copies[-1].copy_barcode}]
+    response = await client.post(
+        f"{base_url}/books/loan-books", json=payload, headers=tokens[mock_admin_email]
+    )
+    assert response.status_code == 403
+
+    payload["items"] = [{"isbn": isbn, "copy_barcode": bk_copies[-1].copy_barcode}]
+    response = await client.post(
+        f"{base_url}/books/loan-books", json=payload, headers=tokens[mock_admin_email]
+    )
+    assert response.status_code == 422
+
+
+@pytest.mark.anyio
+async def test_return_books(
+    admin_auth_client, test_session, mock_user, mock_book_copies
+):
+    isbn, _ = mock_book_copies
+    base_url = admin_auth_client.base_url
+    response = await admin_auth_client.post(
+        f"{base_url}/books/loan-books",
+        json={
+            "user_uid": mock_user.user_uid,
+            "items": [{"isbn": isbn}, {"isbn": isbn}],
+        },
+    )
+    on_time, late = [r["book_copy"]["copy_barcode"] for r in response.json()["results"]]
+    await test_session.execute(
+        update(Loan)
+        .where(Loan.bk_copy_barcode == late)
+        .values(due_at=datetime.now(timezone.utc) - timedelta(days=3))
+    )
+
+    response = await admin_auth_client.post(
+        f"{base_url}/books/loan-returns",
+        json={"barcodes": [on_time, late, on_time, "BK-MISSING-000001"]},
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert (data["returned"], data["failed"]) == (2, 1)
+    results = {r["copy_barcode"]: r for r in data["results"]}
+    assert results[on_time]["status"] == "returned"
+    assert results[late]["status"] == "returned_late"
+    assert results[late]["days_late"] == 3
+    assert data["total_fines"] == results[late]["fine"] == 300
+    assert not results["BK-MISSING-000001"]["returned"]
+
+    user = await test_session.scalar(
+        select(User)
+        .where(User.user_uid == mock_user.user_uid)
+        .execution_options(populate_existing=True)
+    )
+    assert user.fine_balance == 300
+    copies = await test_session.scalars(
+        select(BookCopy.status).where(BookCopy.copy_barcode.in_([on_time, late]))
+    )
+    assert set(copies) == {BkCopyStatus.IN_CHECK}
+
+    # a second scan of the same copies finds nothing left to return
+    response = await admin_auth_client.post(
+        f"{base_url}/books/loan-returns", json={"barcodes": [on_time]}
+    )
+    assert response.json()["returned"] == 0
+
+
+@pytest.mark.anyio
+async def test_return_books_skips_loans_closed_after_read(
+    admin_auth_client, test_session, mock_user, mock_loan, monkeypatch
+):
+    _, barcode = mock_loan
+    user_uid = mock_user.user_uid
+    await test_session.execute(
+        update(Loan).values(due_at=datetime.now(timezone.utc) - timedelta(days=3))
+    )
+    await test_session.commit()
+    read_loans = crud.get_active_loans_by_barcodes
+
+    async def read_then_return_elsewhere(db, barcodes):
+        rows = await read_loans(db, barcodes)
+        # another desk returns the loan right after this read
+        await db.execute(update(Loan).values(status=LoanStatus.RETURNED))
+        return rows
+
+    monkeypatch.setattr(
+        crud, "get_active_loans_by_barcodes", read_then_return_elsewhere
+    )
+    response = await admin_auth_client.post(
+        f"{admin_auth_client.base_url}/books/loan-returns",
+        json={"barcodes": [barcode]},
+    )
+    data = response.json()
+    assert (data["returned"], data["failed"], data["total_fines"]) == (0, 1, 0)
+    user = await test_session.scalar(
+        select(User)
+        .where(User.user_uid == user_uid)
+        .execution_options(populate_existing=True)
+    )
+    assert (user.active_loans_count, user.fine_balance) == (1, 0)
+
+
+@pytest.mark.anyio
+async def test_sweep_overdue(
+    admin_auth_client, test_session, mock_user, mock_book_copies
+):
+    isbn, _ = mock_book_copies
+    base_url = admin_auth_client.base_url
+    response = await admin_auth_client.post(
+        f"{base_url}/books/loan-books",
+        json={
+            "user_uid": mock_user.user_uid,
+            "items": [{"isbn": isbn}, {"isbn": isbn}],
+        },
+    )
+    late, on_time = [r["book_copy"]["copy_barcode"] for r in response.json()["results"]]
+    await test_session.execute(
+        update(Loan)
+        .where(Loan.bk_copy_barcode == late)
+        .values(due_at=datetime.now(timezone.utc) - timedelta(days=2))
+    )
+
+    response = await admin_auth_client.post(f"{base_url}/books/sweep-overdue")
+    assert response.status_code == 200
+    assert response.json() == {
+        "scanned": 1,
+        "newly_overdue": 1,
+        "fined_loans": 1,
+        "fines": 200,
+    }
+    # the same day again charges nothing new
+    response = await admin_auth_client.post(f"{base_url}/books/sweep-overdue")
+    assert response.json()["fines"] == 0
+
+    user = await test_session.scalar(
+        select(User)
+        .where(User.user_uid == mock_user.user_uid)
+        .execution_options(populate_existing=True)
+    )
+    assert user.fine_balance == 200
+    loan = await test_session.scalar(
+        select(Loan)
+        .where(Loan.bk_copy_barcode == late)
+        .execution_options(populate_existing=True)
+    )
+    assert loan.status == LoanStatus.OVERDUE
+
+    # the return only charges what the sweep has not
+    response = await admin_auth_client.post(
+        f"{base_url}/books/loan-returns", json={"barcodes": [late, on_time]}
+    )
+    assert response.json()["returned"] == 2
+    assert response.json()["total_fines"] == 0
+
+
+@pytest.mark.anyio
+async def test_sweep_skips_loans_returned_after_read(test_session, mock_loan):
+    now = datetime.now(timezone.utc)
+    await test_session.execute(update(Loan).values(due_at=now - timedelta(days=3)))
+    rows = await crud.get_overdue_loans_batch(test_session, LoanStatus.ACTIVE, now, 10)
+    assert len(rows) == 1
+    # the loan is returned between the sweep's read and its UPDATE
+    await test_session.execute(update(Loan).values(status=LoanStatus.RETURNED_LATE))
+    fined_days = {(row.due_at, row.id): (row.fined_days, 3) for row in rows}
+    assert (
+        await crud.mark_loans_overdue(test_session, LoanStatus.ACTIVE, fined_days) == []
+    )
+    loan = await test_session.scalar(
+        select(Loan).execution_options(populate_existing=True)
+    )
+    assert loan.status == LoanStatus.RETURNED_LATE
+    assert loan.fined_days == 0
+
+
+@pytest.mark.anyio
+async def test_expire_schedules(
+    client, test_session, mock_admin, mock_user, mock_book_copies
+):
+    isbn, _ = mock_book_copies
+    base_url = client.base_url
+    tokens = await login_headers(client, mock_user)
+    admin_headers = tokens[mock_admin_email]
+    response = await client.post(
+        f"{base_url}/books/book-schedule/{isbn}", headers=tokens[mock_user.email]
+    )
+    schedule_info = response.json()["schedule_info"]
+    assert schedule_info["expires_at"]
+
+    # nothing is due yet
+    response = await client.post(
+        f"{base_url}/books/expire-schedules", headers=admin_headers
+    )
+    assert response.json() == {"expired": 0, "released": 0, "allocated": 0}
+
+    await test_session.execute(
+        update(BkCopySchedule)
+        .where(BkCopySchedule.schedule_id == schedule_info["schedule_id"])
+        .values(expires_at=datetime.now(timezone.utc) - timedelta(minutes=1))
+    )
+    response = await client.post(
+        f"{base_url}/books/expire-schedules", headers=admin_headers
+    )
+    assert response.status_code == 200
+    assert response.json() == {"expired": 1, "released": 1, "allocated": 0}
+
+    copy_status = await test_session.scalar(
+        select(BookCopy.status).where(
+            BookCopy.copy_barcode == schedule_info["bk_copy_barcode"]
+        )
+    )
+    assert copy_status == BkCopyStatus.AVAILABLE
+    response = await client.get(
+        f"{base_url}/books/fetch?isbn={isbn}", headers=admin_headers
+    )
+    assert response.json()["availability"]["reserved"] == 0
+    response = await client.get(f"{base_url}/metrics", headers=admin_headers)
+    assert response.json()["schedule_expiry"]["last_released"] == 1
+    holds = await test_session.scalar(
+        select(User.active_holds_count).where(User.user_uid == mock_user.user_uid)
+    )
+    assert holds == 0
+
+
+@pytest.mark.anyio
+async def test_hold_queue(
+    client, test_session, mock_admin, mock_user, mock_book_copies
+):
+    isbn, bk_copies = mock_book_copies
+    base_url = client.base_url
+    tokens = await login_headers(client, mock_user)
+    admin_headers, user_headers = tokens[mock_admin_email], tokens[mock_user.email]
+    barcodes = [bk.copy_barcode for bk in bk_copies]
+
+    async def set_status(barcodes, copy_status):
+        payload = {
+            "book_copies": [
+                {"copy_barcode": b, "status": copy_status} for b in barcodes
+            ]
+        }
+        response = await client.patch(
+            f"{base_url}/books/update-bk-copies-status",
+            json=payload,
+            headers=admin_headers,
+        )
+        return response.json()
+
+    await set_status(barcodes, "DAMAGED")
+    schedule_url = f"{base_url}/books/book-schedule/{isbn}"
+    response = await client.post(schedule_url, headers=user_headers)
+    assert response.status_code == 202
+    assert response.json()["position"] == 1
+    response = await client.post(schedule_url, headers=admin_headers)
+    assert response.json()["position"] == 2
+    # asking again keeps the patron's place instead of queueing twice
+    response = await client.post(schedule_url, headers=user_headers)
+    assert response.json()["position"] == 1
+
+    # a repaired copy goes to the head of the queue
+    assert (await set_status(barcodes[:1], "AVAILABLE"))["holds_allocated"] == 1
+    schedule = await test_session.scalar(
+        select(BkCopySchedule).where(BkCopySchedule.user_uid == mock_user.user_uid)
+    )
+    assert schedule.bk_copy_barcode == barcodes[0]
+    copy_status = await test_session.scalar(
+        select(BookCopy.status)
+        .where(BookCopy.copy_barcode == barcodes[0])
+        .execution_options(populate_existing=True)
+    )
+    assert copy_status == BkCopyStatus.RESERVED
+
+    response = await client.get(f"{base_url}/books/holds/{isbn}", headers=user_headers)
+    assert response.status_code == 404
+    response = await client.get(f"{base_url}/books/holds/{isbn}", headers=admin_headers)
+    assert response.json()["position"] == 1
+    assert (await set_status(barcodes[1:], "AVAILABLE"))["holds_allocated"] == 1
+    response = await client.get(f"{base_url}/books/holds/{isbn}", headers=admin_headers)
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_holds_skip_ineligible_patrons(test_session, mock_book):
+    isbn = mock_book.isbn
+    patrons = [
+        User(full_name=f"Patron {i}", email=f"hold{i}@example.com", password="x")
+        for i in range(3)
+    ]
+    test_session.add_all(patrons)
+    await test_session.flush()
+    uids = [patron.user_uid for patron in patrons]
+    holds = [await crud.create_hold(test_session, uid, isbn) for uid in uids]
+    # queueing again keeps the one waiting hold
+    assert (await crud.create_hold(test_session, uids[0], isbn)).id == holds[0].id
+    with pytest.raises(IntegrityError):
+        async with test_session.begin_nested():
+            test_session.add(HoldRequest(user_uid=uids[0], book_isbn=isbn))
+
+    # the first patron owes too much, the second has been deactivated
+    await test_session.execute(
+        update(User).where(User.user_uid == uids[0]).values(fine_balance=1000)
+    )
+    await test_session.execute(
+        update(User).where(User.user_uid == uids[1]).values(is_active=False)
+    )
+    claimed = await crud.claim_next_hold(test_session, isbn, 5, 1000)
+    assert claimed.user_uid == uids[2]
+    # the ones passed over keep their place in line
+    waiting = await test_session.scalars(
+        select(HoldRequest.id)
+        .where(HoldRequest.status == HoldStatus.WAITING)
+        .order_by(HoldRequest.id)
+    )
+    assert list(waiting) == [holds[0].id, holds[1].id]
+    assert await crud.claim_next_hold(test_session, isbn, 5, 1000) is None
+
+
+def test_next_hold_head_locks_only_the_hold():
+    head = crud.next_hold_head("isbn", 5, 1000, skip_locked=True)
+    sql = str(head.compile(dialect=postgresql.dialect()))
+    # the patron's users row is joined but must not be locked
+    assert sql.endswith("FOR UPDATE OF hold_requests SKIP LOCKED")
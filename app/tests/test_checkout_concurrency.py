@@ -0,0 +1,175 @@
+import asyncio
+from collections import Counter
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.core.auth import create_access_token
+from app.core.database import Base, get_session
+from app.main import app
+from app.models import (
+    BkCopySchedule,
+    BkCopyStatus,
+    Book,
+    BookCopy,
+    HoldRequest,
+    HoldStatus,
+    Loan,
+    User,
+)
+from app.utils import generate_book_copy_barcode
+
+NUM_COPIES = 50
+NUM_CHECKOUTS = 300
+
+
+@pytest.fixture(scope="function")
+async def file_db_sessionmaker(tmp_path):
+    """
+    Concurrent requests need their own connections, which the shared
+    in-memory test database can't provide, so this test runs on a file.
+    """
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'checkouts.db'}",
+        connect_args={"timeout": 60},
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    await engine.dispose()
+
+
+@pytest.mark.anyio
+async def test_concurrent_checkouts_never_share_a_copy(file_db_sessionmaker):
+    isbn = "stress-isbn"
+    async with file_db_sessionmaker() as session:
+        staff = User(
+            full_name="Desk", email="desk@example.com", password="x", is_staff=True
+        )
+        book = Book(title="Popular", author="someone", location="a1", isbn=isbn)
+        patrons = [
+            User(full_name=f"Patron {i}", email=f"p{i}@example.com", password="x")
+            for i in range(NUM_CHECKOUTS)
+        ]
+        session.add_all([staff, book, *patrons])
+        await session.flush()
+        session.add_all(
+            BookCopy(
+                book_isbn=isbn,
+                serial=serial,
+                copy_barcode=generate_book_copy_barcode(book.library_barcode, serial),
+            )
+            for serial in range(1, NUM_COPIES + 1)
+        )
+        await session.commit()
+        token = create_access_token({"sub": staff.email}, staff)
+        patron_uids = [patron.user_uid for patron in patrons]
+
+    async def override_get_session():
+        async with file_db_sessionmaker() as session:
+            yield session
+
+    app.dependency_overrides[get_session] = override_get_session
+    try:
+        async with AsyncClient(
+            transport=ASGITransport(app=app),
+            base_url="http://test",
+            headers={"Authorization": f"Bearer {token}"},
+        ) as client:
+            responses = await asyncio.gather(
+                *(
+                    client.post(
+                        "/books/loan-book", data={"user_uid": uid, "isbn": isbn}
+                    )
+                    for uid in patron_uids
+                )
+            )
+    finally:
+        app.dependency_overrides.clear()
+
+    codes = Counter(response.status_code for response in responses)
+    assert codes == {201: NUM_COPIES, 404: NUM_CHECKOUTS - NUM_COPIES}
+
+    async with file_db_sessionmaker() as session:
+        loaned = (await session.execute(select(Loan.bk_copy_barcode))).scalars().all()
+        statuses = (await session.execute(select(BookCopy.status))).scalars().all()
+    assert len(loaned) == len(set(loaned)) == NUM_COPIES
+    assert set(statuses) == {BkCopyStatus.BORROWED}
+
+
+NUM_WAITING = 30
+NUM_RETURNED = 10
+
+
+@pytest.mark.anyio
+async def test_concurrent_returns_allocate_each_hold_once(file_db_sessionmaker):
+    isbn = "queued-isbn"
+    async with file_db_sessionmaker() as session:
+        staff = User(
+            full_name="Desk", email="desk@example.com", password="x", is_staff=True
+        )
+        book = Book(title="Waitlisted", author="someone", location="a1", isbn=isbn)
+        patrons = [
+            User(full_name=f"Patron {i}", email=f"p{i}@example.com", password="x")
+            for i in range(NUM_WAITING)
+        ]
+        session.add_all([staff, book, *patrons])
+        await session.flush()
+        copies = [
+            BookCopy(
+                book_isbn=isbn,
+                serial=serial,
+                copy_barcode=generate_book_copy_barcode(book.library_barcode, serial),
+                status=BkCopyStatus.DAMAGED,
+            )
+            for serial in range(1, NUM_RETURNED + 1)
+        ]
+        session.add_all(copies)
+        session.add_all(
+            HoldRequest(user_uid=patron.user_uid, book_isbn=isbn) for patron in patrons
+        )
+        await session.commit()
+        token = create_access_token({"sub": staff.email}, staff)
+        barcodes = [copy.copy_barcode for copy in copies]
+        first_in_line = {patron.user_uid for patron in patrons[:NUM_RETURNED]}
+
+    async def override_get_session():
+        async with file_db_sessionmaker() as session:
+            yield session
+
+    app.dependency_overrides[get_session] = override_get_session
+    try:
+        async with AsyncClient(
+            transport=ASGITransport(app=app),
+            base_url="http://test",
+            headers={"Authorization": f"Bearer {token}"},
+        ) as client:
+            # every copy comes back from inspection in its own request
+            await asyncio.gather(
+                *(
+                    client.patch(
+                        "/books/update-bk-copies-status",
+                        json={
+                            "book_copies": [
+                                {"copy_barcode": barcode, "status": "AVAILABLE"}
+                            ]
+                        },
+                    )
+                    for barcode in barcodes
+                )
+            )
+    finally:
+        app.dependency_overrides.clear()
+
+    async with file_db_sessionmaker() as session:
+        schedules = (await session.execute(select(BkCopySchedule))).scalars().all()
+        waiting = await session.scalar(
+            select(func.count(HoldRequest.id)).where(
+                HoldRequest.status == HoldStatus.WAITING
+            )
+        )
+    assert len({s.bk_copy_barcode for s in schedules}) == len(schedules) == NUM_RETURNED
+    assert {s.user_uid for s in schedules} == first_in_line
+    assert waiting == NUM_WAITING - NUM_RETURNED
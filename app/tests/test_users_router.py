@@ -1,4 +1,18 @@
 import pytest
+from pydantic import ValidationError
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update
+
+from app import crud
+from app.core.auth import create_access_token
+from app.core.cache import principal_cache, token_cache
+from app.core.hashing import hashing_pool
+from app.core.revocation import revoked_tokens
+from app.core.config import Settings
+from app.core.throttle import LoginThrottle, TokenBucketStore, login_throttle
+from app.models import Loan, LoanStatus, User
+from app.services import invalidate_stale_principals, sync_revoked_tokens
+from app.tests.conftest import mock_admin_email, mock_admin_password
 
 @pytest.mark.anyio
 async def test_signup(client):
@@ -24,4 +38,210 @@ async def test_login(client, mock_user):
     assert response.status_code == 200
     data = response.json()
     token = data['access_token']
-    assert isinstance(token, str)
\ No newline at end of file
+    assert isinstance(token, str)
+
+@pytest.mark.anyio
+async def test_login_hashing_pool_full(client, mock_user, monkeypatch):
+    monkeypatch.setattr(hashing_pool, 'max_pending', 0)
+    form_data = {
+        'email': mock_user.email,
+        'password': 'mockuser123'
+    }
+    response = await client.post(f'{client.base_url}/users/login', data=form_data)
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == '1'
+
+@pytest.mark.anyio
+async def test_reconcile_counters(admin_auth_client, test_session, mock_user, mock_loan):
+    # the fixture loan is the user's only open loan, knock the counters off
+    await test_session.execute(
+        update(User)
+        .where(User.user_uid == mock_user.user_uid)
+        .values(active_loans_count=7, active_holds_count=2)
+    )
+    response = await admin_auth_client.post(f'{admin_auth_client.base_url}/users/reconcile-counters')
+    assert response.status_code == 200
+    assert response.json() == {'corrected': 1}
+
+    counters = (await test_session.execute(
+        select(User.active_loans_count, User.active_holds_count)
+        .where(User.user_uid == mock_user.user_uid)
+    )).one()
+    assert tuple(counters) == (1, 0)
+
+    response = await admin_auth_client.post(f'{admin_auth_client.base_url}/users/reconcile-counters')
+    assert response.json() == {'corrected': 0}
+
+
+@pytest.mark.anyio
+async def test_loan_history(auth_client, test_session, mock_admin, mock_user):
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    loans = [
+        Loan(
+            user_uid=mock_user.user_uid,
+            bk_copy_barcode=f'COPY-{i}',
+            checked_out_at=start + timedelta(days=i // 2), # pairs share a timestamp
+            status=LoanStatus.RETURNED if i % 2 else LoanStatus.ACTIVE,
+        )
+        for i in range(5)
+    ]
+    test_session.add_all(loans)
+    await test_session.flush()
+    base_url = auth_client.base_url
+
+    seen = []
+    cursor = None
+    while True:
+        params = {'limit': 2, **({'cursor': cursor} if cursor else {})}
+        response = await auth_client.get(f'{base_url}/users/me/loans', params=params)
+        assert response.status_code == 200
+        data = response.json()
+        seen += [loan['bk_copy_barcode'] for loan in data['loans']]
+        cursor = data['next_cursor']
+        if not cursor:
+            break
+    # newest first, ties broken by id, every loan exactly once
+    assert seen == ['COPY-4', 'COPY-3', 'COPY-2', 'COPY-1', 'COPY-0']
+
+    response = await auth_client.get(
+        f'{base_url}/users/me/loans', params={'status': 'returned'}
+    )
+    assert [loan['bk_copy_barcode'] for loan in response.json()['loans']] == ['COPY-3', 'COPY-1']
+    # a cursor only continues the listing it came from
+    response = await auth_client.get(
+        f'{base_url}/users/me/loans', params={'limit': 1}
+    )
+    response = await auth_client.get(
+        f'{base_url}/users/me/loans',
+        params={'status': 'active', 'cursor': response.json()['next_cursor']},
+    )
+    assert response.status_code == 400
+
+    # patrons cannot read each other's history, staff can
+    url = f'{base_url}/users/{mock_user.user_uid}/loans'
+    response = await auth_client.get(url)
+    assert response.status_code == 403
+    response = await auth_client.post(
+        f'{base_url}/users/login',
+        data={'email': mock_admin_email, 'password': mock_admin_password},
+    )
+    headers = {'Authorization': f"Bearer {response.json()['access_token']}"}
+    response = await auth_client.get(url, params={'status': 'active'}, headers=headers)
+    assert len(response.json()['loans']) == 3
+
+@pytest.mark.anyio
+async def test_principal_cache(auth_client, test_session, mock_user):
+    url = f'{auth_client.base_url}/users/me/loans'
+    hits = principal_cache.hits
+    assert (await auth_client.get(url)).status_code == 200
+    assert (await auth_client.get(url)).status_code == 200
+    assert principal_cache.hits == hits + 1
+
+    # deactivating through crud marks the principal stale for the service layer
+    user = await crud.get_user_by_uid(test_session, mock_user.user_uid)
+    await crud.update_user(test_session, user, {'is_active': False})
+    await test_session.commit()
+    assert (await auth_client.get(url)).status_code == 200 # still cached
+    await invalidate_stale_principals(test_session)
+    response = await auth_client.get(url)
+    assert response.status_code == 400
+    assert response.json()['detail'] == 'Inactive user'
+
+@pytest.mark.anyio
+async def test_token_verification(client, mock_user):
+    url = f'{client.base_url}/users/me/loans'
+    data = {'sub': mock_user.email, 'user_uid': mock_user.user_uid}
+    token = create_access_token(data, mock_user, timedelta(minutes=5))
+    headers = {'Authorization': f'Bearer {token}'}
+    hits = token_cache.hits
+    assert (await client.get(url, headers=headers)).status_code == 200
+    assert (await client.get(url, headers=headers)).status_code == 200
+    assert token_cache.hits == hits + 1
+
+    expired = create_access_token(data, mock_user, timedelta(minutes=-1))
+    response = await client.get(url, headers={'Authorization': f'Bearer {expired}'})
+    assert response.status_code == 401
+    assert response.json()['detail'] == 'Token has expired. Please login again'
+
+    tampered = token[:-2] + ('AA' if token[-2:] != 'AA' else 'BB')
+    response = await client.get(url, headers={'Authorization': f'Bearer {tampered}'})
+    assert response.status_code == 401
+    assert response.json()['detail'] == 'Invalid credentials'
+
+@pytest.mark.anyio
+async def test_login_throttled(client, mock_admin, mock_user):
+    url = f'{client.base_url}/users/login'
+    form_data = {'email': mock_admin_email, 'password': 'wrong-password'}
+    for _ in range(5):
+        response = await client.post(url, data=form_data)
+        assert response.status_code == 401
+    throttled = login_throttle.throttled_email
+    response = await client.post(url, data=form_data)
+    assert response.status_code == 429
+    assert int(response.headers['retry-after']) >= 1
+    assert login_throttle.throttled_email == throttled + 1
+
+    # other accounts from the same client are still let through
+    form_data = {'email': mock_user.email, 'password': 'mockuser123'}
+    response = await client.post(url, data=form_data)
+    assert response.status_code == 200
+
+@pytest.mark.anyio
+async def test_login_throttle_charges_only_allowed_attempts():
+    # a stopped clock, so no bucket refills during the test
+    throttle = LoginThrottle(TokenBucketStore(100, clock=lambda: 0.0))
+    for _ in range(5):
+        assert await throttle.check('a@example.com', '10.0.0.1') is None
+    for _ in range(10):
+        assert await throttle.check('a@example.com', '10.0.0.1')
+    assert throttle.throttled_email == 10
+    # the refused attempts left the 15 remaining IP tokens alone
+    for i in range(15):
+        assert await throttle.check(f'{i}@example.com', '10.0.0.1') is None
+    assert await throttle.check('b@example.com', '10.0.0.1')
+    assert throttle.throttled_ip == 1
+
+def test_login_rates_must_be_positive():
+    with pytest.raises(ValidationError):
+        Settings(login_ip_per_minute=0)
+    with pytest.raises(ValidationError):
+        Settings(login_email_per_minute=-1)
+
+@pytest.mark.anyio
+async def test_refresh_and_logout(client, test_session, mock_user):
+    base_url = client.base_url
+    form_data = {'email': mock_user.email, 'password': 'mockuser123'}
+    tokens = (await client.post(f'{base_url}/users/login', data=form_data)).json()
+    refresh_token = tokens['refresh_token']
+
+    # a refresh token is not accepted as a bearer token
+    response = await client.get(
+        f'{base_url}/users/me/loans', headers={'Authorization': f'Bearer {refresh_token}'}
+    )
+    assert response.status_code == 401
+
+    response = await client.post(f'{base_url}/users/refresh', data={'refresh_token': refresh_token})
+    assert response.status_code == 200
+    rotated = response.json()
+    assert rotated['refresh_token'] != refresh_token
+    # the presented refresh token was rotated out
+    response = await client.post(f'{base_url}/users/refresh', data={'refresh_token': refresh_token})
+    assert response.status_code == 401
+
+    headers = {'Authorization': f"Bearer {rotated['access_token']}"}
+    assert (await client.get(f'{base_url}/users/me/loans', headers=headers)).status_code == 200
+    response = await client.post(
+        f'{base_url}/users/logout', data={'refresh_token': rotated['refresh_token']}, headers=headers
+    )
+    assert response.json() == {'revoked': 2}
+    assert (await client.get(f'{base_url}/users/me/loans', headers=headers)).status_code == 401
+    response = await client.post(
+        f'{base_url}/users/refresh', data={'refresh_token': rotated['refresh_token']}
+    )
+    assert response.status_code == 401
+
+    # a rebuilt filter still knows every unexpired access token revocation,
+    # the two revoked refresh tokens are left to the table
+    assert await sync_revoked_tokens(test_session) == {'pruned': 0, 'revoked': 1}
+    assert revoked_tokens.stats()['entries'] == 1
+    assert (await client.get(f'{base_url}/users/me/loans', headers=headers)).status_code == 401
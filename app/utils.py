@@ -1,8 +1,18 @@
+import base64
+import binascii
+import codecs
+import csv
+import hashlib
+import json
+import re
 import string
 import enum
 import secrets
+import zlib
 from logging import Logger
 from datetime import datetime, timezone, timedelta
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import AsyncIterator
 from fastapi import Request
 
 logger = Logger(__name__)
@@ -27,16 +37,14 @@ def safe_datetime_compare(dt1: datetime, dt2: datetime) -> bool:
 
 def generate_book_copy_barcode(base_barcode, serial):
     try:
-        str_serial = str(serial).zfill(3)
+        str_serial = str(serial).zfill(6)
         return f"COPY-{base_barcode}-{str_serial}"
     except ValueError as e:
         logger.warning(f"ValueError: {e}")
 
 
 def generate_barcode(serial: str | None = None):
-    digits = string.digits
-    serial = "".join([secrets.choice(digits) for _ in range(7)])
-    return f"BK-{serial}"
+    return f"BK-{secrets.randbelow(10**7):07d}"
 
 
 def generate_random_id():
@@ -77,12 +85,23 @@ def generate_schedule_id():
     return f"SC-{id}"
 
 
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
 def default_loan_due_date():
     return datetime.now(timezone.utc).replace(
         minute=0, second=0, microsecond=0
     ) + timedelta(days=7)
 
 
+def default_schedule_expiry(now: datetime | None = None, cutoff_hour: int = 18):
+    """Holds last until the next `cutoff_hour`:00 UTC, today's if not yet past."""
+    now = now or datetime.now(timezone.utc)
+    cutoff = now.replace(hour=cutoff_hour, minute=0, second=0, microsecond=0)
+    return cutoff if now < cutoff else cutoff + timedelta(days=1)
+
+
 def reraise_exceptions(request: Request):
     if hasattr(request.state, "exceptions"):
         exc: list | None = getattr(request.state, "exceptions")
@@ -104,3 +123,144 @@ def map_bk_copy_status(value: str):
         return BkCopyStatus.DAMAGED
     else:
         return BkCopyStatus.BORROWED
+
+
+def encode_cursor(data: dict) -> str:
+    raw = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict | None:
+    """
+    Reverse of `encode_cursor`. Returns None for anything that is not a
+    cursor this api handed out, so callers can answer with a 400.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def search_terms(query: str) -> list[str]:
+    """
+    Splits free text typed by a patron into plain word tokens, dropping any
+    operator syntax so it can't break (or abuse) the full-text query.
+    """
+    return re.findall(r"\w+", query.lower())
+
+
+async def iter_text_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Turns a stream of raw body chunks into decoded lines without holding
+    more than one partial line in memory.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def parse_import_rows(
+    lines: AsyncIterator[str], fmt: str
+) -> AsyncIterator[tuple[int, dict | None]]:
+    """
+    Yields `(row_number, fields)` for every data row of a CSV (header first)
+    or JSONL catalog. Rows that can't be parsed come through as None so the
+    caller can report them. CSV records are expected on a single line.
+    """
+    row_no = 0
+    header = None
+    async for line in lines:
+        if not line.strip():
+            continue
+        if fmt == "jsonl":
+            row_no += 1
+            try:
+                data = json.loads(line)
+            except ValueError:
+                data = None
+            yield row_no, data if isinstance(data, dict) else None
+            continue
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        row_no += 1
+        if len(values) != len(header):
+            yield row_no, None
+            continue
+        yield row_no, {k: v for k, v in zip(header, values) if v != ""}
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+async def buffer_chunks(
+    parts: AsyncIterator[str], size: int = 64 * 1024
+) -> AsyncIterator[bytes]:
+    """Coalesces small text parts into ~`size` byte chunks for streaming."""
+    buffer, buffered = [], 0
+    async for part in parts:
+        data = part.encode("utf-8")
+        buffer.append(data)
+        buffered += len(data)
+        if buffered >= size:
+            yield b"".join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def as_utc(dt: datetime) -> datetime:
+    # sqlite hands back naive timestamps, they are UTC
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha256(":".join(str(p) for p in parts).encode("utf-8"))
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def http_date(dt: datetime) -> str:
+    return format_datetime(as_utc(dt).astimezone(timezone.utc), usegmt=True)
+
+
+def is_not_modified(request: Request, etag: str, last_modified: datetime) -> bool:
+    """
+    Evaluates If-None-Match / If-Modified-Since (the latter only when no
+    If-None-Match was sent) against the current validators.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = as_utc(parsedate_to_datetime(if_modified_since))
+        except (TypeError, ValueError):
+            return False
+        return as_utc(last_modified).replace(microsecond=0) <= since
+    return False
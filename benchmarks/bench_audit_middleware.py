@@ -0,0 +1,106 @@
+"""
+Requests per second through the app with and without AuditMiddleware, for
+an authenticated GET (/books/fetch) and a form POST to /users/refresh,
+urlencoded and multipart with a small file part (rejected since it is
+given an access token). Entries go
+to the audit writer as they would in production. Run from the repo root:
+
+    python benchmarks/bench_audit_middleware.py
+"""
+
+# ruff: noqa: E402
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_audit.db")
+os.environ.update(
+    DATABASE_URL=f"sqlite+aiosqlite:///{DB_PATH}",
+    TEST_MODE="True",
+    HASH_ALGORITHM=os.environ.get("HASH_ALGORITHM") or "argon2",
+    JWT_ALGORITHM=os.environ.get("JWT_ALGORITHM") or "HS256",
+    SECRET_KEY=os.environ.get("SECRET_KEY") or "bench-secret",
+)
+
+from httpx import ASGITransport, AsyncClient
+
+from app.core.audit import audit_writer
+from app.core.auth import create_access_token
+from app.core.database import AsyncSessionLocal, Base, engine
+from app.core.middleware import AuditMiddleware
+from app.crud import rebuild_availability
+from app.models import Book, User
+from app.main import app
+
+REQUESTS = 2_000
+ISBN = 9780000000001
+
+
+async def seed() -> str:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as session:
+        user = User(full_name="Bench Reader", email="reader@example.com", password="x")
+        session.add(user)
+        session.add(Book(title="bench", author="bench", location="b0", isbn=ISBN))
+        await session.flush()
+        await rebuild_availability(session)
+        await session.commit()
+    data = {"sub": user.email, "user_uid": user.user_uid, "is_staff": False}
+    return create_access_token(data, user, timedelta(minutes=30))
+
+
+async def rate(asgi_app, label: str, token: str):
+    transport = ASGITransport(app=asgi_app)
+    async with AsyncClient(transport=transport, base_url="http://bench") as client:
+        headers = {"Authorization": f"Bearer {token}"}
+        for name, call in (
+            (
+                "GET fetch",
+                lambda: client.get(
+                    "/books/fetch", params={"isbn": ISBN}, headers=headers
+                ),
+            ),
+            (
+                "POST form",
+                lambda: client.post(
+                    "/users/refresh", data={"refresh_token": token}
+                ),
+            ),
+            (
+                "POST multi",
+                lambda: client.post(
+                    "/users/refresh",
+                    data={"refresh_token": token},
+                    files={"attachment": ("notes.txt", b"x" * 4096, "text/plain")},
+                ),
+            ),
+        ):
+            for _ in range(50):  # warm up
+                await call()
+            start = time.perf_counter()
+            for _ in range(REQUESTS):
+                await call()
+            elapsed = time.perf_counter() - start
+            print(f"{label:15} {name:10} {REQUESTS / elapsed:8.0f} req/s")
+
+
+async def main():
+    engine.echo = False
+    token = await seed()
+    audit_writer.start()
+    await rate(app, "middleware off", token)
+    await rate(AuditMiddleware(app), "middleware on", token)
+    await audit_writer.stop()
+    print(f"audit_writer: {audit_writer.stats()}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
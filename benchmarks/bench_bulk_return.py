@@ -0,0 +1,134 @@
+"""
+Times returning 1,000 loaned copies one request at a time through
+POST /books/loan-return against a single POST /books/loan-returns, on a
+file backed SQLite database. Run from the repo root:
+
+    python benchmarks/bench_bulk_return.py
+"""
+
+# ruff: noqa: E402
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_returns.db")
+os.environ.update(
+    DATABASE_URL=f"sqlite+aiosqlite:///{DB_PATH}",
+    TEST_MODE="True",
+    HASH_ALGORITHM=os.environ.get("HASH_ALGORITHM") or "argon2",
+    JWT_ALGORITHM=os.environ.get("JWT_ALGORITHM") or "HS256",
+    SECRET_KEY=os.environ.get("SECRET_KEY") or "bench-secret",
+)
+
+from httpx import ASGITransport, AsyncClient
+
+from app.core.auth import hash_password
+from app.core.database import AsyncSessionLocal, Base, engine
+from app.crud import rebuild_availability
+from app.models import BkCopyStatus, Book, BookCopy, Loan, User
+from app.main import app
+
+RETURNS = 1_000
+PATRONS = 250
+
+
+async def seed(name: str, overdue: bool) -> list[tuple[str, str]]:
+    """Lends RETURNS copies of a fresh book; returns (loan_id, barcode) pairs."""
+    now = datetime.now(timezone.utc)
+    async with AsyncSessionLocal() as session:
+        session.add(Book(title=name, author="bench", location="b0", isbn=name))
+        users = [
+            User(
+                full_name=f"{name} patron {i}",
+                email=f"{name}-{i}@example.com",
+                password="x",
+            )
+            for i in range(PATRONS)
+        ]
+        copies = [
+            BookCopy(
+                book_isbn=name,
+                serial=i,
+                copy_barcode=f"{name}-{i:06d}",
+                status=BkCopyStatus.BORROWED,
+            )
+            for i in range(RETURNS)
+        ]
+        session.add_all(users + copies)
+        await session.flush()
+        loans = [
+            Loan(
+                user_uid=users[i % PATRONS].user_uid,
+                bk_copy_barcode=copy.copy_barcode,
+                # every other loan is two days overdue
+                due_at=now - timedelta(days=2)
+                if overdue and i % 2
+                else now + timedelta(days=14),
+            )
+            for i, copy in enumerate(copies)
+        ]
+        session.add_all(loans)
+        await session.flush()
+        await rebuild_availability(session)
+        await session.commit()
+        return [(loan.loan_id, loan.bk_copy_barcode) for loan in loans]
+
+
+async def main():
+    engine.echo = False
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as session:
+        session.add(
+            User(
+                full_name="Bench Admin",
+                email="bench@example.com",
+                password=hash_password("benchpassword"),
+                is_staff=True,
+                is_superuser=True,
+            )
+        )
+        await session.commit()
+    # the single return endpoint is only timed on on-time loans
+    single = await seed("bench-single", overdue=False)
+    bulk = await seed("bench-bulk", overdue=True)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://bench") as client:
+        response = await client.post(
+            "/users/login",
+            data={"email": "bench@example.com", "password": "benchpassword"},
+        )
+        token = response.json()["access_token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+
+        start = time.perf_counter()
+        for loan_id, barcode in single:
+            await client.post(
+                "/books/loan-return",
+                data={"loan_id": loan_id, "bk_copy_barcode": barcode},
+            )
+        elapsed = time.perf_counter() - start
+        print(f"{RETURNS} single returns: {elapsed * 1000:9.1f} ms")
+
+        start = time.perf_counter()
+        response = await client.post(
+            "/books/loan-returns", json={"barcodes": [b for _, b in bulk]}
+        )
+        elapsed = time.perf_counter() - start
+        data = response.json()
+        print(
+            f"{RETURNS} bulk returns:   {elapsed * 1000:9.1f} ms "
+            f"(returned={data['returned']}, fines={data['total_fines']})"
+        )
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""
+Times POST /books/generate-copies for 1k/10k/50k copies against a file
+backed SQLite database. Run from the repo root:
+
+    python benchmarks/bench_copy_generation.py
+"""
+
+# ruff: noqa: E402
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_copies.db")
+os.environ.update(
+    DATABASE_URL=f"sqlite+aiosqlite:///{DB_PATH}",
+    TEST_MODE="True",
+    HASH_ALGORITHM=os.environ.get("HASH_ALGORITHM") or "argon2",
+    JWT_ALGORITHM=os.environ.get("JWT_ALGORITHM") or "HS256",
+    SECRET_KEY=os.environ.get("SECRET_KEY") or "bench-secret",
+)
+
+from httpx import ASGITransport, AsyncClient
+
+from app.core.auth import hash_password
+from app.core.database import AsyncSessionLocal, Base, engine
+from app.main import app
+from app.models import Book, User
+
+QUANTITIES = (1_000, 10_000, 50_000)
+
+
+async def main():
+    engine.echo = False
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as session:
+        session.add(
+            User(
+                full_name="Bench Admin",
+                email="bench@example.com",
+                password=hash_password("benchpassword"),
+                is_staff=True,
+                is_superuser=True,
+            )
+        )
+        for quantity in QUANTITIES:
+            session.add(
+                Book(
+                    title=f"bench-{quantity}",
+                    author="bench",
+                    location="b0",
+                    isbn=f"bench-{quantity}",
+                )
+            )
+        await session.commit()
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://bench") as client:
+        response = await client.post(
+            "/users/login",
+            data={"email": "bench@example.com", "password": "benchpassword"},
+        )
+        token = response.json()["access_token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+
+        for quantity in QUANTITIES:
+            start = time.perf_counter()
+            response = await client.post(
+                "/books/generate-copies",
+                data={"isbn": f"bench-{quantity}", "quantity": quantity},
+            )
+            elapsed = time.perf_counter() - start
+            print(
+                f"{quantity:>6} copies: {elapsed * 1000:9.1f} ms "
+                f"({quantity / elapsed:,.0f} copies/s) status={response.status_code}"
+            )
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,129 @@
+"""
+Measures GET /books/fetch latency while a storm of concurrent logins is
+being served, once with password verification running inline on the event
+loop (the old behaviour) and once through the hashing worker pool. Run from
+the repo root:
+
+    python benchmarks/bench_login_storm.py
+"""
+
+# ruff: noqa: E402
+
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_logins.db")
+os.environ.update(
+    DATABASE_URL=f"sqlite+aiosqlite:///{DB_PATH}",
+    TEST_MODE="True",
+    HASH_ALGORITHM=os.environ.get("HASH_ALGORITHM") or "argon2",
+    JWT_ALGORITHM=os.environ.get("JWT_ALGORITHM") or "HS256",
+    SECRET_KEY=os.environ.get("SECRET_KEY") or "bench-secret",
+    HASHING_MAX_PENDING="1000",
+)
+
+from httpx import ASGITransport, AsyncClient
+
+from app.core import auth
+from app.core.auth import hash_password, verify_password
+from app.core.database import AsyncSessionLocal, Base, engine
+from app.core.hashing import hashing_pool
+from app.crud import rebuild_availability
+from app.models import Book, User
+from app.main import app
+
+LOGINS = 200
+LOGIN_CONCURRENCY = 20
+FETCHES = 300
+ISBN = 9780000000001
+
+
+async def inline_verify(plain_password: str, hashed_password: str):
+    return verify_password(plain_password, hashed_password)
+
+
+async def seed():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as session:
+        session.add(
+            User(
+                full_name="Bench Reader",
+                email="reader@example.com",
+                password=hash_password("benchpassword"),
+            )
+        )
+        session.add(Book(title="bench", author="bench", location="b0", isbn=ISBN))
+        await session.flush()
+        await rebuild_availability(session)
+        await session.commit()
+
+
+async def storm(client: AsyncClient):
+    semaphore = asyncio.Semaphore(LOGIN_CONCURRENCY)
+
+    async def login():
+        async with semaphore:
+            await client.post(
+                "/users/login",
+                data={"email": "reader@example.com", "password": "benchpassword"},
+            )
+
+    await asyncio.gather(*(login() for _ in range(LOGINS)))
+
+
+async def fetches(client: AsyncClient) -> list[float]:
+    latencies = []
+    for _ in range(FETCHES):
+        start = time.perf_counter()
+        await client.get("/books/fetch", params={"isbn": ISBN})
+        latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0)
+    return latencies
+
+
+async def run(client: AsyncClient, label: str):
+    storm_task = asyncio.create_task(storm(client))
+    start = time.perf_counter()
+    latencies = await fetches(client)
+    await storm_task
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p50 = statistics.median(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(
+        f"{label:8} fetch p50 {p50:7.1f} ms  p99 {p99:7.1f} ms  "
+        f"max {latencies[-1]:7.1f} ms  ({LOGINS} logins, {elapsed:5.1f} s)"
+    )
+
+
+async def main():
+    engine.echo = False
+    await seed()
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://bench") as client:
+        response = await client.post(
+            "/users/login",
+            data={"email": "reader@example.com", "password": "benchpassword"},
+        )
+        token = response.json()["access_token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+
+        pooled = auth.verify_password_async
+        auth.verify_password_async = inline_verify
+        await run(client, "inline")
+        auth.verify_password_async = pooled
+        await run(client, "pooled")
+        print(f"pool: {hashing_pool.stats()}")
+    hashing_pool.shutdown()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+"""
+Seeds a file backed SQLite database with open loans (half of them past
+due) and times one overdue sweep over them, along with the slowest
+batch, i.e. the longest any batch held its write transaction. Run from
+the repo root:
+
+    python benchmarks/bench_overdue_sweep.py [loans]
+"""
+
+# ruff: noqa: E402
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_overdue.db")
+os.environ.update(
+    DATABASE_URL=f"sqlite+aiosqlite:///{DB_PATH}",
+    TEST_MODE="True",
+    HASH_ALGORITHM=os.environ.get("HASH_ALGORITHM") or "argon2",
+    JWT_ALGORITHM=os.environ.get("JWT_ALGORITHM") or "HS256",
+    SECRET_KEY=os.environ.get("SECRET_KEY") or "bench-secret",
+)
+
+from sqlalchemy import event, insert
+
+from app.core.database import AsyncSessionLocal, Base, engine
+from app.models import Loan, LoanStatus, User
+from app.services import sweep_overdue_loans
+
+LOANS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+PATRONS = 10_000
+SEED_CHUNK = 50_000
+
+
+async def seed():
+    now = datetime.now(timezone.utc)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(
+            insert(User),
+            [
+                {
+                    "user_uid": f"patron-{i}",
+                    "full_name": f"patron {i}",
+                    "email": f"patron-{i}@example.com",
+                    "password": "x",
+                    "card_number": f"card-{i}",
+                    "fine_balance": 0,
+                }
+                for i in range(PATRONS)
+            ],
+        )
+        for start in range(0, LOANS, SEED_CHUNK):
+            await conn.execute(
+                insert(Loan),
+                [
+                    {
+                        "loan_id": f"loan-{i}",
+                        "user_uid": f"patron-{i % PATRONS}",
+                        "bk_copy_barcode": f"copy-{i}",
+                        "status": LoanStatus.ACTIVE,
+                        # odd loans are 1-30 days overdue, even ones not due yet
+                        "due_at": now - timedelta(days=1 + i % 30)
+                        if i % 2
+                        else now + timedelta(days=14),
+                        "fined_days": 0,
+                    }
+                    for i in range(start, min(start + SEED_CHUNK, LOANS))
+                ],
+            )
+
+
+async def main():
+    engine.echo = False
+    start = time.perf_counter()
+    await seed()
+    print(f"seeded {LOANS:,} loans in {time.perf_counter() - start:.1f} s")
+
+    async with AsyncSessionLocal() as session:
+        commits = []
+        event.listen(
+            session.sync_session,
+            "after_commit",
+            lambda s: commits.append(time.perf_counter()),
+        )
+        start = time.perf_counter()
+        totals = await sweep_overdue_loans(session)
+        elapsed = time.perf_counter() - start
+        batch_times = [b - a for a, b in zip([start] + commits, commits)]
+        print(
+            f"first sweep:  {elapsed:6.1f} s, {len(batch_times)} batches, "
+            f"slowest batch {max(batch_times) * 1000:.0f} ms, {totals}"
+        )
+
+        start = time.perf_counter()
+        totals = await sweep_overdue_loans(session)
+        print(f"second sweep: {time.perf_counter() - start:6.1f} s, {totals}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
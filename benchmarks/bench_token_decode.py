@@ -0,0 +1,74 @@
+"""
+Per-request bearer token overhead: the old path decoded and verified the
+JWT twice (audit middleware, then get_current_user); now the request
+shares one AuthContext and repeat tokens hit the verified-token cache.
+Run from the repo root:
+
+    python benchmarks/bench_token_decode.py
+"""
+
+# ruff: noqa: E402
+
+import asyncio
+import os
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.update(
+    DATABASE_URL=os.environ.get("DATABASE_URL") or "sqlite+aiosqlite://",
+    HASH_ALGORITHM=os.environ.get("HASH_ALGORITHM") or "argon2",
+    JWT_ALGORITHM=os.environ.get("JWT_ALGORITHM") or "HS256",
+    SECRET_KEY=os.environ.get("SECRET_KEY") or "bench-secret",
+)
+
+from starlette.requests import Request
+
+from app.core.auth import create_access_token, decode_token, get_auth_context
+from app.core.cache import token_cache
+from app.models import User
+
+REQUESTS = 20_000
+
+
+def make_request(token: str) -> Request:
+    headers = [(b"authorization", f"Bearer {token}".encode())]
+    return Request({"type": "http", "headers": headers, "state": {}})
+
+
+async def old_path(token: str):
+    make_request(token)
+    decode_token(token, False)  # AuditMiddleware.get_actor_claims
+    decode_token(token)  # get_current_user
+
+
+async def new_path(token: str):
+    request = make_request(token)
+    await get_auth_context(request)  # AuditMiddleware
+    await get_auth_context(request)  # get_current_user
+
+
+async def timed(label: str, path, token: str):
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        await path(token)
+    per_request = (time.perf_counter() - start) / REQUESTS * 1e6
+    print(f"{label:24} {per_request:7.1f} us/request")
+
+
+async def main():
+    user = User(email="bench@example.com", user_uid="U-BENCH", is_staff=False)
+    data = {"sub": user.email, "user_uid": user.user_uid, "is_staff": False}
+    token = create_access_token(data, user, timedelta(minutes=15))
+    await timed("decode twice (before)", old_path, token)
+    token_cache.maxsize = 0
+    await timed("shared, cache off", new_path, token)
+    token_cache.maxsize = 10_000
+    await timed("shared, cache on", new_path, token)
+    print(f"token_cache: {token_cache.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,53 @@
+# ruff: noqa: E402
+
+import argparse
+import asyncio
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.core.config import Settings
+from app.core.database import AsyncSessionLocal, Base, engine
+from app.services import import_books
+from app.utils import parse_import_rows
+
+settings = Settings()
+
+
+async def read_lines(path: Path):
+    with path.open(encoding="utf-8-sig", newline="") as f:
+        for line in f:
+            yield line.rstrip("\r\n")
+
+
+async def main(path: Path, fmt: str, batch_size: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as session:
+        report = await import_books(
+            session, parse_import_rows(read_lines(path), fmt), batch_size
+        )
+    await engine.dispose()
+
+    print(
+        f"inserted: {report['inserted']} | conflicts: {report['num_conflicts']} "
+        f"| invalid: {report['num_invalid']}"
+    )
+    for kind in ("conflicts", "invalid"):
+        for issue in report[kind]:
+            print(f"  row {issue['row']} ({issue['isbn']}): {issue['detail']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import a book catalog")
+    parser.add_argument("path", type=Path, help="CSV (with header) or JSONL file")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default=None)
+    parser.add_argument("--batch-size", type=int, default=settings.import_batch_size)
+    args = parser.parse_args()
+
+    fmt = args.format or (
+        "jsonl" if args.path.suffix in (".jsonl", ".ndjson") else "csv"
+    )
+    asyncio.run(main(args.path, fmt, args.batch_size))